@@ -1,16 +1,21 @@
-from wpilib import DriverStation
+import math
+
+from wpilib import DriverStation, RobotBase
 import wpimath.units as units
-from wpimath.geometry import Pose2d
 
 import pathplannerlib.auto as auto
-import pathplannerlib.config as config
+import pathplannerlib.config as pplconfig
 import pathplannerlib.path as pplpath
+from pathplannerlib.pathfinding import Pathfinding
+from pathplannerlib.logging import PathPlannerLogging
+from wpimath.geometry import Pose2d
 
-# Load constants from the json file
-import json
-with open('constants.json') as jsonf:
-	constants = json.load(jsonf)
-	jsonf.close()
+from config import robotconfig
+from autonomous.pathcache import PathCache
+from autonomous.pathfinder import NavGrid, GridPathfinder
+from extras.debugmsgs import *
+from extras.telemetry import telemetry
+from extras.worker import worker
 
 class PPL:
     '''
@@ -20,44 +25,77 @@ class PPL:
     Uses pathplannerlib  
     '''
     def __init__(self, robot: object):
-        self.paths = {} # Dictionary to store data to easilly get a path later on
+        self.paths = {} # Dictionary to store data to easilly get a path later on (path name -> path following command)
+        constants = robotconfig.get().pathplanner
 
         self.pathFollowerConfig = auto.AutoBuilder.configureHolonomic(
-            robot.drivetrain.getOdometry(), # Robot pose supplier
+            robot.drivetrain.getOdometry, # Robot pose supplier (odometry fused with vision)
 
-            robot.drivetrain.resetOdometry(Pose2d()), # Method to reset odometry (will be called if your auto has a starting pose)
+            robot.drivetrain.resetOdometry, # Method to reset odometry (will be called if your auto has a starting pose)
 
-            robot.drivetrain.getRelativeSpeeds(), # ChassisSpeeds supplier. MUST BE ROBOT RELATIVE
+            robot.drivetrain.getRelativeSpeeds, # ChassisSpeeds supplier. MUST BE ROBOT RELATIVE
 
-            robot.drivetrain.drive( # Method that will drive the robot given ROBOT RELATIVE ChassisSpeeds
-                robot.drivetrain.speeds.vx,
-                robot.drivetrain.speeds.vy,
-                robot.drivetrain.speeds.omega,
-                False,
-                robot.getPeriod()
-            ),
+            lambda speeds: robot.drivetrain.driveRobotRelative(speeds, robot.getPeriod()), # Method that will drive the robot given ROBOT RELATIVE ChassisSpeeds
             
             # Set up path follower
             auto.HolonomicPathFollowerConfig(
-                config.PIDConstants(
-                    constants["PATHPLANNER_CONSTANTS"]["TRANSLATION_PID_CONSTANTS"][0],
-                    constants["PATHPLANNER_CONSTANTS"]["TRANSLATION_PID_CONSTANTS"][1],
-                    constants["PATHPLANNER_CONSTANTS"]["TRANSLATION_PID_CONSTANTS"][2]
-                ),
-                config.PIDConstants(
-                    constants["PATHPLANNER_CONSTANTS"]["ROTATION_PID_CONSTANTS"][0],
-                    constants["PATHPLANNER_CONSTANTS"]["ROTATION_PID_CONSTANTS"][1],
-                    constants["PATHPLANNER_CONSTANTS"]["ROTATION_PID_CONSTANTS"][2]
-                ),
-                units.meters_per_second(constants["PATHPLANNER_CONSTANTS"]["MAX_SPEED"]),
-                units.meters(constants["PATHPLANNER_CONSTANTS"]["DRIVE_BASE_RADIUS"]),
-                config.ReplanningConfig()
+                pplconfig.PIDConstants(*constants.translationPID),
+                pplconfig.PIDConstants(*constants.rotationPID),
+                units.meters_per_second(constants.maxSpeed),
+                units.meters(constants.driveBaseRadius),
+                pplconfig.ReplanningConfig()
             ),
 
-            self.shouldFlipPath(), # Supplier to control path flipping based on alliance color
+            self.shouldFlipPath, # Supplier to control path flipping based on alliance color
             robot.drivetrain # Reference to drivetrain component to set requirements
         )
 
+        # Pose the path follower is driving towards, sent with the drivetrain telemetry (PathPlanner sends its own
+        # '/PathPlanner' topics unbatched)
+        telemetryConfig = robotconfig.get().telemetry
+        targetPoseTopic = telemetry.structTopic('Autonomous/targetPose', Pose2d, (telemetryConfig.positionThreshold, telemetryConfig.positionThreshold, telemetryConfig.angleThreshold), telemetryConfig.maxRate)
+        PathPlannerLogging.setLogTargetPoseCallback(lambda pose: targetPoseTopic.set(pose.X(), pose.Y(), pose.rotation().radians()))
+
+        # Every path is parsed and its trajectories generated before autonomous (see 'warmup()')
+        cacheConstants = robotconfig.get().pathCache
+        cacheDirectory = None
+        if cacheConstants.persist:
+            cacheDirectory = cacheConstants.directory or ('pathcache' if RobotBase.isSimulation() else '/home/lvuser/pathcache')
+
+        # On-the-fly paths around the navgrid obstacles (used by 'AutoBuilder.pathfindToPose()' and 'SDRbt'), the grid
+        # is loaded on the pathfinder thread
+        robotRadius = constants.driveBaseRadius + robotconfig.get().pathfinder.clearanceMargin
+        self.pathfinder = GridPathfinder(lambda: NavGrid(robotRadius=robotRadius))
+        Pathfinding.setPathfinder(self.pathfinder)
+
+        self.pathCache = PathCache(cacheDirectory, cacheConstants.rotationTolerance)
+        self.pathCache.scan()
+        self.warmupBudget = cacheConstants.warmupBudget
+        self.warmupJob = None # Path cache warmup running on the background worker
+
+    def warmup(self): # Add this to the 'disabledPeriodic()' method
+        '''
+        Does a little of the path parsing/generation each call, and builds the path following commands once it is done
+        '''
+        if self.pathCache.isReady() and len(self.paths) == len(self.pathCache.names):
+            return
+
+        if worker.running:
+            # Parsed and generated on the worker, off the robot loop. The commands are built here once it is done
+            job = self.warmupJob
+            if job is None or (job.done() and not self.pathCache.isReady()):
+                self.warmupJob = worker.submit(self.pathCache.warmup, math.inf, name='Path cache warmup', modeScoped=False)
+                return
+            if not job.done():
+                return
+        elif not self.pathCache.warmup(self.warmupBudget):
+            return
+
+        for pathName in self.pathCache.names:
+            if pathName not in self.paths:
+                self.paths[pathName] = auto.AutoBuilder.followPath(self.pathCache.get(pathName))
+        successMsg(f'{len(self.paths)} paths ready for autonomous')
+
     def shouldFlipPath(self):
         '''
         Boolean supplier that controls when the path will be mirrored for the red alliance
@@ -71,13 +109,12 @@ class PPL:
         Runs a path baed on the file name of the path
         '''
 
-        #[OLD IMPLEMENTATION. KEEP HERE FOR TESTING]
-
-        path = pplpath.PathPlannerPath.fromPathFile(pathName)
+        command = self.paths.get(pathName) # Built during 'warmup()'
+        if command is None:
+            # Not warmed up yet (or a new path): load it now. Create a path following command using AutoBuilder. This will also trigger event markers.
+            command = self.paths[pathName] = auto.AutoBuilder.followPath(self.pathCache.get(pathName))
 
-        #Create a path following command using AutoBuilder. This will also trigger event markers.
-        
-        return auto.AutoBuilder.followPath(path)
+        return command
 
         #return auto.PathPlannerAuto(pathName)
 
@@ -85,6 +122,29 @@ class SDRbt:
     '''
     # SDRbt
     Self-driving robot
+
+    Drives to any pose on the field around the navgrid obstacles and the obstacles it is told about.
+    Paths are searched on the pathfinder thread, so replanning never holds up the robot loop
     '''
-    def __init__(self):
-        pass # TODO: Make it work :)
\ No newline at end of file
+    def __init__(self, robot: object):
+        self.robot = robot
+        constants = robotconfig.get()
+
+        self.constraints = pplpath.PathConstraints(
+            constants.pathplanner.maxSpeed,
+            constants.pathfinder.maxAcceleration,
+            constants.pathfinder.maxAngularVelocity,
+            constants.pathfinder.maxAngularAcceleration
+        )
+
+    def driveTo(self, pose, endVelocity: float = 0.0):
+        '''
+        Returns a command that drives to a field pose (blue alliance origin), replanning when the obstacles change
+        '''
+        return auto.AutoBuilder.pathfindToPose(pose, self.constraints, endVelocity)
+
+    def setObstacles(self, boxes: list):
+        '''
+        Sets the dynamic obstacles (list of (Translation2d, Translation2d) opposite corners) and replans from the current pose
+        '''
+        Pathfinding.setDynamicObstacles(boxes, self.robot.drivetrain.getOdometry().translation())
\ No newline at end of file
@@ -0,0 +1,339 @@
+# Parses every PathPlanner path and generates its trajectories before autonomous starts
+# Following a cached path at the start of autonomous is a dict lookup, with no json parsing or trajectory generation, and
+# its trajectory is a table sampled in constant time every tick (see 'autonomous/trajectorytable.py')
+# Paths profiled by 'autonomous/velocityprofile.py' follow that profile instead of the trajectory PathPlanner generates
+from collections import deque
+from time import perf_counter
+import hashlib
+import json
+import math
+import os
+import threading
+
+from wpilib import getDeployDirectory
+from wpimath.kinematics import ChassisSpeeds
+
+import pathplannerlib.path as pplpath
+import pathplannerlib.trajectory as ppltrajectory
+
+from autonomous.trajectorytable import TrajectoryTable, TableTrajectory, TABLES_DIRECTORY, PROFILE_VERSION
+from extras.debugmsgs import *
+
+FORMAT_VERSION = 2 # Trajectory tables (see 'autonomous/trajectorytable.py')
+
+_pplVersion = None
+
+def pplVersion():
+    '''
+    Returns the installed version of pathplannerlib (part of the content hash, so a new version regenerates every path)
+
+    Read from the name of its dist-info directory the first time, since importing 'importlib.metadata' takes tens of
+    milliseconds of the robot code start
+    '''
+    global _pplVersion
+    if _pplVersion is None:
+        _pplVersion = 'unknown'
+        prefix = 'robotpy_pathplannerlib-'
+        try:
+            for entry in os.listdir(os.path.dirname(os.path.dirname(pplpath.__file__))):
+                if entry.startswith(prefix) and entry.endswith('.dist-info'):
+                    _pplVersion = entry[len(prefix):-len('.dist-info')]
+                    break
+        except OSError:
+            pass
+    return _pplVersion
+
+class CachedPath(pplpath.PathPlannerPath):
+    '''
+    # CachedPath
+    PathPlannerPath that hands out its pre-generated flipped path and trajectory instead of building them when a command starts
+
+    The cached trajectory is only used when the robot starts at rest with (nearly) the rotation it was generated for,
+    otherwise it is generated like a normal path
+    '''
+    @classmethod
+    def wrap(cls, path: pplpath.PathPlannerPath, rotationTolerance: float):
+        cached = cls.__new__(cls)
+        cached.__dict__.update(path.__dict__)
+        cached.flipped = None
+        cached.trajectory = None
+        cached.startingRotation = path.getPreviewStartingHolonomicPose().rotation()
+        cached.rotationTolerance = rotationTolerance # Radians
+        cached.hits = 0
+        cached.misses = 0
+        return cached
+
+    def flipPath(self):
+        if self.flipped is not None:
+            return self.flipped
+        return super().flipPath()
+
+    def getTrajectory(self, starting_speeds, starting_rotation):
+        if (self.trajectory is not None
+                and abs(starting_speeds.vx) < 0.05 and abs(starting_speeds.vy) < 0.05 and abs(starting_speeds.omega) < 0.05
+                and abs((starting_rotation - self.startingRotation).radians()) <= self.rotationTolerance):
+            self.hits += 1
+            return self.trajectory
+
+        self.misses += 1
+        return super().getTrajectory(starting_speeds, starting_rotation)
+
+class PathCacheEntry:
+    '''
+    # PathCacheEntry
+    The blue and red (flipped) versions of one path file, identified by the hash of its content
+    '''
+    __slots__ = ('contentHash', 'blue', 'red')
+
+    def __init__(self, contentHash: str, blue: CachedPath, red: CachedPath):
+        self.contentHash = contentHash
+        self.blue = blue
+        self.red = red
+
+    def isReady(self):
+        return self.blue.trajectory is not None and self.red.trajectory is not None
+
+class PathCache:
+    '''
+    # PathCache
+    Finds every '.path' file in 'deploy/pathplanner/paths', parses it and generates the blue and red trajectories
+
+    'scan()' only reads and hashes the files. The parsing and generation are split into small steps that 'warmup()' runs
+    within a time budget (call it from 'disabledPeriodic()', or run it on the background worker: steps and 'get()'
+    are serialized by a lock). Trajectories can be saved to 'directory' so the next
+    start of the robot code only has to map their tables back into memory
+
+    A path with a table in 'deploy/trajectories' that was profiled from the same path file follows that table (the red
+    version is the flipped table), and nothing is generated for it
+    Named commands used by event markers must be registered before the paths are parsed
+    '''
+    def __init__(self, directory: str = None, rotationTolerance: float = math.radians(5.0)):
+        self.directory = directory # Where generated trajectories are saved (None to not save them)
+        self.rotationTolerance = rotationTolerance
+        self.pathsDirectory = os.path.join(getDeployDirectory(), 'pathplanner', 'paths')
+        self.tablesDirectory = os.path.join(getDeployDirectory(), TABLES_DIRECTORY)
+
+        self.names = {} # Path name -> content hash
+        self.entries = {} # Content hash -> 'PathCacheEntry'
+        self._pending = deque() # Generators that do the work of one path, one step per 'next()'
+        self._lock = threading.RLock() # Held while a step runs ('get()' can finish the work while the worker is warming up)
+
+    def scan(self):
+        '''
+        Hashes every path file and queues the ones that are not cached yet. Returns the number of queued paths
+        '''
+        try:
+            fileNames = sorted(name for name in os.listdir(self.pathsDirectory) if name.endswith('.path'))
+        except OSError as e:
+            debugMsg(f'No PathPlanner paths found: {e}')
+            return 0
+
+        version = pplVersion().encode()
+        queued = 0
+        for fileName in fileNames:
+            with open(os.path.join(self.pathsDirectory, fileName), 'rb') as pathFile:
+                content = pathFile.read()
+
+            contentHash = hashlib.sha1(content + version).hexdigest()
+            name = fileName[:-len('.path')]
+            self.names[name] = contentHash
+
+            if contentHash not in self.entries:
+                self.entries[contentHash] = None # Reserved, so files with the same content are only processed once
+                self._pending.append(self._build(name, contentHash, content))
+                queued += 1
+        return queued
+
+    def warmup(self, budgetSeconds: float):
+        '''
+        Runs queued work until 'budgetSeconds' have passed. Returns True when every path is ready
+
+        A single step (parsing a path or generating one trajectory) is never interrupted, so this can run over the budget by one step
+        '''
+        deadline = perf_counter() + budgetSeconds
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+                try:
+                    next(self._pending[0])
+                except StopIteration:
+                    self._pending.popleft()
+                except Exception as e:
+                    debugMsg(f'Could not cache path: {e}')
+                    self._pending.popleft()
+
+            if perf_counter() >= deadline:
+                break
+        return not self._pending
+
+    def isReady(self):
+        return not self._pending
+
+    def get(self, name: str, red: bool = False):
+        '''
+        Returns the cached path with the given name (the flipped version if 'red'), finishing its work first if needed
+        '''
+        contentHash = self.names.get(name)
+        if contentHash is None:
+            errorMsg(f"Path '{name}' does not exist in '{self.pathsDirectory}'", None)
+
+        entry = self.entries[contentHash]
+        if entry is None or not entry.isReady():
+            debugMsg(f"Path '{name}' was not cached before it was needed, finishing it now")
+            while self._pending and (entry is None or not entry.isReady()):
+                self.warmup(1.0)
+                entry = self.entries[contentHash]
+            if entry is None:
+                errorMsg(f"Path '{name}' could not be parsed", None)
+
+        return entry.red if red else entry.blue
+
+    def _build(self, name: str, contentHash: str, content: bytes):
+        '''
+        Generator that parses a path and generates its trajectories, yielding between the slow steps
+        '''
+        path = pplpath.PathPlannerPath._fromJson(json.loads(content))
+        blue = CachedPath.wrap(path, self.rotationTolerance)
+        red = CachedPath.wrap(path.flipPath(), self.rotationTolerance)
+        red.flipped = blue # Flipping the red path gives the blue one back
+        blue.flipped = red
+        entry = PathCacheEntry(contentHash, blue, red)
+        yield
+
+        if self._loadProfile(name, content, entry):
+            self.entries[contentHash] = entry
+            debugMsg(f"Loaded the velocity profile of path '{name}'")
+            return
+
+        if self._load(entry):
+            self.entries[contentHash] = entry
+            debugMsg(f"Loaded cached trajectories of path '{name}'")
+            return
+
+        blue.trajectory = self._generate(blue)
+        yield
+        red.trajectory = self._generate(red)
+        self.entries[contentHash] = entry
+        yield
+
+        self._save(entry)
+        debugMsg(f"Generated trajectories of path '{name}'")
+
+    @staticmethod
+    def _generate(path: CachedPath):
+        trajectory = ppltrajectory.PathPlannerTrajectory(path, ChassisSpeeds(), path.startingRotation)
+        return TableTrajectory.compile(trajectory)
+
+    def _filePath(self, entry: PathCacheEntry, suffix: str):
+        return os.path.join(self.directory, f'{entry.contentHash}{suffix}')
+
+    def _save(self, entry: PathCacheEntry):
+        '''
+        Saves the table of both trajectories ('.npy') and what is needed to rebuild them around it ('.json'):
+        the event marker times, the path constraints and which of them every row uses
+        '''
+        if self.directory is None:
+            return
+
+        markers = entry.blue.getEventMarkers()
+        index = {
+            'version': FORMAT_VERSION,
+            'markers': len(markers)
+        }
+        for color, path in (('blue', entry.blue), ('red', entry.red)):
+            index[color] = {
+                'markerTimes': self._markerTimes(path.trajectory, markers),
+                'constraints': [
+                    [constraints.maxVelocityMps, constraints.maxAccelerationMpsSq, constraints.maxAngularVelocityRps, constraints.maxAngularAccelerationRpsSq]
+                    for constraints in path.trajectory.pathConstraints
+                ],
+                'constraintRows': list(path.trajectory.constraintRows)
+            }
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entry.blue.trajectory.table.save(self._filePath(entry, '-blue.npy'))
+            entry.red.trajectory.table.save(self._filePath(entry, '-red.npy'))
+
+            # Written last, a crash while saving leaves no index and the tables are not used
+            temporaryPath = self._filePath(entry, '.json.tmp')
+            with open(temporaryPath, 'w') as indexFile:
+                json.dump(index, indexFile)
+            os.replace(temporaryPath, self._filePath(entry, '.json'))
+        except OSError as e:
+            debugMsg(f'Could not save path cache: {e}')
+
+    @staticmethod
+    def _markerTimes(trajectory, markers):
+        commandTimes = {}
+        for time, command in trajectory.getEventCommands():
+            commandTimes.setdefault(id(command), []).append(time)
+        return [commandTimes[id(marker.command)].pop(0) for marker in markers]
+
+    def _load(self, entry: PathCacheEntry):
+        '''
+        Maps both tables written by '_save()' back into memory. Returns False if there are no valid files
+        '''
+        if self.directory is None or not os.path.exists(self._filePath(entry, '.json')):
+            return False
+
+        try:
+            with open(self._filePath(entry, '.json')) as indexFile:
+                index = json.load(indexFile)
+            if index.get('version') != FORMAT_VERSION or index['markers'] != len(entry.blue.getEventMarkers()):
+                return False
+
+            trajectories = []
+            for color, path in (('blue', entry.blue), ('red', entry.red)):
+                constraints = [pplpath.PathConstraints(*values) for values in index[color]['constraints']]
+                table = TrajectoryTable.load(self._filePath(entry, f'-{color}.npy'))
+                rows = bytes(index[color]['constraintRows'])
+                if len(rows) != table.rows:
+                    return False
+
+                eventCommands = sorted(zip(index[color]['markerTimes'], (marker.command for marker in path.getEventMarkers())), key=lambda event: event[0])
+                trajectories.append(TableTrajectory(table, constraints, rows, eventCommands))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            debugMsg(f'Ignoring invalid path cache files: {e}')
+            return False
+
+        entry.blue.trajectory, entry.red.trajectory = trajectories
+        return True
+
+    def _loadProfile(self, name: str, content: bytes, entry: PathCacheEntry):
+        '''
+        Maps the table 'autonomous/velocityprofile.py' wrote for the path into memory, if it was profiled from this
+        version of the path file. Returns False otherwise
+        '''
+        tablePath = os.path.join(self.tablesDirectory, name + '.npy')
+        indexPath = os.path.join(self.tablesDirectory, name + '.json')
+        if not os.path.exists(tablePath) or not os.path.exists(indexPath):
+            return False
+
+        try:
+            with open(indexPath) as indexFile:
+                index = json.load(indexFile)
+            if index.get('version') != PROFILE_VERSION or index.get('pathHash') != hashlib.sha1(content).hexdigest():
+                debugMsg(f"Ignoring the velocity profile of path '{name}', the path changed since it was profiled")
+                return False
+
+            markers = entry.blue.getEventMarkers()
+            if len(index['markerTimes']) != len(markers):
+                return False
+            constraints = [pplpath.PathConstraints(*values) for values in index['constraints']]
+            table = TrajectoryTable.load(tablePath)
+            rows = bytes(index['constraintRows'])
+            if len(rows) != table.rows:
+                return False
+
+            trajectories = []
+            for path, pathTable in ((entry.blue, table), (entry.red, table.flipped())):
+                eventCommands = sorted(zip(index['markerTimes'], (marker.command for marker in path.getEventMarkers())), key=lambda event: event[0])
+                trajectories.append(TableTrajectory(pathTable, constraints, rows, eventCommands))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            debugMsg(f"Ignoring invalid velocity profile of path '{name}': {e}")
+            return False
+
+        entry.blue.trajectory, entry.red.trajectory = trajectories
+        return True
@@ -0,0 +1,365 @@
+# Finds paths around the obstacles of 'deploy/pathplanner/navgrid.json' on a background thread
+# Used by pathplannerlib's pathfinding commands ('AutoBuilder.pathfindToPose()') in place of its own pathfinder
+# The grid is loaded on that thread too, so NumPy is not imported while the robot code boots
+from array import array
+import heapq
+import json
+import math
+import os
+import threading
+from time import perf_counter
+
+from wpilib import getDeployDirectory
+from wpimath.geometry import Pose2d, Rotation2d, Translation2d
+
+import pathplannerlib.path as pplpath
+from pathplannerlib.pathfinders import Pathfinder
+
+from extras.debugmsgs import *
+
+SQRT2 = math.sqrt(2.0)
+
+# Neighbor offsets (column, row, cost in nodes) of the 8-connected grid
+NEIGHBORS = ((1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0), (1, 1, SQRT2), (1, -1, SQRT2), (-1, 1, SQRT2), (-1, -1, SQRT2))
+
+MIN_WAYPOINT_SPACING = 0.01 # Meters. Closer waypoints are merged (PathPlanner cannot generate a segment between two equal points)
+
+def distinctWaypoints(points: list):
+    '''
+    Drops every waypoint closer than 'MIN_WAYPOINT_SPACING' to the one kept before it. The last waypoint (the goal) is
+    always kept, in place of the one before it if they are too close
+    '''
+    kept = points[:1]
+    for point in points[1:]:
+        last = kept[-1]
+        if math.hypot(point[0] - last[0], point[1] - last[1]) >= MIN_WAYPOINT_SPACING:
+            kept.append(point)
+        elif len(kept) > 1 and point is points[-1]:
+            kept[-1] = point
+    return kept
+
+class NavGrid:
+    '''
+    # NavGrid
+    Occupancy grid of the field loaded from a PathPlanner navgrid into NumPy arrays
+
+    'clearance' is the distance (meters) from the middle of each node to the nearest obstacle or field wall. Nodes with
+    less clearance than the robot radius are blocked, so the planner can treat the robot as a point
+    '''
+    def __init__(self, path: str = None, robotRadius: float = 0.0):
+        import numpy as np
+
+        path = path or os.path.join(getDeployDirectory(), 'pathplanner', 'navgrid.json')
+        with open(path) as gridFile:
+            data = json.load(gridFile)
+
+        self.nodeSize = float(data['nodeSizeMeters'])
+        self.fieldLength = float(data['field_size']['x'])
+        self.fieldWidth = float(data['field_size']['y'])
+        self.obstacles = np.array(data['grid'], dtype=bool) # [row (y), column (x)]
+        self.rows, self.columns = self.obstacles.shape
+
+        # Field position of the middle of every node
+        rowIndices, columnIndices = np.indices(self.obstacles.shape)
+        self.centerX = (columnIndices + 0.5) * self.nodeSize
+        self.centerY = (rowIndices + 0.5) * self.nodeSize
+
+        self.clearance = self._clearance()
+        self.setRobotRadius(robotRadius)
+
+    def _clearance(self):
+        '''
+        Distance from every node to the closest obstacle node (its edge) or field wall. Computed once, so it can be brute force
+        '''
+        import numpy as np
+
+        clearance = np.minimum.reduce([
+            self.centerX, self.fieldLength - self.centerX,
+            self.centerY, self.fieldWidth - self.centerY
+        ])
+
+        obstacleX = self.centerX[self.obstacles]
+        obstacleY = self.centerY[self.obstacles]
+        if obstacleX.size:
+            # Distance between node middles minus half a node (distance to the edge of the obstacle node)
+            distances = np.hypot(self.centerX[..., None] - obstacleX, self.centerY[..., None] - obstacleY).min(axis=-1)
+            clearance = np.minimum(clearance, np.maximum(distances - 0.5 * self.nodeSize, 0.0))
+
+        clearance[self.obstacles] = 0.0
+        return clearance
+
+    def setRobotRadius(self, robotRadius: float):
+        self.robotRadius = robotRadius
+        self.blocked = self.obstacles | (self.clearance < robotRadius)
+
+    def withObstacles(self, boxes: list):
+        '''
+        Returns a copy of 'blocked' with dynamic obstacles added. Each box is two opposite corners ((x1, y1), (x2, y2))
+        '''
+        import numpy as np
+
+        blocked = self.blocked.copy()
+        for (x1, y1), (x2, y2) in boxes:
+            # Distance from each node to the box, blocked if the robot would touch it
+            dx = np.maximum(np.maximum(min(x1, x2) - self.centerX, self.centerX - max(x1, x2)), 0.0)
+            dy = np.maximum(np.maximum(min(y1, y2) - self.centerY, self.centerY - max(y1, y2)), 0.0)
+            blocked |= np.hypot(dx, dy) < self.robotRadius
+        return blocked
+
+    def toNode(self, x: float, y: float):
+        column = min(max(int(x / self.nodeSize), 0), self.columns - 1)
+        row = min(max(int(y / self.nodeSize), 0), self.rows - 1)
+        return row * self.columns + column
+
+    def toPosition(self, node: int):
+        row, column = divmod(node, self.columns)
+        return (column + 0.5) * self.nodeSize, (row + 0.5) * self.nodeSize
+
+    def nearestFree(self, x: float, y: float, blocked):
+        '''
+        Returns the free node closest to a position (None if every node is blocked)
+        '''
+        import numpy as np
+
+        distances = np.hypot(self.centerX - x, self.centerY - y)
+        distances[blocked] = np.inf
+        node = int(np.argmin(distances))
+        return None if math.isinf(distances.flat[node]) else node
+
+class GridPlanner:
+    '''
+    # GridPlanner
+    A* over the 8-connected nodes of a 'NavGrid', followed by line-of-sight smoothing
+
+    Blocked nodes are passed to every query as a flat bytearray so dynamic obstacles only cost a copy of the grid
+    '''
+    def __init__(self, grid: NavGrid):
+        self.grid = grid
+
+    def findPath(self, start: tuple, goal: tuple, blocked=None):
+        '''
+        Returns a list of (x, y) waypoints from 'start' to 'goal' (field meters), or None if the goal cannot be reached.
+        There is only one waypoint if the start and goal end up closer than 'MIN_WAYPOINT_SPACING'
+
+        Starts/goals inside a blocked node are moved to the closest free node. 'blocked' is the grid to use instead of
+        'grid.blocked' (from 'grid.withObstacles()')
+        '''
+        import numpy as np
+
+        grid = self.grid
+        if blocked is None:
+            blocked = grid.blocked
+
+        startNode = grid.toNode(*start)
+        if blocked.flat[startNode]:
+            startNode = grid.nearestFree(*start, blocked)
+        goalNode = grid.toNode(*goal)
+        goalBlocked = blocked.flat[goalNode]
+        if goalBlocked:
+            goalNode = grid.nearestFree(*goal, blocked)
+        if startNode is None or goalNode is None:
+            return None
+
+        flatBlocked = bytearray(blocked.ravel().astype(np.uint8))
+        nodes = self._search(startNode, goalNode, flatBlocked)
+        if nodes is None:
+            return None
+
+        # Real start/goal positions at the ends (unless they are inside an obstacle). With a single node the start and
+        # goal are both in it, and may be the same point
+        startPoint = start if not blocked.flat[grid.toNode(*start)] else grid.toPosition(startNode)
+        goalPoint = goal if not goalBlocked else grid.toPosition(goalNode)
+        points = [startPoint, *(grid.toPosition(node) for node in nodes[1:-1]), goalPoint]
+
+        return distinctWaypoints(self._smooth(points, flatBlocked))
+
+    def _search(self, startNode: int, goalNode: int, blocked: bytearray):
+        columns = self.grid.columns
+        rows = self.grid.rows
+        goalRow, goalColumn = divmod(goalNode, columns)
+
+        cost = array('d', [math.inf]) * (rows * columns)
+        cameFrom = array('i', [-1]) * (rows * columns)
+        closed = bytearray(rows * columns)
+        cost[startNode] = 0.0
+        openHeap = [(0.0, startNode)]
+
+        while openHeap:
+            _, node = heapq.heappop(openHeap)
+            if closed[node]:
+                continue # Older, more expensive entry of a node that was already expanded
+            closed[node] = 1
+
+            if node == goalNode:
+                path = [node]
+                while node != startNode:
+                    node = cameFrom[node]
+                    path.append(node)
+                path.reverse()
+                return path
+
+            row, column = divmod(node, columns)
+            nodeCost = cost[node]
+
+            for dColumn, dRow, stepCost in NEIGHBORS:
+                nextColumn = column + dColumn
+                nextRow = row + dRow
+                if not (0 <= nextColumn < columns and 0 <= nextRow < rows):
+                    continue
+                nextNode = nextRow * columns + nextColumn
+                if blocked[nextNode]:
+                    continue
+                if dColumn and dRow and (blocked[row * columns + nextColumn] or blocked[nextRow * columns + column]):
+                    continue # Do not cut the corner of an obstacle
+
+                nextCost = nodeCost + stepCost
+                if nextCost < cost[nextNode]:
+                    cost[nextNode] = nextCost
+                    cameFrom[nextNode] = node
+
+                    # Octile distance to the goal (never overestimates on an 8-connected grid)
+                    dx = abs(goalColumn - nextColumn)
+                    dy = abs(goalRow - nextRow)
+                    heapq.heappush(openHeap, (nextCost + max(dx, dy) + (SQRT2 - 1.0) * min(dx, dy), nextNode))
+        return None
+
+    def _smooth(self, points: list, blocked: bytearray):
+        '''
+        Removes every waypoint that the robot can skip by driving straight to a later one
+        '''
+        smoothed = [points[0]]
+        index = 0
+        while index < len(points) - 1:
+            furthest = index + 1
+            for candidate in range(len(points) - 1, index + 1, -1):
+                if self._lineOfSight(points[index], points[candidate], blocked):
+                    furthest = candidate
+                    break
+            smoothed.append(points[furthest])
+            index = furthest
+        return smoothed
+
+    def _lineOfSight(self, start: tuple, end: tuple, blocked: bytearray):
+        grid = self.grid
+        distance = math.hypot(end[0] - start[0], end[1] - start[1])
+        steps = max(1, int(distance / (0.25 * grid.nodeSize))) # Quarter node steps
+        for step in range(steps + 1):
+            t = step / steps
+            if blocked[grid.toNode(start[0] + (end[0] - start[0]) * t, start[1] + (end[1] - start[1]) * t)]:
+                return False
+        return True
+
+class GridPathfinder(Pathfinder):
+    '''
+    # GridPathfinder
+    pathplannerlib 'Pathfinder' that runs 'GridPlanner' queries on a background thread
+
+    Setting the start, goal or dynamic obstacles only stores the request, so the robot loop never waits on a search.
+    The pathfinding commands pick the result up with 'isNewPathAvailable()'/'getCurrentPath()'
+
+    'loadGrid' returns the 'NavGrid'. It is called on the pathfinder thread, requests made before it is loaded are
+    answered once it is
+    '''
+    def __init__(self, loadGrid):
+        self.grid = None
+        self.planner = None
+        self._loadGrid = loadGrid
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._start = None
+        self._goal = None
+        self._obstacles = None # Dynamic obstacle boxes of the newest request (None for none)
+        self._requestId = 0 # Increases with every new request
+
+        self._waypoints = [] # Result of the newest query (list of (x, y))
+        self._newPathAvailable = False
+        self.lastQuerySeconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='Pathfinder', daemon=True)
+        self._thread.start()
+
+    def isNewPathAvailable(self):
+        return self._newPathAvailable
+
+    def getCurrentPath(self, constraints, goal_end_state):
+        self._newPathAvailable = False
+        waypoints = self._waypoints
+        if len(waypoints) < 2: # Already at the goal, there is no path to follow
+            return None
+        return pplpath.PathPlannerPath(pplpath.PathPlannerPath.bezierFromPoses(self._poses(waypoints)), constraints, goal_end_state)
+
+    def setStartPosition(self, start_position: Translation2d):
+        self._request(start=(start_position.X(), start_position.Y()))
+
+    def setGoalPosition(self, goal_position: Translation2d):
+        self._request(goal=(goal_position.X(), goal_position.Y()))
+
+    def setDynamicObstacles(self, obs: list, current_robot_pos: Translation2d):
+        # Added to the grid on the pathfinder thread
+        boxes = [((a.X(), a.Y()), (b.X(), b.Y())) for a, b in obs]
+        self._request(start=(current_robot_pos.X(), current_robot_pos.Y()), obstacles=boxes)
+
+    def _request(self, start: tuple = None, goal: tuple = None, obstacles: list = None):
+        with self._lock:
+            if start is not None:
+                self._start = start
+            if goal is not None:
+                self._goal = goal
+            if obstacles is not None:
+                self._obstacles = obstacles
+            self._requestId += 1
+        self._wake.set()
+
+    @staticmethod
+    def _poses(waypoints: list):
+        '''
+        Waypoints -> poses facing the direction of travel (what 'bezierFromPoses()' needs for its control points)
+        '''
+        poses = []
+        last = len(waypoints) - 1
+        for index, (x, y) in enumerate(waypoints):
+            previousX, previousY = waypoints[max(index - 1, 0)]
+            nextX, nextY = waypoints[min(index + 1, last)]
+            heading = math.atan2(nextY - previousY, nextX - previousX) # Through the corner for middle waypoints
+            poses.append(Pose2d(x, y, Rotation2d(heading)))
+        return poses
+
+    def _run(self):
+        try:
+            self.grid = self._loadGrid()
+            self.planner = GridPlanner(self.grid)
+        except Exception as e:
+            warningMsg(f'Could not load the navgrid, pathfinding is disabled: {e}')
+            return
+
+        handledId = 0
+        blocked = self.grid.blocked # Grid with the current dynamic obstacles
+        blockedFor = None # Obstacle boxes 'blocked' was made with
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+
+            with self._lock:
+                requestId, start, goal, obstacles = self._requestId, self._start, self._goal, self._obstacles
+            if requestId == handledId or start is None or goal is None:
+                continue
+            handledId = requestId
+
+            if obstacles is not blockedFor:
+                blocked = self.grid.withObstacles(obstacles)
+                blockedFor = obstacles
+
+            queryStart = perf_counter()
+            try:
+                waypoints = self.planner.findPath(start, goal, blocked)
+            except Exception as e:
+                debugMsg(f'Pathfinding failed: {e}')
+                continue
+            self.lastQuerySeconds = perf_counter() - queryStart
+
+            if waypoints is None:
+                debugMsg(f'No path from {start} to {goal}')
+                continue
+            self._waypoints = waypoints
+            self._newPathAvailable = True
@@ -0,0 +1,249 @@
+# Trajectories compiled to one NumPy array at a fixed time step, sampled in constant time
+# A table is read straight from (and written to) a '.npy' file, memory mapped so loading it copies nothing
+# NumPy is imported by the functions that build or load tables (during warmup), not while the robot code boots
+import math
+import os
+
+from wpimath.geometry import Rotation2d, Translation2d
+
+import pathplannerlib.trajectory as ppltrajectory
+
+# Columns of a table (seconds, meters and radians, field relative). 'heading' is the robot heading (unwrapped, so it can
+# be interpolated), 'omega' its rate (nan if the trajectory does not give one)
+COLUMNS = ('time', 'x', 'y', 'heading', 'vx', 'vy', 'omega')
+TIME, X, Y, HEADING, VX, VY, OMEGA = range(len(COLUMNS))
+WIDTH = len(COLUMNS)
+
+DEFAULT_PERIOD = 0.02 # One robot tick
+
+# Velocity profiled tables ('<path>.npy' and '<path>.json', see 'autonomous/velocityprofile.py'), in the deploy directory
+TABLES_DIRECTORY = 'trajectories'
+PROFILE_VERSION = 1
+
+class TrajectorySample:
+    '''
+    # TrajectorySample
+    State of a 'TrajectoryTable' at some time, overwritten by every 'TrajectoryTable.sample()' it is given to
+    '''
+    __slots__ = COLUMNS + (
+        'row', 'fraction' # Row before the sampled time, and how far (0 - 1) the time is towards the next row
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0.0)
+        self.row = 0
+
+def stateWeights(stateTimes, times):
+    '''
+    For every time (NumPy arrays), the index of the first state at or after it (at least 1) and how far the time is
+    from the state before it. Same search as 'PathPlannerTrajectory.sample()'
+    '''
+    import numpy as np
+
+    following = np.clip(np.searchsorted(stateTimes, times, side='left'), 1, stateTimes.size - 1)
+    span = stateTimes[following] - stateTimes[following - 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(span > 0.0, (times - stateTimes[following - 1]) / span, 1.0)
+    return following, np.clip(fraction, 0.0, 1.0)
+
+class TrajectoryTable:
+    '''
+    # TrajectoryTable
+    A trajectory as one (rows, len(COLUMNS)) float64 array, with a row every 'period' seconds (the last row can be closer)
+
+    'sample()' finds the row from the time with one division and interpolates it with the next one, so it costs the
+    same for any length of trajectory. Values are read through a flat memoryview of the array, which gives plain floats
+    '''
+    def __init__(self, data):
+        import numpy as np
+
+        data = np.asarray(data)
+        if data.dtype != np.float64 or data.ndim != 2 or data.shape[1] != WIDTH or data.shape[0] < 1:
+            raise ValueError(f'A trajectory table is a float64 array of (rows, {WIDTH}), got {data.dtype} {data.shape}')
+        self.data = np.ascontiguousarray(data) # Only copies if the array was not laid out row after row
+
+        if data[0, TIME] != 0.0:
+            raise ValueError('A trajectory table must start at time 0')
+
+        self.rows = data.shape[0]
+        self.duration = float(data[-1, TIME])
+        self.period = float(data[1, TIME] - data[0, TIME]) if self.rows > 1 else DEFAULT_PERIOD
+        if self.rows > 2 and not np.allclose(np.diff(data[:-1, TIME]), self.period, rtol=0.0, atol=1e-9):
+            raise ValueError('The rows of a trajectory table must be evenly spaced in time')
+        self.rate = 1.0 / self.period
+        self.values = memoryview(self.data).cast('B').cast('d')
+
+    def column(self, name: str):
+        '''
+        Returns a view of one column ('COLUMNS')
+        '''
+        return self.data[:, COLUMNS.index(name)]
+
+    def sample(self, time: float, out: TrajectorySample = None):
+        '''
+        Interpolates the table at 'time' (seconds, clamped to the trajectory). Writes into 'out' if given, and returns it
+        '''
+        out = out or TrajectorySample()
+        values = self.values
+
+        last = self.rows - 1
+        row = int(time * self.rate) if time > 0.0 else 0
+        if row >= last:
+            row = max(last - 1, 0)
+        start = row * WIDTH
+        end = start + WIDTH if last else start
+
+        startTime = values[start]
+        span = values[end] - startTime
+        fraction = (time - startTime) / span if span > 0.0 else 1.0
+        if fraction < 0.0:
+            fraction = 0.0
+        elif fraction > 1.0:
+            fraction = 1.0
+
+        out.time = startTime + span * fraction
+        out.x = values[start + X] + (values[end + X] - values[start + X]) * fraction
+        out.y = values[start + Y] + (values[end + Y] - values[start + Y]) * fraction
+        out.heading = values[start + HEADING] + (values[end + HEADING] - values[start + HEADING]) * fraction
+        out.vx = values[start + VX] + (values[end + VX] - values[start + VX]) * fraction
+        out.vy = values[start + VY] + (values[end + VY] - values[start + VY]) * fraction
+        out.omega = values[start + OMEGA] + (values[end + OMEGA] - values[start + OMEGA]) * fraction
+        out.row = row
+        out.fraction = fraction
+        return out
+
+    def flipped(self):
+        '''
+        Returns a copy of the table on the other side of the field, like 'PathPlannerPath.flipPath()'
+        '''
+        import numpy as np
+        from pathplannerlib.geometry_util import FIELD_LENGTH
+
+        data = np.array(self.data)
+        data[:, X] = FIELD_LENGTH - data[:, X]
+        data[:, HEADING] = math.pi - data[:, HEADING]
+        data[:, VX] = -data[:, VX]
+        data[:, OMEGA] = -data[:, OMEGA]
+        return TrajectoryTable(data)
+
+    @classmethod
+    def fromStates(cls, states: list, period: float = DEFAULT_PERIOD):
+        '''
+        Compiles the states of a PathPlannerTrajectory. Every row has the value 'PathPlannerTrajectory.sample()' gives at its time
+        '''
+        import numpy as np
+
+        stateTimes = np.array([state.timeSeconds for state in states])
+        duration = stateTimes[-1]
+        times = np.arange(0.0, duration, period) if duration > 0.0 else np.zeros(1)
+        if duration - times[-1] > 1e-9:
+            times = np.append(times, duration)
+
+        # Linear interpolation between the two states around each row, like 'State.interpolate()' (angles the short way)
+        following, fraction = stateWeights(stateTimes, times)
+        def lerp(values):
+            values = np.asarray(values, dtype=float)
+            return values[following - 1] + (values[following] - values[following - 1]) * fraction
+
+        speed = lerp([state.velocityMps for state in states])
+        travel = lerp(np.unwrap([state.heading.radians() for state in states]))
+        holonomicRates = [state.holonomicAngularVelocityRps for state in states]
+
+        table = np.empty((times.size, WIDTH))
+        table[:, TIME] = times
+        table[:, X] = lerp([state.positionMeters.X() for state in states])
+        table[:, Y] = lerp([state.positionMeters.Y() for state in states])
+        table[:, HEADING] = lerp(np.unwrap([state.targetHolonomicRotation.radians() for state in states]))
+        table[:, VX] = speed * np.cos(travel)
+        table[:, VY] = speed * np.sin(travel)
+        table[:, OMEGA] = lerp([math.nan if rate is None else rate for rate in holonomicRates])
+        return cls(table)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        '''
+        Reads a table written by 'save()'. With 'mmap' the file is mapped read-only instead of copied into memory
+        '''
+        import numpy as np
+
+        return cls(np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False))
+
+    def save(self, path: str):
+        '''
+        Writes the table to a '.npy' file (through a temporary file, so a crash never leaves half a table behind)
+        '''
+        import numpy as np
+
+        temporaryPath = path + '.tmp'
+        with open(temporaryPath, 'wb') as tableFile:
+            np.save(tableFile, self.data, allow_pickle=False)
+        os.replace(temporaryPath, path)
+
+class TableTrajectory(ppltrajectory.PathPlannerTrajectory):
+    '''
+    # TableTrajectory
+    PathPlannerTrajectory that samples a 'TrajectoryTable' instead of searching and interpolating a list of states.
+    Only the first and last states exist as objects (for 'getInitialState()' and 'getEndState()')
+
+    'constraints' are the PathConstraints of the trajectory and 'constraintRows' the index (bytes) of the ones each row
+    uses, so the follower limits the rotation the same way as with the generated trajectory
+    '''
+    def __init__(self, table: TrajectoryTable, constraints: tuple, constraintRows: bytes = None, eventCommands: list = None):
+        self.table = table
+        self.pathConstraints = tuple(constraints)
+        self.constraintRows = constraintRows
+        self.current = TrajectorySample() # Reused by every 'sample()'
+
+        super().__init__(None, None, None, states=[self.state(0.0), self.state(table.duration)], event_commands=eventCommands or [])
+
+    @classmethod
+    def compile(cls, trajectory: ppltrajectory.PathPlannerTrajectory, period: float = DEFAULT_PERIOD):
+        '''
+        Compiles a generated trajectory (keeping its event commands)
+        '''
+        import numpy as np
+
+        states = trajectory.getStates()
+        table = TrajectoryTable.fromStates(states, period)
+
+        # Constraints of the state 'State.interpolate()' takes them from at each row
+        following, fraction = stateWeights(np.array([state.timeSeconds for state in states]), table.data[:, TIME])
+        chosen = np.where(fraction < 0.5, following - 1, following)
+        constraints = []
+        indices = {}
+        for state in states:
+            if id(state.constraints) not in indices:
+                indices[id(state.constraints)] = len(constraints)
+                constraints.append(state.constraints)
+        rows = bytes(indices[id(states[index].constraints)] for index in chosen)
+        return cls(table, constraints, rows, trajectory.getEventCommands())
+
+    def state(self, time: float):
+        '''
+        Samples the table into a new PathPlanner State
+        '''
+        sample = self.table.sample(time, self.current)
+        speed = math.hypot(sample.vx, sample.vy)
+
+        rows = self.constraintRows
+        if rows is None:
+            constraints = self.pathConstraints[0]
+        else:
+            constraints = self.pathConstraints[rows[min(sample.row + (sample.fraction >= 0.5), len(rows) - 1)]]
+
+        return ppltrajectory.State(
+            sample.time, speed, 0.0, 0.0,
+            Translation2d(sample.x, sample.y),
+            Rotation2d(sample.vx, sample.vy) if speed > 1e-9 else Rotation2d(),
+            Rotation2d(sample.heading),
+            None if math.isnan(sample.omega) else sample.omega,
+            0.0, constraints, 0.0
+        )
+
+    def sample(self, time: float):
+        if time <= 0.0:
+            return self.getInitialState()
+        if time >= self.table.duration:
+            return self.getEndState()
+        return self.state(time)
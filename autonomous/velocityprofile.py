@@ -0,0 +1,342 @@
+# Time-optimal velocity profiles of PathPlanner paths that respect the limits of every swerve module
+# PathPlanner only limits the robot as a whole, so a path that turns the robot while driving can ask a module to go faster
+# (or steer faster) than it can, and the drivetrain ends up slowing everything down. This profiles the path with those
+# limits and writes the result as a trajectory table ('deploy/trajectories/<path>.npy', see 'autonomous/trajectorytable.py')
+# next to what the path cache needs to follow it ('<path>.json': the hash of the path file, constraints and event marker times)
+# Run with 'python -m autonomous.velocityprofile [path name ...]' (every path by default)
+import hashlib
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from autonomous.trajectorytable import TrajectoryTable, WIDTH, TIME, DEFAULT_PERIOD, TABLES_DIRECTORY, PROFILE_VERSION
+from extras.debugmsgs import *
+
+SAMPLE_SPACING = 0.01 # Meters between the samples of a path (at most, roughly)
+
+# What limits the speed at a sample (index of 'VelocityProfile.limits')
+LIMITS = ('path speed', 'curvature', 'rotation speed', 'module speed', 'steering rate', 'steering acceleration')
+
+# Modules going slower than this (meters per meter of path) can point anywhere, their steering is not limited
+STOPPED_MODULE = 1e-3
+
+def bezierSamples(waypoints: list, spacing: float):
+    '''
+    Samples the cubic bezier segments between PathPlanner waypoints (json) about every 'spacing' meters
+
+    Returns the waypoint relative position (segment index + bezier parameter), the positions and their first and second
+    derivatives by the bezier parameter, as arrays of (N,) and (N, 2)
+    '''
+    segments = len(waypoints) - 1
+    if segments < 1:
+        errorMsg('A path needs at least two waypoints', None)
+
+    def point(value):
+        return (value['x'], value['y'])
+
+    relative = []
+    controls = []
+    for index in range(segments):
+        start, end = waypoints[index], waypoints[index + 1]
+        segment = np.array((point(start['anchor']), point(start['nextControl']), point(end['prevControl']), point(end['anchor'])))
+
+        # The control polygon is never shorter than the curve, so this keeps the samples at most 'spacing' apart
+        length = np.hypot(*np.diff(segment, axis=0).T).sum()
+        count = max(16, int(math.ceil(length / spacing)))
+        t = np.arange(count + (index == segments - 1)) / count # The last segment also gets its end point
+        relative.append(index + t)
+        controls.append(np.broadcast_to(segment, (t.size, 4, 2)))
+
+    u = np.concatenate(relative)
+    t = (u - np.minimum(np.floor(u), segments - 1))[:, None]
+    P0, P1, P2, P3 = np.moveaxis(np.concatenate(controls), 1, 0)
+    s = 1.0 - t
+
+    position = s ** 3 * P0 + 3.0 * s * s * t * P1 + 3.0 * s * t * t * P2 + t ** 3 * P3
+    first = 3.0 * s * s * (P1 - P0) + 6.0 * s * t * (P2 - P1) + 3.0 * t * t * (P3 - P2)
+    second = 6.0 * s * (P2 - 2.0 * P1 + P0) + 6.0 * t * (P3 - 2.0 * P2 + P1)
+    return u, position, first, second
+
+class VelocityProfile:
+    '''
+    # VelocityProfile
+    A path sampled by distance, with the fastest velocity at every sample and the time it is reached at
+    '''
+    def __init__(self, name: str, relative: np.ndarray, distance: np.ndarray, position: np.ndarray, travel: np.ndarray,
+                 rotation: np.ndarray, rotationRate: np.ndarray, moduleFactor: np.ndarray, velocity: np.ndarray, limits: np.ndarray,
+                 zones: np.ndarray):
+        self.name = name
+        self.relative = relative # Waypoint relative position (segment index + bezier parameter)
+        self.distance = distance # Meters along the path
+        self.position = position # (N, 2) meters
+        self.travel = travel # Direction of travel (radians)
+        self.rotation = rotation # Heading of the robot (radians, unwrapped)
+        self.rotationRate = rotationRate # Radians per meter of path
+        self.moduleFactor = moduleFactor # Speed of the fastest module per meter/second of the robot
+        self.velocity = velocity # Meters/second
+        self.limits = limits # Index in 'LIMITS' of what limits each sample
+        self.zones = zones # Constraints of each sample (0 for the global constraints, 1 + the index of a constraint zone)
+
+        # Average speed between samples -> time at every sample
+        average = (velocity[1:] + velocity[:-1]) / 2.0
+        with np.errstate(divide='ignore'):
+            self.time = np.concatenate(((0.0,), np.cumsum(np.diff(distance) / average)))
+
+    @property
+    def lapTime(self):
+        return float(self.time[-1])
+
+    def limitShares(self):
+        '''
+        Returns the fraction of the path (by distance) each of 'LIMITS' is the limit for
+        '''
+        lengths = np.bincount(self.limits[1:], weights=np.diff(self.distance), minlength=len(LIMITS))
+        return dict(zip(LIMITS, lengths / max(self.distance[-1], 1e-9)))
+
+    def table(self, period: float = DEFAULT_PERIOD):
+        '''
+        Resamples the profile every 'period' seconds into a 'TrajectoryTable'
+        '''
+        times = np.arange(0.0, self.lapTime, period)
+        times = np.append(times, self.lapTime) if self.lapTime - times[-1] > 1e-9 else times
+
+        speed = self.velocity
+        columns = (
+            self.position[:, 0],
+            self.position[:, 1],
+            self.rotation,
+            speed * np.cos(self.travel),
+            speed * np.sin(self.travel),
+            speed * self.rotationRate
+        )
+        table = np.empty((times.size, WIDTH))
+        table[:, TIME] = times
+        for index, column in enumerate(columns, TIME + 1):
+            table[:, index] = np.interp(times, self.time, column)
+        return TrajectoryTable(table)
+
+    def index(self, data: dict, table: TrajectoryTable, pathHash: str):
+        '''
+        What the path cache needs to follow 'table' (from the json of the profiled path): the path constraints, which of
+        them every row uses and the time of every event marker
+        '''
+        def values(constraints: dict):
+            return [constraints['maxVelocity'], constraints['maxAcceleration'],
+                    math.radians(constraints['maxAngularVelocity']), math.radians(constraints['maxAngularAcceleration'])]
+
+        nearest = np.rint(np.interp(table.data[:, TIME], self.time, np.arange(self.time.size))).astype(int)
+        markers = [marker['waypointRelativePos'] for marker in data.get('eventMarkers', ())]
+        return {
+            'version': PROFILE_VERSION,
+            'pathHash': pathHash,
+            'constraints': [values(data['globalConstraints'])] + [values(zone['constraints']) for zone in data.get('constraintZones', ())],
+            'constraintRows': self.zones[nearest].tolist(),
+            'markerTimes': np.interp(markers, self.relative, self.time).tolist()
+        }
+
+    def save(self, path: str, data: dict, pathHash: str, period: float = DEFAULT_PERIOD):
+        '''
+        Writes 'table()' to a '.npy' file and its 'index()' to a '.json' file next to it (see 'PathCache')
+        '''
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        table = self.table(period)
+        table.save(path)
+
+        indexPath = os.path.splitext(path)[0] + '.json'
+        with open(indexPath + '.tmp', 'w') as indexFile:
+            json.dump(self.index(data, table, pathHash), indexFile)
+        os.replace(indexPath + '.tmp', indexPath)
+
+class VelocityProfiler:
+    '''
+    # VelocityProfiler
+    Finds the fastest velocity along a PathPlanner path (json) that keeps every module within its speed, steering rate
+    and steering acceleration, on top of the path's own constraints
+
+    The module locations in 'constants.json' are not real locations yet (see 'RobotConfig'), so by default the modules
+    are on the corners of a square at 'DRIVE_BASE_RADIUS' from the middle of the robot, like PathPlanner assumes
+    '''
+    def __init__(self, locations: tuple = None, moduleMaxSpeed: float = None, steeringRate: float = None, steeringAcceleration: float = None):
+        from config import robotconfig
+        config = robotconfig.get()
+
+        if locations is None:
+            corner = config.pathplanner.driveBaseRadius / math.sqrt(2.0)
+            locations = ((corner, corner), (corner, -corner), (-corner, corner), (-corner, -corner)) # Same order as 'config.modules'
+        self.locations = np.array(locations, dtype=float) # (modules, 2) meters, robot relative
+
+        self.moduleMaxSpeed = moduleMaxSpeed or config.calculations.moduleMaxSpeed # Meters/second
+        self.steeringRate = steeringRate or config.calculations.moduleMaxAngularVelocity # Radians/second
+        self.steeringAcceleration = steeringAcceleration or config.calculations.moduleMaxAngularAcceleration # Radians/second^2
+
+    def constraints(self, data: dict, u: np.ndarray):
+        '''
+        Max velocity, acceleration and angular velocity (radians) at every sample, from the global constraints and the
+        constraint zones, and which of them each sample uses (0 for the global constraints, 1 + the index of a zone)
+        '''
+        def values(constraints: dict):
+            return (constraints['maxVelocity'], constraints['maxAcceleration'], math.radians(constraints['maxAngularVelocity']))
+
+        result = np.empty((3, u.size))
+        result[:] = np.array(values(data['globalConstraints']))[:, None]
+        zones = np.zeros(u.size, dtype=np.uint8)
+
+        # Where zones overlap PathPlanner uses the first one, so it is applied last
+        for index, zone in reversed(list(enumerate(data.get('constraintZones', ())))):
+            inside = (u >= zone['minWaypointRelativePos']) & (u <= zone['maxWaypointRelativePos'])
+            result[:, inside] = np.array(values(zone['constraints']))[:, None]
+            zones[inside] = index + 1
+        return result, zones
+
+    @staticmethod
+    def rotationTargets(data: dict, u: np.ndarray, distance: np.ndarray):
+        '''
+        Robot heading (radians) and its rate (radians per meter) at every sample
+
+        Same as PathPlanner: the heading turns the short way from one rotation target to the next, in proportion to the
+        distance between them. A 'rotateFast' target is asked for right away
+        '''
+        targets = sorted(
+            (target['waypointRelativePos'], math.radians(target['rotationDegrees']), target.get('rotateFast', False))
+            for target in data.get('rotationTargets', ())
+        )
+        targets.append((u[-1], math.radians(data['goalEndState']['rotation']), data['goalEndState'].get('rotateFast', False)))
+
+        # Unwrapped heading of every target, each reached the short way from the one before
+        headings = [math.radians((data.get('previewStartingState') or {}).get('rotation', 0.0))]
+        for _, target, _ in targets:
+            headings.append(headings[-1] + math.remainder(target - headings[-1], 2.0 * math.pi))
+        headings = np.array(headings)
+        targetDistances = np.concatenate(((0.0,), np.interp([target[0] for target in targets], u, distance)))
+        rotateFast = np.array([False] + [target[2] for target in targets])
+
+        # Index of the next target of every sample (a sample on a target belongs to it)
+        following = np.minimum(np.searchsorted(targetDistances[1:], distance, side='left') + 1, len(targets))
+        start, end = targetDistances[following - 1], targetDistances[following]
+        span = np.maximum(end - start, 1e-9)
+        progress = np.clip((distance - start) / span, 0.0, 1.0)
+
+        fast = rotateFast[following]
+        change = headings[following] - headings[following - 1]
+        rotation = np.where(fast, headings[following], headings[following - 1] + change * progress)
+        rotationRate = np.where(fast | (end - start < 1e-9), 0.0, change / span)
+        return rotation, rotationRate
+
+    def profile(self, data: dict, name: str = '', startVelocity: float = None, endVelocity: float = None):
+        '''
+        Profiles a path (the json of a '.path' file). Returns a 'VelocityProfile'
+        '''
+        if data.get('choreoTrajectory'):
+            errorMsg(f"'{name}' is a Choreo path, which is already time parameterized", None)
+
+        u, position, first, second = bezierSamples(data['waypoints'], SAMPLE_SPACING)
+        distance = np.concatenate(((0.0,), np.cumsum(np.hypot(*np.diff(position, axis=0).T))))
+        step = np.diff(distance)
+
+        travel = np.arctan2(first[:, 1], first[:, 0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            curvature = np.nan_to_num((first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0]) / np.hypot(*first.T) ** 3)
+
+        (maxVelocity, maxAcceleration, maxAngularVelocity), zones = self.constraints(data, u)
+        rotation, rotationRate = self.rotationTargets(data, u, distance)
+
+        # Velocity of every module per meter/second of the robot (field relative): travel + rotation x location
+        cos, sin = np.cos(rotation), np.sin(rotation)
+        locationX = cos[:, None] * self.locations[:, 0] - sin[:, None] * self.locations[:, 1]
+        locationY = sin[:, None] * self.locations[:, 0] + cos[:, None] * self.locations[:, 1]
+        moduleX = np.cos(travel)[:, None] - rotationRate[:, None] * locationY
+        moduleY = np.sin(travel)[:, None] + rotationRate[:, None] * locationX
+        moduleSpeed = np.hypot(moduleX, moduleY)
+
+        # Steering angle of every module (robot relative) and how fast it changes along the path
+        steering = np.unwrap(np.arctan2(moduleY, moduleX) - rotation[:, None], axis=0)
+        steeringRate = np.gradient(steering, distance, axis=0)
+        steeringAcceleration = np.gradient(steeringRate, distance, axis=0)
+        moving = moduleSpeed > STOPPED_MODULE
+        steeringRate = np.abs(np.where(moving, steeringRate, 0.0)).max(axis=1)
+        steeringAcceleration = np.abs(np.where(moving, steeringAcceleration, 0.0)).max(axis=1)
+        moduleFactor = moduleSpeed.max(axis=1)
+
+        # Highest velocity squared allowed at each sample by every limit (same order as 'LIMITS')
+        with np.errstate(divide='ignore'):
+            limits = np.stack((
+                maxVelocity ** 2,
+                maxAcceleration / np.abs(curvature), # Like PathPlanner
+                (maxAngularVelocity / np.abs(rotationRate)) ** 2,
+                (self.moduleMaxSpeed / moduleFactor) ** 2,
+                (self.steeringRate / steeringRate) ** 2,
+                self.steeringAcceleration / steeringAcceleration
+            ))
+        limit = limits.min(axis=0)
+
+        goal = data['goalEndState']['velocity'] if endVelocity is None else endVelocity
+        start = (data.get('previewStartingState') or {}).get('velocity', 0.0) if startVelocity is None else startVelocity
+        limit[0] = min(limit[0], start ** 2)
+        limit[-1] = min(limit[-1], goal ** 2)
+
+        # Forward (accelerating) and backward (braking) passes on the velocity squared, v1^2 <= v0^2 + 2 * a * ds. With
+        # 'reach' the sum of 2 * a * ds so far, 'v^2 - reach' can only go down along the path: one running minimum
+        reach = np.concatenate(((0.0,), np.cumsum(2.0 * maxAcceleration[1:] * step)))
+        forward = np.minimum.accumulate(limit - reach) + reach
+        reach = np.concatenate(((0.0,), np.cumsum(2.0 * maxAcceleration[:-1][::-1] * step[::-1])))
+        backward = (np.minimum.accumulate(limit[::-1] - reach) + reach)[::-1]
+        velocity = np.sqrt(np.maximum(np.minimum(forward, backward), 0.0))
+
+        return VelocityProfile(name, u, distance, position, travel, rotation, rotationRate, moduleFactor, velocity, limits.argmin(axis=0), zones)
+
+    def pathPlannerTimes(self, data: dict, profile: VelocityProfile):
+        '''
+        Time PathPlanner's own profile takes to drive the path, as generated and once the drivetrain slows it down so
+        no module goes faster than 'moduleMaxSpeed'. Returns (generated, desaturated) in seconds
+
+        Both are integrated over the samples of 'profile' like its own time, with a constant acceleration between
+        PathPlanner's states (the total time PathPlanner reports is off by the length of one state at each end)
+        '''
+        import pathplannerlib.path as pplpath
+        import pathplannerlib.trajectory as ppltrajectory
+        from wpimath.kinematics import ChassisSpeeds
+
+        path = pplpath.PathPlannerPath._fromJson(data)
+        states = ppltrajectory.PathPlannerTrajectory(path, ChassisSpeeds(), path.getPreviewStartingHolonomicPose().rotation()).getStates()
+        positions = np.array([(state.positionMeters.X(), state.positionMeters.Y()) for state in states])
+        distance = np.concatenate(((0.0,), np.cumsum(np.hypot(*np.diff(positions, axis=0).T))))
+        velocity = np.sqrt(np.interp(profile.distance, distance * (profile.distance[-1] / distance[-1]), [state.velocityMps ** 2 for state in states]))
+        desaturated = velocity * np.minimum(1.0, self.moduleMaxSpeed / np.maximum(velocity * profile.moduleFactor, 1e-9))
+
+        step = np.diff(profile.distance)
+        with np.errstate(divide='ignore'):
+            return tuple(float(np.sum(2.0 * step / (speed[1:] + speed[:-1]))) for speed in (velocity, desaturated))
+
+def main(arguments: list):
+    # wpilib looks for 'deploy' next to the main script when it is first imported, so pretend to be 'robot.py'
+    import __main__
+    robotDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __main__.__file__ = os.path.join(robotDirectory, 'robot.py')
+    sys.path.insert(0, robotDirectory)
+
+    from wpilib import getDeployDirectory
+    pathsDirectory = os.path.join(getDeployDirectory(), 'pathplanner', 'paths')
+    tablesDirectory = os.path.join(getDeployDirectory(), TABLES_DIRECTORY)
+    names = arguments or sorted(fileName[:-len('.path')] for fileName in os.listdir(pathsDirectory) if fileName.endswith('.path'))
+
+    profiler = VelocityProfiler()
+    for name in names:
+        with open(os.path.join(pathsDirectory, name + '.path'), 'rb') as pathFile:
+            content = pathFile.read()
+        data = json.loads(content)
+
+        profile = profiler.profile(data, name)
+        generated, desaturated = profiler.pathPlannerTimes(data, profile)
+        tablePath = os.path.join(tablesDirectory, name + '.npy')
+        profile.save(tablePath, data, hashlib.sha1(content).hexdigest())
+
+        successMsg(f"'{name}': {profile.lapTime:.2f} s over {profile.distance[-1]:.2f} m (PathPlanner's profile: {generated:.2f} s, {desaturated:.2f} s once the module speeds are desaturated)")
+        debugMsg('  Limited by ' + ', '.join(f'{limit} {share:.0%}' for limit, share in profile.limitShares().items() if share > 0.0))
+        debugMsg(f"  Wrote '{tablePath}' (followed instead of PathPlanner's trajectory until the path changes)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
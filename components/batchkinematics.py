@@ -0,0 +1,262 @@
+# Swerve kinematics on NumPy arrays, for evaluating thousands of chassis speeds at once (trajectory analysis, tuning)
+# Same math as wpimath's SwerveDrive4Kinematics, SwerveModuleState.optimize and SwerveDrive4Odometry, to floating point
+# rounding. Not used by the robot loop (see 'components/controlpath.py' for that)
+import math
+
+import numpy as np
+
+from config import robotconfig
+
+TWO_PI = 2.0 * math.pi
+
+def wrapAngle(angles: np.ndarray):
+    '''
+    Wraps angles (radians) to [-pi, pi], like Rotation2d normalizes them (without the sine, cosine and atan2)
+    '''
+    return angles - TWO_PI * np.rint(angles / TWO_PI)
+
+def cosSin(angles: np.ndarray):
+    '''
+    Cosine and sine of angles (radians) from the tangent of the half angle
+
+    NumPy's float64 sine and cosine are not vectorized, its tangent is (about seven times faster for both)
+    '''
+    tangent = np.tan(0.5 * angles)
+    squared = tangent * tangent
+    denominator = 1.0 + squared
+    return (1.0 - squared) / denominator, 2.0 * tangent / denominator
+
+# Samples processed at a time by 'BatchKinematics.moduleStates()', small enough for the arrays to stay in the CPU cache
+BLOCK_SIZE = 4096
+
+class BatchKinematics:
+    '''
+    # BatchKinematics
+    Inverse and forward swerve kinematics on arrays of samples
+
+    Chassis speeds are (N, 3) arrays of (vx meters/second, vy meters/second, omega radians/second). Module states are
+    (N, 4, 2) arrays of (speed meters/second, angle radians) per module, in the same order as the drivetrain kinematics.
+    Module positions have the same layout with the distance (meters) in place of the speed
+
+    Example:
+        kinematics = BatchKinematics.fromConfig()
+        states = kinematics.moduleStates(speeds, headings, period=0.02, currentAngles=angles)
+    '''
+    def __init__(self, locations: tuple, maxSpeed: float = None):
+        '''
+        'locations' are the (x, y) of each module (meters, Translation2d works too), 'maxSpeed' the fastest a module can go
+        '''
+        self.locations = np.array([(location[0], location[1]) for location in locations], dtype=float)
+        self.maxSpeed = maxSpeed
+        self.modules = len(self.locations)
+
+        # Rows (vx, vy) of each module: [1, 0, -y] and [0, 1, x] (center of rotation at the middle of the robot)
+        inverse = np.zeros((self.modules, 2, 3))
+        inverse[:, 0, 0] = 1.0
+        inverse[:, 1, 1] = 1.0
+        inverse[:, 0, 2] = -self.locations[:, 1]
+        inverse[:, 1, 2] = self.locations[:, 0]
+        self.inverse = inverse.reshape(self.modules * 2, 3)
+        self.inverseX = np.ascontiguousarray(inverse[:, 0, :].T) # (3, modules), so each product is a contiguous array
+        self.inverseY = np.ascontiguousarray(inverse[:, 1, :].T)
+
+        # Least squares solution of the inverse kinematics (wpimath uses a QR decomposition of the same matrix)
+        self.forward = np.linalg.pinv(self.inverse)
+
+    @classmethod
+    def fromConfig(cls, config: robotconfig.RobotConfig = None):
+        '''
+        Module locations and 'MODULE_MAX_SPEED' from 'constants.json' (no hardware needed)
+        '''
+        config = config or robotconfig.get()
+        modules = (config.frontLeft, config.frontRight, config.rearLeft, config.rearRight)
+        return cls(tuple(module.location for module in modules), config.calculations.moduleMaxSpeed)
+
+    @classmethod
+    def fromDrivetrain(cls, drivetrain):
+        '''
+        Module locations and maximum speed of a 'Drivetrain'
+        '''
+        return cls(tuple(module.location for module in drivetrain.modules), drivetrain.moduleMaxSpeed)
+
+    def fromFieldRelative(self, speeds: np.ndarray, headings: np.ndarray):
+        '''
+        ChassisSpeeds.fromFieldRelativeSpeeds() for every sample, with 'headings' the (N,) robot headings in radians
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        cos, sin = cosSin(-np.asarray(headings, dtype=float))
+        result = speeds.copy()
+        result[:, 0] = speeds[:, 0] * cos - speeds[:, 1] * sin
+        result[:, 1] = speeds[:, 0] * sin + speeds[:, 1] * cos
+        return result
+
+    def discretize(self, speeds: np.ndarray, period: float):
+        '''
+        ChassisSpeeds.discretize() for every sample: speeds of the twist that ends where driving 'speeds' for 'period'
+        seconds would
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        dx = speeds[:, 0] * period
+        dy = speeds[:, 1] * period
+        dtheta = wrapAngle(speeds[:, 2] * period)
+
+        # Pose2d().log(): the translation rotated by (halfThetaByTanOfHalfDtheta, -halfDtheta), without normalizing
+        # that rotation and scaling it back up. 'cos(dtheta) - 1' loses precision for small rotations; it is computed
+        # the same way as wpimath (not from 'cosSin()') so the results agree there too
+        halfDtheta = dtheta / 2.0
+        cosMinusOne = np.cos(dtheta) - 1.0
+        small = np.abs(cosMinusOne) < 1e-9
+        halfThetaByTanOfHalfDtheta = np.where(
+            small,
+            1.0 - 1.0 / 12.0 * dtheta * dtheta,
+            -(halfDtheta * np.sin(dtheta)) / np.where(small, 1.0, cosMinusOne)
+        )
+
+        result = np.empty_like(speeds)
+        result[:, 0] = (dx * halfThetaByTanOfHalfDtheta + dy * halfDtheta) / period
+        result[:, 1] = (dy * halfThetaByTanOfHalfDtheta - dx * halfDtheta) / period
+        result[:, 2] = dtheta / period
+        return result
+
+    def toModuleStates(self, speeds: np.ndarray, initialAngles: np.ndarray = None):
+        '''
+        SwerveDrive4Kinematics.toSwerveModuleStates() for every sample. Returns (N, 4, 2) module states
+
+        Like wpimath, a sample with all speeds zero keeps the module angles of the sample before it ('initialAngles'
+        for the first samples, zero if not given)
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        x = speeds @ self.inverseX
+        y = speeds @ self.inverseY
+
+        states = np.empty((len(speeds), self.modules, 2))
+        speed = states[..., 0]
+        np.sqrt(x * x + y * y, out=speed)
+        angle = states[..., 1]
+        np.arctan2(y, x, out=angle)
+        np.copyto(angle, 0.0, where=speed <= 1e-6) # Rotation2d of a zero length vector
+
+        # Stopped samples keep the angles of the last moving sample
+        stopped = (speeds[:, 0] == 0.0) & (speeds[:, 1] == 0.0) & (speeds[:, 2] == 0.0)
+        if stopped.any():
+            lastMoving = np.where(stopped, -1, np.arange(len(speeds)))
+            np.maximum.accumulate(lastMoving, out=lastMoving)
+            initial = np.zeros(self.modules) if initialAngles is None else np.asarray(initialAngles, dtype=float)
+            angles = np.vstack((initial[None, :], angle))
+            states[:, :, 1] = angles[lastMoving + 1]
+            np.copyto(speed, 0.0, where=stopped[:, None])
+        return states
+
+    def desaturate(self, states: np.ndarray, maxSpeed: float = None):
+        '''
+        SwerveDrive4Kinematics.desaturateWheelSpeeds() for every sample: when a module of a sample is faster than
+        'maxSpeed' (default 'MODULE_MAX_SPEED'), every module of that sample is slowed down by the same ratio
+        '''
+        maxSpeed = self.maxSpeed if maxSpeed is None else maxSpeed
+        states = np.array(states, dtype=float)
+        speeds = states[..., 0]
+        fastest = np.abs(speeds[:, 0])
+        for module in range(1, self.modules):
+            np.maximum(fastest, np.abs(speeds[:, module]), out=fastest) # Faster than '.max(axis=1)' over so few modules
+        saturated = (fastest > maxSpeed)[:, None]
+        np.divide(speeds, fastest[:, None], out=speeds, where=saturated)
+        np.multiply(speeds, maxSpeed, out=speeds, where=saturated)
+        return states
+
+    def optimize(self, states: np.ndarray, currentAngles: np.ndarray):
+        '''
+        SwerveModuleState.optimize() for every module of every sample: a module more than 90 degrees from its
+        'currentAngles' (N, 4 radians) turns the other way and drives backwards
+        '''
+        states = np.array(states, dtype=float)
+        turns = (states[..., 1] - np.asarray(currentAngles, dtype=float)) / TWO_PI
+        flip = np.abs(turns - np.rint(turns)) > 0.25 # More than a quarter turn away, the short way around
+        speeds = states[..., 0]
+        angles = states[..., 1]
+        np.negative(speeds, out=speeds, where=flip)
+        angles -= flip * np.copysign(math.pi, angles) # Half a turn, staying in [-pi, pi]
+        return states
+
+    def moduleStates(self, speeds: np.ndarray, headings: np.ndarray = None, period: float = None, currentAngles: np.ndarray = None,
+                    desaturate: bool = False, initialAngles: np.ndarray = None):
+        '''
+        Module setpoints for (N, 3) chassis speeds, every step in the same order as the robot:
+        field relative speeds are rotated by 'headings' (if given), discretized over 'period' seconds (if given),
+        turned into module states and optimized against 'currentAngles' (N, 4 radians, if given). Returns (N, 4, 2) module states
+
+        The robot does not desaturate its module speeds ('Drivetrain.drive()', 'ControlPath.update()' without 'maxSpeed'),
+        so neither does this by default. With 'desaturate' they are limited to 'MODULE_MAX_SPEED' before they are optimized
+
+        Samples are processed in blocks of 'BLOCK_SIZE', which is about 1.5 times faster than whole arrays
+        '''
+        speeds = np.asarray(speeds, dtype=float)
+        states = np.empty((len(speeds), self.modules, 2))
+
+        for start in range(0, len(speeds), BLOCK_SIZE):
+            end = start + BLOCK_SIZE
+            block = speeds[start:end]
+            if headings is not None:
+                block = self.fromFieldRelative(block, headings[start:end])
+            if period is not None:
+                block = self.discretize(block, period)
+
+            blockStates = self.toModuleStates(block, initialAngles)
+            initialAngles = blockStates[-1, :, 1] # Kept by stopped samples of the next block
+            if desaturate:
+                blockStates = self.desaturate(blockStates)
+            if currentAngles is not None:
+                blockStates = self.optimize(blockStates, currentAngles[start:end])
+            states[start:end] = blockStates
+
+        return states
+
+    def toChassisSpeeds(self, states: np.ndarray):
+        '''
+        SwerveDrive4Kinematics.toChassisSpeeds() for every sample (least squares fit of the module states)
+        '''
+        states = np.asarray(states, dtype=float)
+        cos, sin = cosSin(states[..., 1])
+        components = np.empty(states.shape)
+        np.multiply(states[..., 0], cos, out=components[..., 0])
+        np.multiply(states[..., 0], sin, out=components[..., 1])
+        return components.reshape(len(states), self.modules * 2) @ self.forward.T
+
+    def integrateOdometry(self, positions: np.ndarray, gyroAngles: np.ndarray = None, startPose: tuple = (0.0, 0.0, 0.0)):
+        '''
+        SwerveDrive4Odometry for a whole log. 'positions' are (N, 4, 2) module positions, the first one taken at 'startPose'
+        (x, y, heading radians). Returns the (N, 3) poses
+
+        With 'gyroAngles' (N radians) the heading comes from the gyro as in wpimath, otherwise from the wheels
+        '''
+        positions = np.asarray(positions, dtype=float)
+        deltas = np.empty((len(positions) - 1, self.modules, 2))
+        deltas[..., 0] = np.diff(positions[..., 0], axis=0)
+        deltas[..., 1] = positions[1:, :, 1]
+        twists = self.toChassisSpeeds(deltas) # Same math as 'toTwist2d()'
+
+        startX, startY, startHeading = startPose
+        if gyroAngles is not None:
+            gyroAngles = np.asarray(gyroAngles, dtype=float)
+            headings = wrapAngle(gyroAngles - gyroAngles[0] + startHeading)
+            twists[:, 2] = wrapAngle(np.diff(headings))
+        else:
+            headings = wrapAngle(startHeading + np.concatenate(([0.0], np.cumsum(twists[:, 2]))))
+
+        # Pose2d.exp() of each twist, from the heading at the start of the step
+        # 'sin(dtheta)' and '1 - cos(dtheta)' come from the tangent of the half angle (see 'cosSin()')
+        dx, dy, dtheta = twists[:, 0], twists[:, 1], twists[:, 2]
+        small = np.abs(dtheta) < 1e-9
+        safeDtheta = np.where(small, 1.0, dtheta)
+        tangent = np.tan(0.5 * dtheta)
+        denominator = 1.0 + tangent * tangent
+        s = np.where(small, 1.0 - 1.0 / 6.0 * dtheta * dtheta, 2.0 * tangent / denominator / safeDtheta)
+        c = np.where(small, 0.5 * dtheta, 2.0 * tangent * tangent / denominator / safeDtheta)
+        localX = dx * s - dy * c
+        localY = dx * c + dy * s
+
+        cos, sin = cosSin(headings[:-1])
+        poses = np.empty((len(positions), 3))
+        poses[:, 0] = startX + np.concatenate(([0.0], np.cumsum(localX * cos - localY * sin)))
+        poses[:, 1] = startY + np.concatenate(([0.0], np.cumsum(localX * sin + localY * cos)))
+        poses[:, 2] = headings
+        return poses
@@ -1,128 +1,159 @@
 # Streamlines implementation of periphierals like xbox controllers, keybaords, button stations, etc.
+import functools
+
 import wpilib
-from wpimath import applyDeadband
-from wpimath.filter import SlewRateLimiter
 
 from extras.debugmsgs import *
-import numpy as np
-
-# Load constants from the json file
-import json
-with open('constants.json') as jsonf:
-	constants = json.load(jsonf)
-	jsonf.close()
+from config import robotconfig
+from .inputshaping import InputShaper
+
+# Bit of each button in 'DriverStation.getStickButtons()' (button n is bit n - 1)
+BUTTON_BITS = {
+    'A': 1 << (wpilib.XboxController.Button.kA - 1),
+    'B': 1 << (wpilib.XboxController.Button.kB - 1),
+    'X': 1 << (wpilib.XboxController.Button.kX - 1),
+    'Y': 1 << (wpilib.XboxController.Button.kY - 1),
+    'L_BUMPER': 1 << (wpilib.XboxController.Button.kLeftBumper - 1),
+    'R_BUMPER': 1 << (wpilib.XboxController.Button.kRightBumper - 1),
+    'BACK': 1 << (wpilib.XboxController.Button.kBack - 1),
+    'START': 1 << (wpilib.XboxController.Button.kStart - 1),
+    'L_STICK': 1 << (wpilib.XboxController.Button.kLeftStick - 1),
+    'R_STICK': 1 << (wpilib.XboxController.Button.kRightStick - 1)
+}
 
 class XboxController():
     '''
     # XboxController
     Module which streamlines controll of an Xbox controller
     '''
-    def __init__(self, instance: object):
+    def __init__(self, instance: object, aux: bool = False):
         '''
         Constructs the controller class
 
-        The 'instance' argument should be the object of your robot
+        The 'instance' argument should be the object of your robot.
+        Set 'aux' to use the auxiliary controller port and the 'AUX_MACROS' of 'constants.json'
         '''
         self.instance = instance # The instance should be the name of the class of your robot
+        self.aux = aux
+        config = robotconfig.get()
+        port = config.controller.auxId if aux else config.controller.mainId
 
         # Define our controller
-        self.wpilibController = wpilib.XboxController(constants['CONTROLLER_CONSTANTS']['CONTROLLER_MAIN_ID'])
+        self.wpilibController = wpilib.XboxController(port)
+
+        # Reads every button of the controller as one bitmask (see 'BUTTON_BITS')
+        self.getButtons = functools.partial(wpilib.DriverStation.getStickButtons, port)
+        self.buttons = 0 # Buttons held during the last call to 'executeMacros()'
 
-        # Slew rate limiters to make joystick inputs more gentle; 1/3 sec from 0 to 1.
-        self.xSpeedLimiter = SlewRateLimiter(constants['CONTROLLER_CONSTANTS']['CONTROLLER_RATE_LIMIT'])
-        self.ySpeedLimiter = SlewRateLimiter(constants['CONTROLLER_CONSTANTS']['CONTROLLER_RATE_LIMIT'])
-        self.rotLimiter = SlewRateLimiter(constants['CONTROLLER_CONSTANTS']['CONTROLLER_RATE_LIMIT'])
+        # Values read every tick are copied here so 'getSwerveValues()' does not look anything up
+        self.shaper = None
+        self.applyConfig(config)
+        robotconfig.subscribe(self.applyConfig)
 
         # Define our swervemodule speeds
         self.xSpeed = 0
         self.ySpeed = 0
         self.rot = 0 # Rotation of robot (rotates robot without moving its X and Y position)
 
-        # An array of all of the boolean values that we can bind a macro too
-        self.values = np.array([
-            self.wpilibController.getStartButtonReleased(),
-            self.wpilibController.getAButtonReleased(),
-            self.wpilibController.getBButtonReleased(),
-            self.wpilibController.getXButtonReleased(),
-            self.wpilibController.getYButtonReleased(),
-            self.wpilibController.getLeftBumperReleased(),
-            self.wpilibController.getRightBumperReleased(),
-            self.wpilibController.getLeftStickButtonReleased(),
-            self.wpilibController.getRightStickButtonReleased()
-        ])
-
-        # Eack key can be set in 'constants.json' to carry out a function in annother python script
-        self.macroNames = [constants['CONTROLLER_CONSTANTS']['MACROS'][key] for key in ['START', 'A', 'B', 'X', 'Y', 'L_BUMPER', 'R_BUMPER', 'L_STICK', 'R_STICK']]
-
-    def executeMacros(self, macros = None): # Add this to the 'robotPeriodic()' method
+    def applyConfig(self, config):
         '''
-        Use boolean indexing to execute functions for pressed buttons
+        Copies the values used by the periodic methods from the robot configuration
         '''
+        controller = config.controller
+
+        # Joystick shaping (see 'components/inputshaping.py'). Slow mode stays on through a config reload
+        slow = self.shaper is not None and self.shaper.speedScale != 1.0
+        self.shaper = InputShaper(
+            config.calculations.motorDeadband,
+            controller.translationExpo,
+            controller.rotationExpo,
+            controller.rateLimit,
+            controller.rotationRateLimit,
+            config.calculations.chassisMaxSpeed,
+            controller.maxRotationSpeed,
+            controller.slowModeScale
+        )
+        self.shaper.setSlowMode(slow)
+
+        self.compileMacros(config.controller.auxMacros if self.aux else config.controller.macros)
 
-        # Update array of values
-        self.values = np.array([
-            self.wpilibController.getStartButtonReleased(),
-            self.wpilibController.getAButtonReleased(),
-            self.wpilibController.getBButtonReleased(),
-            self.wpilibController.getXButtonReleased(),
-            self.wpilibController.getYButtonReleased(),
-            self.wpilibController.getLeftBumperReleased(),
-            self.wpilibController.getRightBumperReleased(),
-            self.wpilibController.getLeftStickButtonReleased(),
-            self.wpilibController.getRightStickButtonReleased()
-        ])
-
-
-        trueValues = np.where(self.values == True)[0]
-
-        for index in trueValues:
-            try:
-                if macros is not None and self.macroNames[index] in macros:
-                    macroToCall = getattr(self.instance, self.macroNames[index])
-
-                    if macroToCall and callable(macroToCall):
-                        macroToCall()
-                    else:
-                        debugMsg(f"Method '{self.macroNames[index]}' not found or not callable.", None)
-
-                elif macros == None:
-                    # If the user did not filter specific macros, just execute all macros if their cooresponding buttons were pressed
-                    macroToCall = getattr(self.instance, self.macroNames[index])
-
-                    if macroToCall and callable(macroToCall):
-                        macroToCall()
-                    else:
-                        debugMsg(f"Method '{self.macroNames[index]}' not found or not callable.", None)
-            except Exception as e:
-                debugMsg(f'While indexing macros: {e}')
-        
-    def getSwerveValues(self):
+    def compileMacros(self, macros: tuple):
         '''
-        Returns calculated values from xbox controller input to appropriate drivetrain values (explicitly for swervemodules)
+        Resolves each macro in 'constants.json' to a bitmask of its buttons and a bound method of the robot
+
+        Done once (and again on config reload), so 'executeMacros()' does no lookups or reflection
         '''
-        # Get the x speed. We are inverting this because Xbox controllers return
-        # negative values when we push forward.
-        self.xSpeed = (
-            -self.xSpeedLimiter.calculate(
-                applyDeadband(self.wpilibController.getLeftX(), 0.02)) * constants['CALCULATIONS']['CHASSIS_MAX_SPEED']
-        )
+        bindings = {'PRESS': [], 'RELEASE': [], 'HOLD': []}
+
+        for macro in macros:
+            unknownButtons = [button for button in macro.buttons if button not in BUTTON_BITS]
+            macroToCall = getattr(self.instance, macro.method, None)
+
+            if unknownButtons:
+                debugMsg(f"Macro '{macro.method}' uses unknown button(s) {unknownButtons}")
+            elif macroToCall is None or not callable(macroToCall):
+                debugMsg(f"Method '{macro.method}' not found or not callable.")
+            else:
+                mask = 0
+                for button in macro.buttons:
+                    mask |= BUTTON_BITS[button]
+                bindings[macro.event].append((mask, macroToCall))
+
+        self.pressMacros = tuple(bindings['PRESS'])
+        self.releaseMacros = tuple(bindings['RELEASE'])
+        self.holdMacros = tuple(bindings['HOLD'])
+
+    def executeMacros(self): # Add this to the 'robotPeriodic()' method
+        '''
+        Runs the macros whose buttons were pressed, released or held since the last call
 
-        # Get the y speed or sideways/strafe speed. We are inverting this because
-        # we want a positive value when we pull to the left. Xbox controllers
-        # return positive values when you pull to the right by default.
-        self.ySpeed = (
-            -self.ySpeedLimiter.calculate(
-                applyDeadband(self.wpilibController.getLeftY(), 0.02)) * constants['CALCULATIONS']['CHASSIS_MAX_SPEED']
-        )
+        A chord ("L_BUMPER+A") is pressed when its last button goes down and released when any of its buttons comes up
+        '''
+        previous = self.buttons
+        buttons = self.buttons = self.getButtons()
+
+        if buttons != previous:
+            for mask, macroToCall in self.pressMacros:
+                if buttons & mask == mask and previous & mask != mask:
+                    self._runMacro(macroToCall)
+
+            for mask, macroToCall in self.releaseMacros:
+                if previous & mask == mask and buttons & mask != mask:
+                    self._runMacro(macroToCall)
+
+        if buttons:
+            for mask, macroToCall in self.holdMacros:
+                if buttons & mask == mask:
+                    self._runMacro(macroToCall)
+
+    def _runMacro(self, macroToCall):
+        try:
+            macroToCall()
+        except Exception as e: # A failing macro should not stop the others (or the robot loop)
+            debugMsg(f"Macro '{macroToCall.__name__}' failed: {e}")
+
+    def getSwerveValues(self, periodSeconds: float = 0.02):
+        '''
+        Returns calculated values from xbox controller input to appropriate drivetrain values (explicitly for swervemodules)
 
-        # Get the rate of angular rotation. We are inverting this because we want a
-        # positive value when we pull to the left (remember, CCW is positive in
-        # mathematics). Xbox controllers return positive values when you pull to
-        # the right by default.
-        self.rot = (
-            -self.rotLimiter.calculate(
-                applyDeadband(self.wpilibController.getRightX(), 0.02)) * constants['CALCULATIONS']['CHASSIS_MAX_SPEED']
+        'periodSeconds' is the time since the last call (the loop period), used by the slew rate limits
+        '''
+        controller = self.wpilibController
+
+        # The axes are inverted because Xbox controllers return negative values when pushed forward, and positive
+        # values when pulled to the right (we want positive values to the left, CCW is positive in mathematics)
+        self.xSpeed, self.ySpeed, self.rot = self.shaper.update(
+            -controller.getLeftX(),
+            -controller.getLeftY(),
+            -controller.getRightX(),
+            periodSeconds
         )
 
+    def setSlowMode(self, slow: bool):
+        '''
+        Scales the speeds down by 'CONTROLLER_SLOW_MODE_SCALE' (ramped in by the slew rate limits)
+        '''
+        self.shaper.setSlowMode(slow)
+
     def rumble(self, intensity: float = 0.0): # Sets the vibration intensity of the xbox controller
         self.wpilibController.setRumble(self.wpilibController.RumbleType.kBothRumble, intensity)
\ No newline at end of file
@@ -0,0 +1,189 @@
+# Allocation-free path from chassis speeds to swerve module setpoints
+# Same math as wpimath (ChassisSpeeds.fromFieldRelativeSpeeds and discretize, SwerveDrive4Kinematics.toSwerveModuleStates
+# and desaturateWheelSpeeds, SwerveModuleState.optimize), in the same order of operations so every result is bit for bit
+# the same, but on plain floats kept in objects made once instead of new wpimath objects every tick
+import ctypes
+import ctypes.util
+import math
+
+# wpimath uses the C library's hypot, which rounds differently than 'math.hypot' about once every thousand calls
+_libm = ctypes.util.find_library('m')
+if _libm:
+    hypot = ctypes.CDLL(_libm).hypot
+    hypot.restype = ctypes.c_double
+    hypot.argtypes = (ctypes.c_double, ctypes.c_double)
+else:
+    hypot = math.hypot # Results may differ from wpimath in the last bit
+
+# Rotation2d(180 degrees)
+HALF_TURN_COS = math.cos(math.pi)
+HALF_TURN_SIN = math.sin(math.pi)
+
+def degrees(radians: float):
+    '''
+    Radians -> degrees the way wpimath's units library converts them (not 'math.degrees()', which rounds differently)
+    '''
+    return radians * 180.0 / math.pi
+
+class ModuleSetpoint:
+    '''
+    # ModuleSetpoint
+    Speed and angle of one swerve module (a SwerveModuleState), overwritten by every 'ControlPath.update()'
+    '''
+    __slots__ = (
+        'speed', # Meters/second
+        'angle', 'cos', 'sin' # Radians, with the cosine and sine wpimath keeps for the angle
+    )
+
+    def __init__(self):
+        self.speed = 0.0
+        self.angle = 0.0
+        self.cos = 1.0
+        self.sin = 0.0
+
+class ControlPath:
+    '''
+    # ControlPath
+    Turns the requested chassis speeds into a 'ModuleSetpoint' for every module
+
+    Nothing is created per call: the setpoints are the same objects every tick, so the loop does not leave garbage behind.
+    Like the wpimath kinematics, a module keeps its last angle when the robot is asked to stop
+    '''
+    __slots__ = ('moduleX', 'moduleNegY', 'setpoints', 'vx', 'vy', 'omega')
+
+    def __init__(self, locations: tuple):
+        '''
+        'locations' are the Translation2d of the modules, in the same order as the kinematics
+        '''
+        # Column of the inverse kinematics matrix multiplied by omega (center of rotation at the middle of the robot)
+        self.moduleX = tuple(location.X() - 0.0 for location in locations)
+        self.moduleNegY = tuple(-location.Y() + 0.0 for location in locations)
+        self.setpoints = tuple(ModuleSetpoint() for _ in locations)
+
+        # Robot relative speeds after the last 'update()' (meters/second, radians/second)
+        self.vx = 0.0
+        self.vy = 0.0
+        self.omega = 0.0
+
+    def update(self, xSpeed: float, ySpeed: float, rotation: float, fieldRelative: bool, heading: float, periodSeconds: float, maxSpeed: float = None):
+        '''
+        Computes the module setpoints for the given speeds (meters/second, radians/second)
+
+        'heading' is the robot heading in radians (used if 'fieldRelative'). If 'maxSpeed' is given, every module is
+        slowed down by the same ratio so none goes faster than it
+        '''
+        # ChassisSpeeds.fromFieldRelativeSpeeds(): rotate by -heading
+        if fieldRelative:
+            cos = math.cos(-heading)
+            sin = math.sin(-heading)
+            vx = xSpeed * cos - ySpeed * sin
+            vy = xSpeed * sin + ySpeed * cos
+        else:
+            vx = float(xSpeed)
+            vy = float(ySpeed)
+        omega = float(rotation)
+
+        # ChassisSpeeds.discretize(): speeds of the twist that ends at the pose reached after one period
+        dx = vx * periodSeconds
+        dy = vy * periodSeconds
+        dtheta = omega * periodSeconds
+
+        # Pose2d(dx, dy, dtheta).relativeTo(Pose2d())
+        tx = dx * 1.0 - dy * -0.0
+        ty = dx * -0.0 + dy * 1.0
+        cos = math.cos(dtheta)
+        sin = math.sin(dtheta)
+        x = cos * 1.0 - sin * -0.0
+        y = cos * -0.0 + sin * 1.0
+        magnitude = hypot(x, y)
+        cos = x / magnitude
+        sin = y / magnitude
+        dtheta = math.atan2(sin, cos)
+
+        # Pose2d().log()
+        halfDtheta = dtheta / 2.0
+        cosMinusOne = cos - 1
+        if abs(cosMinusOne) < 1e-9:
+            halfThetaByTanOfHalfDtheta = 1.0 - 1.0 / 12.0 * dtheta * dtheta
+        else:
+            halfThetaByTanOfHalfDtheta = -(halfDtheta * sin) / cosMinusOne
+        magnitude = hypot(halfThetaByTanOfHalfDtheta, -halfDtheta)
+        cos = halfThetaByTanOfHalfDtheta / magnitude
+        sin = -halfDtheta / magnitude
+        scale = hypot(halfThetaByTanOfHalfDtheta, halfDtheta)
+        vx = (tx * cos - ty * sin) * scale / periodSeconds
+        vy = (tx * sin + ty * cos) * scale / periodSeconds
+        omega = dtheta / periodSeconds
+
+        self.vx = vx
+        self.vy = vy
+        self.omega = omega
+
+        setpoints = self.setpoints
+
+        # SwerveDrive4Kinematics.toSwerveModuleStates(): stopped modules keep their angle
+        if vx == 0 and vy == 0 and omega == 0:
+            for setpoint in setpoints:
+                setpoint.speed = 0.0
+            return
+
+        fastest = 0.0
+        for setpoint, moduleX, moduleNegY in zip(setpoints, self.moduleX, self.moduleNegY):
+            x = vx * 1.0 + vy * 0.0 + omega * moduleNegY
+            y = vx * 0.0 + vy * 1.0 + omega * moduleX
+            speed = setpoint.speed = hypot(x, y)
+            if speed > fastest:
+                fastest = speed
+
+            if speed > 1e-6:
+                setpoint.cos = cos = x / speed
+                setpoint.sin = sin = y / speed
+            else:
+                setpoint.cos = cos = 1.0 # wpimath reports an error for a zero length rotation
+                setpoint.sin = sin = 0.0
+            setpoint.angle = math.atan2(sin, cos)
+
+        # SwerveDrive4Kinematics.desaturateWheelSpeeds()
+        if maxSpeed is not None and fastest > maxSpeed:
+            for setpoint in setpoints:
+                setpoint.speed = setpoint.speed / fastest * maxSpeed
+
+def optimize(setpoint: ModuleSetpoint, currentAngle: float, target: ModuleSetpoint):
+    '''
+    SwerveModuleState.optimize(): turns the module the short way (reversing the drive) if the setpoint is more than
+    90 degrees from 'currentAngle' (radians). The result is written to 'target', 'setpoint' is left as it is
+    '''
+    cos = math.cos(-currentAngle)
+    sin = math.sin(-currentAngle)
+    x = setpoint.cos * cos - setpoint.sin * sin
+    y = setpoint.cos * sin + setpoint.sin * cos
+    magnitude = hypot(x, y)
+    if magnitude > 1e-6:
+        delta = math.atan2(y / magnitude, x / magnitude)
+    else:
+        delta = 0.0
+
+    if abs(degrees(delta)) > 90.0:
+        target.speed = -setpoint.speed
+        x = setpoint.cos * HALF_TURN_COS - setpoint.sin * HALF_TURN_SIN
+        y = setpoint.cos * HALF_TURN_SIN + setpoint.sin * HALF_TURN_COS
+        magnitude = hypot(x, y)
+        target.cos = cos = x / magnitude
+        target.sin = sin = y / magnitude
+        target.angle = math.atan2(sin, cos)
+    else:
+        target.speed = setpoint.speed
+        target.angle = setpoint.angle
+        target.cos = setpoint.cos
+        target.sin = setpoint.sin
+
+def cosineBetween(setpoint: ModuleSetpoint, currentAngle: float):
+    '''
+    Cosine of the angle from 'currentAngle' (radians) to the setpoint angle, as '(angle - currentRotation).cos()' gives it
+    '''
+    cos = math.cos(-currentAngle)
+    sin = math.sin(-currentAngle)
+    x = setpoint.cos * cos - setpoint.sin * sin
+    y = setpoint.cos * sin + setpoint.sin * cos
+    magnitude = hypot(x, y)
+    return x / magnitude if magnitude > 1e-6 else 1.0
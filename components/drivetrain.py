@@ -1,18 +1,27 @@
 # Stuck? https://github.com/robotpy/examples/blob/main/SwerveBot/drivetrain.py
+import atexit
+import math
+import threading
+from collections import deque
+
 import wpimath.units
 import wpimath.kinematics
-
-import navx
+import wpimath.estimator
+import wpimath.geometry
 
 from .swervemodule import SwerveModule
+from .controlpath import ControlPath
+from .posehistory import PoseHistory
+from .odometry import OdometryThread, OdometrySample
+from hardware import backend
+from hardware.health import health, FAULTED, STATUS_NAMES
+from hardware.motors import motorConfigurator
 
 from extras.debugmsgs import *
-
-# Load constants from the json file
-import json
-with open('constants.json') as jsonf:
-	constants = json.load(jsonf)
-	jsonf.close()
+from extras.profiler import profiler
+from extras.logger import logger
+from extras.telemetry import telemetry
+from config import robotconfig
 
 class Drivetrain():
 	'''
@@ -20,78 +29,257 @@ class Drivetrain():
 
 	Class that controlls components of the drivetrain (anything that moves the robot forwards, backwards, and sideways)
 	'''
+	# Drive modes (see 'updateMode()')
+	NORMAL = 'normal'
+	DEGRADED = 'degraded'
+	STOPPED = 'stopped'
+
 	def __init__(self):
+		self.hardware = backend.get()
+		config = robotconfig.get()
+
+		# The odometry thread and the robot loop both read the sensors, but only one of them at a time
+		# (phoenix6 status signals are refreshed in place). The pose estimator has its own lock
+		self.sensorLock = threading.Lock()
+		self.poseLock = threading.Lock()
+
 		try:
-			# Setup the gyro
-			self.navx = navx.AHRS.create_spi()
+			# Setup the gyro (sampled faster than the default 50 Hz when odometry runs on its own thread)
+			self.navx = self.hardware.createGyro(config.odometry.gyroUpdateRate if config.odometry.frequency > 0 else None)
 			self.zeroGyro()
 		except Exception as e:
 			errorMsg('Issue initializing NavX:',e,__file__)
-		
+
 		# Each member variable represents a 'swervemodule.SwerveModule()' object
-		self.swerveFrontLeft = SwerveModule(
-			constants['MOTOR_CONSTANTS']['MOTOR_DRIVE_FRONT_LEFT_ID'],
-			constants['MOTOR_CONSTANTS']['MOTOR_TURN_FRONT_LEFT_ID'],
-			constants['MOTOR_CONSTANTS']['ENCODER_TURN_FRONT_LEFT_ID'],
-			(constants['OFFSETS']['FRONT_LEFT'], constants['OFFSETS']['FRONT_LEFT'])
+		self.swerveFrontLeft = SwerveModule(config.frontLeft)
+		self.swerveFrontRight = SwerveModule(config.frontRight)
+		self.swerveBackLeft = SwerveModule(config.rearLeft)
+		self.swerveBackRight = SwerveModule(config.rearRight)
+
+		# Modules in the same order as the kinematics
+		self.modules = (
+			self.swerveFrontLeft,
+			self.swerveFrontRight,
+			self.swerveBackLeft,
+			self.swerveBackRight
 		)
-		
-		self.swerveFrontRight = SwerveModule(
-			constants['MOTOR_CONSTANTS']['MOTOR_DRIVE_FRONT_RIGHT_ID'],
-			constants['MOTOR_CONSTANTS']['MOTOR_TURN_FRONT_RIGHT_ID'],
-			constants['MOTOR_CONSTANTS']['ENCODER_TURN_FRONT_RIGHT_ID'],
-			(constants['OFFSETS']['FRONT_RIGHT'], -constants['OFFSETS']['FRONT_RIGHT'])
+
+		# Send the motor settings that changed since the last start and the status frame rates, to every device at once
+		# (before anything reads the encoders)
+		motorConfigurator.configureAll(config.motorSetup.burnFlash, config.motorSetup.parallelDevices)
+
+		# Every status signal of every module, refreshed together in one batched read per tick
+		self.sensorSignals = tuple(signal for module in self.modules for signal in module.getSignals())
+
+		# Logged every tick for post-match analysis (AdvantageScope reads these formats directly)
+		self.moduleStatesLog = logger.doubleArrayChannel('Drivetrain/moduleStates', 8) # (degrees, meters/second) per module
+		self.poseLog = logger.doubleArrayChannel('Drivetrain/pose', 3) # (x meters, y meters, heading radians)
+
+		# Sent to dashboards once per tick when they change (see 'extras/telemetry.py')
+		telemetryConfig = config.telemetry
+		moduleThresholds = (telemetryConfig.speedThreshold, telemetryConfig.angleThreshold) # (meters/second, radians)
+		self.moduleStatesTopic = telemetry.structArrayTopic('Drivetrain/moduleStates', wpimath.kinematics.SwerveModuleState, 4, moduleThresholds, telemetryConfig.maxRate)
+		self.moduleTargetsTopic = telemetry.structArrayTopic('Drivetrain/moduleTargets', wpimath.kinematics.SwerveModuleState, 4, moduleThresholds, telemetryConfig.maxRate)
+		self.poseTopic = telemetry.structTopic('Drivetrain/pose', wpimath.geometry.Pose2d, (telemetryConfig.positionThreshold, telemetryConfig.positionThreshold, telemetryConfig.angleThreshold), telemetryConfig.maxRate)
+		self.speedsTopic = telemetry.structTopic('Drivetrain/requestedSpeeds', wpimath.kinematics.ChassisSpeeds, telemetryConfig.speedThreshold, telemetryConfig.maxRate) # Robot relative
+
+		self.kinematics = wpimath.kinematics.SwerveDrive4Kinematics(
+			self.swerveFrontLeft.location,
+			self.swerveFrontRight.location,
+			self.swerveBackLeft.location,
+			self.swerveBackRight.location,
+		)
+
+		# Same math as the kinematics for 'drive()', on objects made once (see 'components/controlpath.py')
+		self.controlPath = ControlPath(tuple(module.location for module in self.modules))
+
+		# Health of the gyro. While it is not giving good readings the heading is estimated from the wheels
+		self.gyroHealth = health.device('NavX gyro')
+		self.gyroOk = self.hardware.gyroCheck(self.navx)
+		self.gyroFallback = False # Heading is being estimated from the wheels
+		self.gyroOffset = None # Added to the gyro after a fallback, so the heading does not jump when it comes back
+
+		# Drive mode picked from the health of the devices (see 'updateMode()')
+		self.mode = self.NORMAL
+		self.speedScale = 1.0
+		self.healthChanges = -1
+
+		self.sensorTimestamp = 0.0
+		self.gyroRotation = wpimath.geometry.Rotation2d() # Heading used during the current tick
+		self.gyroYaw = 0.0 # Raw gyro reading (radians, before 'gyroOffset') behind 'gyroRotation'
+		self.gyroHeading = self.gyroRotation # Newest heading, updated by 'readGyro()' (possibly on the odometry thread)
+		self.latestGyroYaw = 0.0
+		self.odometryThread = None
+
+		# Newest fused pose. Replaced (never modified) by every odometry update, so readers do not need a lock
+		self.pose = wpimath.geometry.Pose2d()
+		self.poseSamples = deque(maxlen=config.odometry.sampleQueueSize) # Every 'OdometrySample' since the last tick
+		self.tickPose = self.pose # Pose when the sensors were read this tick, where the commands of the tick start from
+
+		self.refreshSensors()
+
+		# Inputs of the last odometry update (used to reset the pose estimator)
+		self.odometryPositions = self.getModulePositions()
+		self.odometryGyro = self.gyroRotation
+
+		# Fuses odometry with (delayed) vision measurements. Vision is applied at its capture time and replayed forward
+		self.poseEstimator = wpimath.estimator.SwerveDrive4PoseEstimator(
+			self.kinematics,
+			self.gyroRotation,
+			self.getModulePositions(),
+			wpimath.geometry.Pose2d(),
+			config.odometry.stateStdDevs,
+			config.vision.stdDevs
 		)
 
-		self.swerveBackLeft = SwerveModule(
-			constants['MOTOR_CONSTANTS']['MOTOR_DRIVE_REAR_LEFT_ID'],
-			constants['MOTOR_CONSTANTS']['MOTOR_TURN_REAR_LEFT_ID'],
-			constants['MOTOR_CONSTANTS']['ENCODER_TURN_REAR_LEFT_ID'],
-			(constants['OFFSETS']['REAR_LEFT'], -constants['OFFSETS']['REAR_LEFT'])
+		# Fused poses over the last few seconds, used to check vision measurements against where the robot was
+		self.poseHistory = PoseHistory(config.odometry.historySize)
+		self.visionAccepted = 0
+		self.visionRejected = 0
+
+		# Values read every tick are copied here so 'drive()' does not look anything up
+		self.applyConfig(config)
+		robotconfig.subscribe(self.applyConfig)
+
+		# Odometry on its own thread, faster than the robot loop (0 Hz updates it from 'updateOdometry()' instead)
+		if config.odometry.frequency > 0:
+			self.odometryThread = OdometryThread(self.updateOdometryThread, config.odometry.frequency, config.odometry.sampleQueueSize)
+			self.poseSamples = self.odometryThread.samples
+			self.odometryThread.start()
+			atexit.register(self.odometryThread.stop)
+
+	def applyConfig(self, config):
+		'''
+		Copies the values used by the periodic methods from the robot configuration
+		'''
+		self.moduleMaxSpeed = config.calculations.moduleMaxSpeed
+		self.degradedSpeedScale = config.health.degradedSpeedScale
+		self.maxVisionError = config.vision.maxPoseError
+
+	@profiler.timed('Drivetrain.refreshSensors')
+	def refreshSensors(self):
+		'''
+		Reads every drivetrain sensor once and stores the readings for the rest of the tick
+
+		Call this at the start of each periodic loop, before anything else uses the drivetrain
+		'''
+		with self.sensorLock:
+			self.hardware.refreshSignals(self.sensorSignals) # Single batched CAN read for all absolute encoders
+
+			previousPositions = self.getModulePositions()
+			self.sensorTimestamp = timestamp = self.hardware.getTimestamp()
+
+			for module in self.modules:
+				module.refresh(timestamp)
+
+			# The odometry thread reads the gyro when it runs, the loop uses its newest heading for the whole tick
+			if self.odometryThread is None:
+				self.readGyro(timestamp, previousPositions, self.getModulePositions())
+			self.gyroRotation = self.gyroHeading
+			self.gyroYaw = self.latestGyroYaw
+			self.tickPose = self.pose
+
+		if health.changes != self.healthChanges:
+			self.updateMode()
+
+		frontLeft, frontRight, backLeft, backRight = (module.snapshot for module in self.modules)
+		self.moduleStatesLog.append(
+			frontLeft.angle.degrees(), frontLeft.driveVelocity,
+			frontRight.angle.degrees(), frontRight.driveVelocity,
+			backLeft.angle.degrees(), backLeft.driveVelocity,
+			backRight.angle.degrees(), backRight.driveVelocity,
+			timestamp=self.sensorTimestamp
 		)
-		
-		self.swerveBackRight = SwerveModule(
-			constants['MOTOR_CONSTANTS']['MOTOR_DRIVE_REAR_RIGHT_ID'],
-			constants['MOTOR_CONSTANTS']['MOTOR_TURN_REAR_RIGHT_ID'],
-			constants['MOTOR_CONSTANTS']['ENCODER_TURN_REAR_RIGHT_ID'],
-			(constants['OFFSETS']['REAR_RIGHT'], -constants['OFFSETS']['REAR_RIGHT'])
+		self.moduleStatesTopic.set(
+			frontLeft.driveVelocity, frontLeft.angleRadians,
+			frontRight.driveVelocity, frontRight.angleRadians,
+			backLeft.driveVelocity, backLeft.angleRadians,
+			backRight.driveVelocity, backRight.angleRadians
+		)
+
+	def readGyro(self, timestamp: float, previousPositions: tuple, positions: tuple):
+		'''
+		Reads the gyro into 'gyroHeading' (call with 'sensorLock' held)
+
+		While the gyro is not giving good readings the heading is integrated from the wheel movement between
+		'previousPositions' and 'positions'
+		'''
+		try:
+			gyroRotation = self.navx.getRotation2d()
+			gyroOk = self.gyroOk()
+		except Exception:
+			gyroOk = False
+
+		if gyroOk:
+			self.latestGyroYaw = gyroRotation.radians()
+			if self.gyroFallback:
+				self.gyroOffset = self.gyroHeading - gyroRotation # Continue from the estimated heading
+				self.gyroFallback = False
+			self.gyroHeading = gyroRotation if self.gyroOffset is None else gyroRotation + self.gyroOffset
+			self.gyroHealth.good(timestamp)
+		else:
+			# Estimate the heading from the rotation measured by the wheels
+			self.gyroFallback = True
+			deltas = tuple(
+				wpimath.kinematics.SwerveModulePosition(position.distance - previous.distance, position.angle)
+				for previous, position in zip(previousPositions, positions)
+			)
+			self.gyroHeading = self.gyroHeading + wpimath.geometry.Rotation2d(self.kinematics.toTwist2d(deltas).dtheta)
+			self.gyroHealth.bad(timestamp)
+
+	def updateMode(self):
+		'''
+		Picks the drive mode from the health of the modules and the gyro (called only when a device changes status)
+
+		NORMAL: every device works
+		DEGRADED: one module or the gyro is faulted. Faulted modules are stopped, the others drive at 'DEGRADED_SPEED_SCALE'
+		of the requested speed, and the heading is estimated from the wheels while the gyro is faulted
+		STOPPED: two or more modules are faulted, the robot does not drive
+		'''
+		self.healthChanges = health.changes
+		faultedModules = [module.name for module in self.modules if module.status == FAULTED]
+
+		if len(faultedModules) >= 2:
+			mode = self.STOPPED
+		elif faultedModules or self.gyroHealth.status == FAULTED:
+			mode = self.DEGRADED
+		else:
+			mode = self.NORMAL
+
+		if mode == self.mode:
+			return
+		self.mode = mode
+		self.speedScale = self.degradedSpeedScale if mode == self.DEGRADED else 1.0
+
+		if mode == self.NORMAL:
+			successMsg('Drivetrain back to normal mode')
+		else:
+			warningMsg(f'Drivetrain in {mode} mode (faulted modules: {faultedModules}, gyro: {STATUS_NAMES[self.gyroHealth.status]})')
+
+	def getModulePositions(self):
+		'''
+		Returns the position of every swerve module (same order as the kinematics)
+		'''
+		return (
+			self.swerveFrontLeft.getPosition(),
+			self.swerveFrontRight.getPosition(),
+			self.swerveBackLeft.getPosition(),
+			self.swerveBackRight.getPosition(),
 		)
-		
-		self.kinematics = wpimath.kinematics.SwerveDrive4Kinematics(
-            self.swerveFrontLeft.location,
-            self.swerveFrontRight.location,
-            self.swerveBackLeft.location,
-            self.swerveBackRight.location,
-        )
-
-		self.odometry = wpimath.kinematics.SwerveDrive4Odometry(
-            self.kinematics,
-            self.navx.getRotation2d(),
-            (
-                self.swerveFrontLeft.getPosition(),
-                self.swerveFrontRight.getPosition(),
-                self.swerveBackLeft.getPosition(),
-                self.swerveBackRight.getPosition(),
-            ),
-        )
 
 	def getRelativeSpeeds(self):
 		'''
-		Returns robot relative speeds that were derived from field relative speeds
+		Returns robot relative speeds measured by the swerve module encoders
 		'''
 		self.speeds = self.kinematics.toChassisSpeeds(
 			(
-				self.swerveFrontRight.getState(), 
-				self.swerveBackRight.getState(), 
-				self.swerveFrontLeft.getState(), 
-				self.swerveBackLeft.getState()
+				self.swerveFrontLeft.getState(),
+				self.swerveFrontRight.getState(),
+				self.swerveBackLeft.getState(),
+				self.swerveBackRight.getState()
 			)
 		)
-		return wpimath.kinematics.ChassisSpeeds.fromFieldRelativeSpeeds(
-			self.speeds.vx,
-			self.speeds.vy,
-			self.speeds.omega,
-			self.navx.getRotation2d())
+		return self.speeds
 
 	def zeroGyro(self):
 		'''
@@ -100,74 +288,142 @@ class Drivetrain():
 		# Zero the NavX gyro
 		try:
 			self.navx.zeroYaw()
+			self.gyroOffset = None
 		except Exception as e:
 			errorMsg('Issue calibrating NavX:',e,__file__)
 
+	@profiler.timed('Drivetrain.updateOdometry')
 	def updateOdometry(self):
 		'''
-		Updates the field relative position of the robot
+		Updates the field relative position of the robot from the readings of this tick
+
+		Does nothing while the odometry thread is running (it updates the pose on its own)
+		'''
+		if self.odometryThread is None:
+			self.poseSamples.append(self.updatePose(self.sensorTimestamp, self.getModulePositions(), self.gyroRotation))
+
+		pose = self.pose # Newest pose, from either thread
+		x = pose.X()
+		y = pose.Y()
+		heading = pose.rotation().radians()
+		self.poseTopic.set(x, y, heading)
+		self.poseLog.append(x, y, heading) # Once per tick, not at the rate of the odometry thread
+
+	def updateOdometryThread(self):
+		'''
+		One update of the odometry thread: reads the module positions and the gyro, then updates the pose
+		'''
+		with self.sensorLock:
+			self.hardware.refreshSignals(self.sensorSignals)
+			timestamp = self.hardware.getTimestamp()
+			positions = tuple(module.readPosition() for module in self.modules)
+			self.readGyro(timestamp, self.odometryPositions, positions)
+			gyroRotation = self.gyroHeading
+
+		return self.updatePose(timestamp, positions, gyroRotation)
+
+	def updatePose(self, timestamp: float, positions: tuple, gyroRotation):
+		'''
+		Adds one odometry measurement to the pose estimator and publishes the new pose. Returns it as an 'OdometrySample'
+		'''
+		with self.poseLock:
+			pose = self.poseEstimator.updateWithTime(timestamp, gyroRotation, positions)
+			x = pose.X()
+			y = pose.Y()
+			heading = pose.rotation().radians()
+			self.poseHistory.add(timestamp, x, y, heading)
+			self.odometryPositions = positions
+			self.odometryGyro = gyroRotation
+			self.pose = pose # Under the lock, or it could overwrite a pose set by 'resetOdometry()' or a vision measurement
+
+		return OdometrySample(timestamp, x, y, heading)
+
+	def addVisionMeasurement(self, visionPose, captureTimestamp: float):
 		'''
-		
-		self.odometry.update(
-            self.navx.getRotation2d(),
-            (
-                self.swerveFrontLeft.getPosition(),
-                self.swerveFrontRight.getPosition(),
-                self.swerveBackLeft.getPosition(),
-                self.swerveBackRight.getPosition(),
-            )
-        )
+		Fuses a vision pose (Pose2d) taken at 'captureTimestamp' (robot time in seconds) into the pose estimate
+
+		The measurement is rejected if it is older than the pose history or too far from where the robot was at that time.
+		Returns True if the measurement was used
+		'''
+		with self.poseLock:
+			pastPose = self.poseHistory.sample(captureTimestamp)
+
+			if pastPose is None or (self.maxVisionError > 0 and math.hypot(visionPose.X() - pastPose[0], visionPose.Y() - pastPose[1]) > self.maxVisionError):
+				self.visionRejected += 1
+				return False
+
+			self.poseEstimator.addVisionMeasurement(visionPose, captureTimestamp)
+			self.pose = self.poseEstimator.getEstimatedPosition()
+
+		self.visionAccepted += 1
+		return True
+
+	def getOdometrySamples(self):
+		'''
+		Returns (and removes) every odometry sample published since the last call, oldest first
+		'''
+		samples = []
+		while self.poseSamples:
+			samples.append(self.poseSamples.popleft())
+		return samples
 
 	def getOdometry(self):
 		'''
-		Returns the field relative position of the robot
+		Returns the field relative position of the robot (odometry fused with vision)
+
+		Never waits on the odometry thread, the newest published pose is returned
 		'''
-		return self.odometry.getPose()
+		return self.pose
 	
 	def resetOdometry(self, initPose):
 		'''
 		Resets odometry of the robot
 		'''
-		self.odometry.resetPosition(
-			self.navx.getRotation2d(),
+		with self.poseLock:
+			self.poseEstimator.resetPosition(
+				self.odometryGyro,
+				self.odometryPositions,
+				initPose
+			)
+			self.poseHistory.clear()
+			self.pose = initPose
 
-			(
-				self.swerveFrontRight.getPosition(),
-				self.swerveBackRight.getPosition(),
-				self.swerveFrontLeft.getPosition(),
-				self.swerveBackLeft.getPosition(),
-			),
-			
-			initPose
-		)
+	def driveRobotRelative(self, speeds, periodSeconds: wpimath.units.seconds = 0.02):
+		'''
+		Drives the robot from robot relative ChassisSpeeds (used by pathplannerlib)
+		'''
+		self.drive(speeds.vx, speeds.vy, speeds.omega, False, periodSeconds)
 
+	@profiler.timed('Drivetrain.drive')
 	def drive(self, xSpeed: float, ySpeed: float, rotation: float, fieldRelative: bool, periodSeconds: wpimath.units.seconds):
 		'''
 		Drives the robot based on the imput from the xbox controller
 		'''
+		if self.mode != self.NORMAL:
+			if self.mode == self.STOPPED:
+				for module in self.modules:
+					module.stop()
+				return
 
-		# Get the swerve-module states
-		swerveModuleStates = self.kinematics.toSwerveModuleStates(
-            wpimath.kinematics.ChassisSpeeds.discretize(
-                (
-                    wpimath.kinematics.ChassisSpeeds.fromFieldRelativeSpeeds(
-                        xSpeed, ySpeed, rotation, self.navx.getRotation2d()
-                    )
-					
-                    if fieldRelative
-                    else wpimath.kinematics.ChassisSpeeds(xSpeed, ySpeed, rotation) # Return minimal output if not field relative
-                ),
-                periodSeconds
-            )
-        )
-
-		# Renormalize speeds (compensates if any speeds are too fast/slow)
-		wpimath.kinematics.SwerveDrive4Kinematics.desaturateWheelSpeeds(
-            swerveModuleStates, constants['CALCULATIONS']['MODULE_MAX_SPEED']
-        )
+			xSpeed *= self.speedScale
+			ySpeed *= self.speedScale
+			rotation *= self.speedScale
+
+		# Get the swerve-module setpoints (field relative speeds are rotated by the heading of this tick, then discretized)
+		# The module speeds are not desaturated: wpimath's 'desaturateWheelSpeeds()' returns new states instead of changing
+		# the ones it is given, so they never were. Pass 'self.moduleMaxSpeed' to limit them
+		controlPath = self.controlPath
+		controlPath.update(xSpeed, ySpeed, rotation, fieldRelative, self.gyroRotation.radians(), periodSeconds)
 
 		# Set the desired states to each swerve motor
-		self.swerveFrontLeft.setDesiredState(swerveModuleStates[0])
-		self.swerveFrontRight.setDesiredState(swerveModuleStates[1])
-		self.swerveBackLeft.setDesiredState(swerveModuleStates[2])
-		self.swerveBackRight.setDesiredState(swerveModuleStates[3])
\ No newline at end of file
+		for module, setpoint in zip(self.modules, controlPath.setpoints):
+			module.applySetpoint(setpoint)
+
+		self.speedsTopic.set(controlPath.vx, controlPath.vy, controlPath.omega)
+		frontLeft, frontRight, backLeft, backRight = (module.target for module in self.modules)
+		self.moduleTargetsTopic.set(
+			frontLeft.speed, frontLeft.angle,
+			frontRight.speed, frontRight.angle,
+			backLeft.speed, backLeft.angle,
+			backRight.speed, backRight.angle
+		)
\ No newline at end of file
@@ -0,0 +1,131 @@
+# Turns raw joystick axes into drive speeds: radial deadband -> response curve -> slow mode -> slew rate limit -> max speed
+# Every stage is a few float operations per tick. The response curves are baked into lookup tables when the
+# configuration is loaded, so nothing is computed with powers or looked up in the configuration while driving
+import math
+
+RESPONSE_TABLE_SIZE = 256 # Entries of a response curve table (over 0 - 1 of the stick past the deadband)
+
+class ResponseCurve:
+    '''
+    # ResponseCurve
+    Maps how far a stick is pushed (0 - 1) to how much of the max speed is asked for
+
+    'expo' blends a linear response (0) with a cubic one (1): small movements get finer control and a full push still
+    gives full speed. The curve is stored as a table and read with linear interpolation between its two closest entries
+    '''
+    __slots__ = ('table', 'scale', 'last')
+
+    def __init__(self, expo: float, size: int = RESPONSE_TABLE_SIZE):
+        expo = min(max(expo, 0.0), 1.0)
+        self.last = size - 1
+        self.scale = float(self.last)
+        self.table = tuple(
+            (1.0 - expo) * (index / self.last) + expo * (index / self.last) ** 3
+            for index in range(size)
+        ) + (1.0,) # Repeated, so a full push can read the entry after it
+
+    def __call__(self, magnitude: float):
+        '''
+        Shaped value of 'magnitude' (clamped to 0 - 1)
+        '''
+        if magnitude <= 0.0:
+            return 0.0
+        if magnitude >= 1.0:
+            return 1.0
+
+        position = magnitude * self.scale
+        index = int(position)
+        low = self.table[index]
+        return low + (self.table[index + 1] - low) * (position - index)
+
+class InputShaper:
+    '''
+    # InputShaper
+    Shapes the left stick (translation) and the right stick X axis (rotation) of a controller
+
+    The deadband of the left stick is radial: the stick is ignored inside a circle instead of a cross, so diagonals are
+    not snapped to an axis and both axes reach full speed together. Translation is limited as one vector (the robot
+    does not bend its path while speeding up) and rotation on its own, each with its own rate (full speeds per second).
+    The slow mode scale is applied before the rate limits, so switching it on and off is smooth too
+    '''
+    __slots__ = (
+        'deadband', 'deadbandScale', 'translationCurve', 'rotationCurve',
+        'translationRateLimit', 'rotationRateLimit', 'maxSpeed', 'maxRotationSpeed',
+        'slowModeScale', 'speedScale',
+        'x', 'y', 'rotation' # Rate limited outputs of the last 'update()' (-1 to 1 of the max speeds)
+    )
+
+    def __init__(self, deadband: float, translationExpo: float, rotationExpo: float, translationRateLimit: float,
+                 rotationRateLimit: float, maxSpeed: float, maxRotationSpeed: float, slowModeScale: float):
+        self.deadband = min(max(deadband, 0.0), 0.99)
+        self.deadbandScale = 1.0 / (1.0 - self.deadband) # Stretches what is left past the deadband back to 0 - 1
+        self.translationCurve = ResponseCurve(translationExpo)
+        self.rotationCurve = ResponseCurve(rotationExpo)
+        self.translationRateLimit = translationRateLimit
+        self.rotationRateLimit = rotationRateLimit
+        self.maxSpeed = maxSpeed
+        self.maxRotationSpeed = maxRotationSpeed
+        self.slowModeScale = slowModeScale
+        self.speedScale = 1.0
+        self.x = 0.0
+        self.y = 0.0
+        self.rotation = 0.0
+
+    def setSlowMode(self, slow: bool):
+        self.speedScale = self.slowModeScale if slow else 1.0
+
+    def reset(self, x: float = 0.0, y: float = 0.0, rotation: float = 0.0):
+        '''
+        Jumps the rate limited outputs to the given values (-1 to 1 of the max speeds)
+        '''
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+
+    def update(self, stickX: float, stickY: float, stickRotation: float, periodSeconds: float):
+        '''
+        Shapes one reading of the sticks (-1 to 1 each), 'periodSeconds' after the last one
+
+        Returns the x speed, y speed (same units as 'maxSpeed') and rotation speed (same units as 'maxRotationSpeed')
+        '''
+        deadband = self.deadband
+        scale = self.speedScale
+
+        # Translation: deadband and curve on how far the stick is pushed, in the direction it is pushed
+        magnitude = math.hypot(stickX, stickY)
+        if magnitude > deadband:
+            shaped = self.translationCurve((magnitude - deadband) * self.deadbandScale) * scale / magnitude
+            targetX = stickX * shaped
+            targetY = stickY * shaped
+        else:
+            targetX = targetY = 0.0
+
+        # Rotation: same on one axis
+        magnitude = abs(stickRotation)
+        if magnitude > deadband:
+            targetRotation = math.copysign(self.rotationCurve((magnitude - deadband) * self.deadbandScale) * scale, stickRotation)
+        else:
+            targetRotation = 0.0
+
+        # Rate limits (the change allowed this tick)
+        deltaX = targetX - self.x
+        deltaY = targetY - self.y
+        step = self.translationRateLimit * periodSeconds
+        distance = math.hypot(deltaX, deltaY)
+        if distance > step:
+            self.x += deltaX * step / distance
+            self.y += deltaY * step / distance
+        else:
+            self.x = targetX
+            self.y = targetY
+
+        step = self.rotationRateLimit * periodSeconds
+        deltaRotation = targetRotation - self.rotation
+        if deltaRotation > step:
+            self.rotation += step
+        elif deltaRotation < -step:
+            self.rotation -= step
+        else:
+            self.rotation = targetRotation
+
+        return self.x * self.maxSpeed, self.y * self.maxSpeed, self.rotation * self.maxRotationSpeed
@@ -0,0 +1,66 @@
+# Runs the drivetrain odometry on its own thread, faster than the 20 ms robot loop
+from collections import deque
+
+import wpilib
+
+from extras.debugmsgs import *
+
+class OdometrySample:
+    '''
+    # OdometrySample
+    One odometry update. Samples are never modified after they are published
+    '''
+    __slots__ = ('timestamp', 'x', 'y', 'heading') # Seconds, meters, meters, radians
+
+    def __init__(self, timestamp: float, x: float, y: float, heading: float):
+        self.timestamp = timestamp
+        self.x = x
+        self.y = y
+        self.heading = heading
+
+class OdometryThread:
+    '''
+    # OdometryThread
+    Calls 'update()' at a fixed rate from a wpilib Notifier (which runs on its own thread, timed by the FPGA)
+
+    'update()' must return an 'OdometrySample'. Samples are kept in a bounded queue, so a consumer that falls behind only
+    loses the oldest ones. Reading 'latest' or the queue never waits on the odometry thread
+    '''
+    def __init__(self, update, frequency: float, queueSize: int = 64):
+        self.update = update
+        self.period = 1.0 / frequency
+        self.samples = deque(maxlen=queueSize) # Appends and pops are thread safe
+        self.latest = None
+        self.updates = 0
+        self.errors = 0
+
+        self.notifier = None
+
+    def start(self):
+        if self.notifier is None:
+            self.notifier = wpilib.Notifier(self.run)
+            self.notifier.setName('Odometry')
+            self.notifier.startPeriodic(self.period)
+
+    def stop(self):
+        '''
+        Stops the updates and waits for the notifier thread to end (it must not outlive the interpreter)
+        '''
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None # Destroying the notifier joins its thread
+
+    def run(self):
+        '''
+        One update: called by the notifier, or by 'SimRunner' between the steps of the simulation once it is stopped
+        '''
+        try:
+            sample = self.update()
+        except Exception as e:
+            self.errors += 1
+            debugMsg(f'Odometry update failed: {e}') # Rate limited by the logger
+            return
+
+        self.latest = sample
+        self.samples.append(sample)
+        self.updates += 1
@@ -0,0 +1,91 @@
+# Time-stamped history of robot poses, used to look up where the robot was when a delayed measurement was taken
+from array import array
+import math
+
+class PoseHistory:
+    '''
+    # PoseHistory
+    Fixed-size ring buffer of (timestamp, x, y, heading) samples stored in flat arrays
+
+    Memory stays bounded no matter how long the match runs, and 'sample()' is a binary search (O(log n))
+    followed by a linear interpolation between the two closest samples
+    '''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.xs = array('d', bytes(8 * capacity))
+        self.ys = array('d', bytes(8 * capacity))
+        self.headings = array('d', bytes(8 * capacity)) # Radians
+        self.start = 0 # Physical index of the oldest sample
+        self.count = 0
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def add(self, timestamp: float, x: float, y: float, heading: float):
+        '''
+        Adds a sample. Samples must be added in time order; a sample older than the newest one clears the history
+        '''
+        if self.count and timestamp <= self.timestamps[(self.start + self.count - 1) % self.capacity]:
+            if timestamp == self.timestamps[(self.start + self.count - 1) % self.capacity]:
+                return # Same tick, keep the first sample
+            self.clear() # Time went backwards (odometry was reset)
+
+        if self.count < self.capacity:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            index = self.start # Overwrite the oldest sample
+            self.start = (self.start + 1) % self.capacity
+
+        self.timestamps[index] = timestamp
+        self.xs[index] = x
+        self.ys[index] = y
+        self.headings[index] = heading
+
+    def oldestTimestamp(self):
+        return self.timestamps[self.start] if self.count else None
+
+    def newestTimestamp(self):
+        return self.timestamps[(self.start + self.count - 1) % self.capacity] if self.count else None
+
+    def sample(self, timestamp: float):
+        '''
+        Returns the interpolated (x, y, heading) at a timestamp, or None if it is outside of the history
+        '''
+        count = self.count
+        if count == 0:
+            return None
+
+        capacity = self.capacity
+        start = self.start
+        timestamps = self.timestamps
+
+        if timestamp < timestamps[start] or timestamp > timestamps[(start + count - 1) % capacity]:
+            return None
+
+        # Binary search for the first sample at or after the timestamp (logical indices, oldest = 0)
+        low, high = 0, count - 1
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[(start + middle) % capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        after = (start + low) % capacity
+        if low == 0 or timestamps[after] == timestamp:
+            return self.xs[after], self.ys[after], self.headings[after]
+
+        before = (start + low - 1) % capacity
+        t = (timestamp - timestamps[before]) / (timestamps[after] - timestamps[before])
+
+        # Interpolate the heading the short way around
+        headingDelta = math.remainder(self.headings[after] - self.headings[before], 2.0 * math.pi)
+
+        return (
+            self.xs[before] + (self.xs[after] - self.xs[before]) * t,
+            self.ys[before] + (self.ys[after] - self.ys[before]) * t,
+            self.headings[before] + headingDelta * t
+        )
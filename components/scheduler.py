@@ -0,0 +1,191 @@
+# Runs commands (commands2 or anything with the same methods) cooperatively from the robot loop, within a time budget
+# Stuck? https://docs.wpilib.org/en/stable/docs/software/commandbased/command-scheduler.html
+from time import perf_counter_ns
+
+from extras.debugmsgs import *
+from extras.profiler import profiler
+
+# Priorities of scheduled commands. HIGH commands always run, lower ones can be deferred when the budget runs out
+LOW = 0
+NORMAL = 1
+HIGH = 2
+PRIORITY_NAMES = {LOW: 'low', NORMAL: 'normal', HIGH: 'high'}
+
+class ScheduledCommand:
+    '''
+    # ScheduledCommand
+    A command while it is scheduled, with what the scheduler needs to run it each tick
+    '''
+    __slots__ = (
+        'command', 'name', 'priority', 'requirements', 'interruptible', 'runsWhenDisabled',
+        'isDefault', # Started because nothing else held its requirement, gives way to any scheduled command
+        'active', # False once ended (it may still be in the list being run this tick)
+        'stage', # Profiler stage of 'execute()'
+        'estimateNs', # Time 'execute()' is expected to take (recent peak, decays each run)
+        'deferred', # Ticks in a row it was skipped to stay within the budget
+        'deferrals' # Ticks it was skipped since the last 'report()'
+    )
+
+    def __init__(self, command, priority: int, stage, isDefault: bool = False):
+        self.command = command
+        self.name = command.getName()
+        self.priority = priority
+        self.requirements = frozenset(command.getRequirements())
+        self.interruptible = command.getInterruptionBehavior().name == 'kCancelSelf'
+        self.runsWhenDisabled = command.runsWhenDisabled()
+        self.isDefault = isDefault
+        self.active = True
+        self.stage = stage
+        self.estimateNs = 0
+        self.deferred = 0
+        self.deferrals = 0
+
+class Scheduler:
+    '''
+    # Scheduler
+    Cooperative command scheduler, run once per tick with 'run()'
+
+    A command holds its requirements (subsystems such as the drivetrain) until it ends. Scheduling a command that needs
+    a held requirement interrupts the holder if it has a lower priority, or the same priority and can be interrupted.
+    Otherwise the new command is not scheduled. When nothing holds a requirement, its default command runs (and gives
+    way to any scheduled command)
+
+    Commands run from the highest priority down. A command below HIGH is deferred to a later tick if the time it is
+    expected to take does not fit in what is left of the budget, at most 'maxDeferrals' ticks in a row
+    '''
+    def __init__(self, budgetSeconds: float = 0.005, maxDeferrals: int = 5):
+        self.budgetNs = int(budgetSeconds * 1e9)
+        self.maxDeferrals = maxDeferrals
+        self.running = [] # 'ScheduledCommand' in the order they run (highest priority first)
+        self.holders = {} # Requirement -> 'ScheduledCommand' holding it
+        self.defaults = {} # Requirement -> default command
+        self.runs = 0
+
+    def setDefaultCommand(self, requirement, command, priority: int = NORMAL):
+        '''
+        Runs 'command' whenever no other command holds 'requirement' (it must require only that).
+        'priority' only decides when it runs in a tick and if it can be deferred
+        '''
+        if set(command.getRequirements()) != {requirement}:
+            errorMsg(f"Default command '{command.getName()}' must require only its subsystem", None)
+        self.defaults[requirement] = (command, priority)
+
+    def schedule(self, command, priority: int = NORMAL, isDefault: bool = False):
+        '''
+        Starts a command. Returns False if it could not be scheduled (a requirement is held by a command it cannot interrupt)
+        '''
+        if self.isScheduled(command):
+            return True
+        scheduled = ScheduledCommand(command, priority, profiler.stage(f'Command {command.getName()}'), isDefault)
+
+        conflicts = {self.holders[requirement] for requirement in scheduled.requirements if requirement in self.holders}
+        for holder in conflicts:
+            if holder.isDefault:
+                continue
+            if isDefault or holder.priority > priority or (holder.priority == priority and not holder.interruptible):
+                debugMsg(f"Command '{scheduled.name}' not scheduled, '{holder.name}' ({PRIORITY_NAMES.get(holder.priority)} priority) needs the same subsystem")
+                return False
+        for holder in conflicts:
+            self._end(holder, True)
+
+        if not self._initialize(scheduled):
+            return False
+        for requirement in scheduled.requirements:
+            self.holders[requirement] = scheduled
+
+        # After the commands of the same or higher priority
+        index = 0
+        while index < len(self.running) and self.running[index].priority >= priority:
+            index += 1
+        self.running.insert(index, scheduled)
+        return True
+
+    def isScheduled(self, command):
+        return any(scheduled.command is command for scheduled in self.running)
+
+    def cancel(self, command):
+        for scheduled in self.running:
+            if scheduled.command is command:
+                self._end(scheduled, True)
+                return
+
+    def cancelAll(self, disabled: bool = False):
+        '''
+        Interrupts every command ('disabled' only cancels the ones that do not run while the robot is disabled)
+        '''
+        for scheduled in tuple(self.running):
+            if not disabled or not scheduled.runsWhenDisabled:
+                self._end(scheduled, True)
+
+    @profiler.timed('Scheduler.run')
+    def run(self):
+        '''
+        Runs every scheduled command once (or defers it), ends the finished ones and starts the default commands
+        '''
+        self.runs += 1
+        deadlineNs = perf_counter_ns() + self.budgetNs
+
+        for requirement, (command, priority) in self.defaults.items():
+            if requirement not in self.holders:
+                self.schedule(command, priority, isDefault=True)
+
+        for scheduled in tuple(self.running):
+            if not scheduled.active: # Ended by a command that ran before it this tick
+                continue
+            if scheduled.priority < HIGH and scheduled.deferred < self.maxDeferrals and perf_counter_ns() + scheduled.estimateNs > deadlineNs:
+                scheduled.deferred += 1
+                scheduled.deferrals += 1
+                continue
+            scheduled.deferred = 0
+
+            command = scheduled.command
+            try:
+                with scheduled.stage:
+                    startNs = perf_counter_ns()
+                    command.execute()
+                    elapsedNs = perf_counter_ns() - startNs
+                finished = command.isFinished()
+            except Exception as e: # A failing command should not stop the others (or the robot loop)
+                debugMsg(f"Command '{scheduled.name}' failed: {e}")
+                self._end(scheduled, True)
+                continue
+
+            # Recent peak, lowered by an eighth each run if the command gets faster
+            estimateNs = scheduled.estimateNs - (scheduled.estimateNs >> 3)
+            scheduled.estimateNs = elapsedNs if elapsedNs > estimateNs else estimateNs
+
+            if finished and scheduled.active:
+                self._end(scheduled, False)
+
+    def report(self):
+        '''
+        Prints the commands that were deferred since the last report, and resets the counts
+        '''
+        deferred = [scheduled for scheduled in self.running if scheduled.deferrals]
+        if deferred:
+            debugMsg(f'Scheduler: {len(self.running)} commands over {self.runs} ticks, deferred: ' + ', '.join(f'{scheduled.name} {scheduled.deferrals}x' for scheduled in deferred))
+        for scheduled in self.running:
+            scheduled.deferrals = 0
+        self.runs = 0
+
+    def _initialize(self, scheduled: ScheduledCommand):
+        try:
+            scheduled.command.initialize()
+            return True
+        except Exception as e:
+            debugMsg(f"Command '{scheduled.name}' failed to start: {e}")
+            return False
+
+    def _end(self, scheduled: ScheduledCommand, interrupted: bool):
+        scheduled.active = False
+        self.running.remove(scheduled)
+        for requirement in scheduled.requirements:
+            if self.holders.get(requirement) is scheduled:
+                del self.holders[requirement]
+
+        if scheduled.deferrals:
+            debugMsg(f"Command '{scheduled.name}' was deferred {scheduled.deferrals} times")
+        try:
+            scheduled.command.end(interrupted)
+        except Exception as e:
+            debugMsg(f"Command '{scheduled.name}' failed to end: {e}")
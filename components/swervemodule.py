@@ -3,7 +3,12 @@
 # Stuck? https://robotpy.readthedocs.io/projects/wpimath/en/latest/wpimath.geometry/Translation2d.html
 from extras.debugmsgs import *
 
-from hardware.motors import CANSparkMax
+from hardware.motors import CANSparkMax, SparkMaxConfig, motorConfigurator
+from hardware.canbus import busLoad, phoenixRates, phoenixFrameRate
+from .controlpath import ModuleSetpoint, optimize, cosineBetween, degrees
+from hardware import backend
+from hardware.health import health, OK, FAULTED
+from config import robotconfig
 
 import wpimath.kinematics
 import wpimath.geometry
@@ -11,132 +16,275 @@ import wpimath.controller
 import wpimath.trajectory
 import wpimath.units
 
-import rev, phoenix6
+class SwerveModuleSnapshot:
+    '''
+    # SwerveModuleSnapshot
+    One consistent set of sensor readings from a swerve module, taken once per tick
+    '''
+    __slots__ = (
+        'timestamp', # FPGA time (seconds) the readings were taken at
+        'absolutePosition', # Absolute encoder position (rotations)
+        'absoluteDegrees', # Absolute encoder position (degrees)
+        'angle', 'angleRadians', # Rotation2d of the module built from the absolute encoder, and its angle
+        'drivePosition', 'driveVelocity', # Drive relative encoder
+        'turnPosition', 'turnVelocity' # Turn relative encoder
+    )
+
+    def __init__(self):
+        self.timestamp = 0.0
+        self.absolutePosition = 0.0
+        self.absoluteDegrees = 0.0
+        self.angle = wpimath.geometry.Rotation2d()
+        self.angleRadians = 0.0
+        self.drivePosition = 0.0
+        self.driveVelocity = 0.0
+        self.turnPosition = 0.0
+        self.turnVelocity = 0.0
 
 class SwerveModule:
     '''
     # SwerveModule
     Used by the drivetrain to controll each individual swerve module on the robot
     '''
-    def __init__(self, driveMotorChannel, turnMotorChannel, turnEncoderChannel, location):
+    def __init__(self, moduleConfig: robotconfig.SwerveModuleConfig):
+        constants = robotconfig.get().moduleConstants
+        hardware = backend.get()
+        self.name = moduleConfig.name
+
+        # Control types used every tick by 'setDesiredState()'
+        self.velocityControl = hardware.controlType('kVelocity')
+        self.positionControl = hardware.controlType('kPosition')
 
         # Location represents the distance (TODO: Find what unit of measurement for distance)
         # From the middle of the robot to any of the swerve modules
-        self.location = wpimath.geometry.Translation2d(location[0], location[1])
+        self.location = wpimath.geometry.Translation2d(moduleConfig.location[0], moduleConfig.location[1])
 
         # Set up the turn (absolute) encoder
         try:
-            self.absoluteEncoder = phoenix6.hardware.CANcoder(turnEncoderChannel) #TODO: Find what 'CANBus' is
+            self.absoluteEncoder = hardware.createCANcoder(moduleConfig.encoderId) #TODO: Find what 'CANBus' is
+            self.absolutePositionSignal = self.absoluteEncoder.get_absolute_position() # Refreshed once per tick by the drivetrain
         except Exception as e:
             errorMsg('Could not initialize absolute encoder:',e,__file__)
 
+        # Only the absolute position is read from the CANcoder (as often as the odometry runs), its other signals are turned off
+        encoderRates = phoenixRates('absoluteEncoder', robotconfig.get().odometry.frequency)
+        busLoad.add(f'CANcoder {moduleConfig.encoderId}', 'absoluteEncoder', phoenixFrameRate(encoderRates, 'absoluteEncoder'))
+        motorConfigurator.add(f'CANcoder {moduleConfig.encoderId}', lambda burnFlash: hardware.setSignalRates(self.absoluteEncoder, encoderRates) or [])
+
         try:
             # Set up the drive motor (motor that moves the robot in a direction)
             # and the turn motor (motor that turns the drive motor to change the direction of the robot)
-            self.motorDrive = CANSparkMax(driveMotorChannel, 80)
-            self.motorTurn = CANSparkMax(turnMotorChannel, 20)
+            # Conversion factors are precomputed from 'MODULE_CONSTANTS'. The settings are sent by the drivetrain, for every motor at once
+            self.motorDrive = CANSparkMax(moduleConfig.driveMotorId, SparkMaxConfig(
+                constants.driveCurrentLimit,
+                positionConversionFactor=constants.drivePositionFactor,
+                velocityConversionFactor=constants.driveVelocityFactor,
+                PID=constants.drivePID,
+                role='drive'
+            ))
+            self.motorTurn = CANSparkMax(moduleConfig.turnMotorId, SparkMaxConfig(
+                constants.turnCurrentLimit,
+                positionConversionFactor=constants.turnPositionFactor,
+                velocityConversionFactor=constants.turnVelocityFactor,
+                PID=constants.turnPID,
+                role='turn'
+            ))
         except Exception as e:
             errorMsg('Could not initialize motors [rev.CANSparkMax]:',e,__file__)
 
+        # Health of each device. Readings are checked once per tick and a failed reading keeps the last good value
+        self.encoderHealth = health.device(f'{self.name} absolute encoder')
+        self.driveHealth = health.device(f'{self.name} drive motor')
+        self.turnHealth = health.device(f'{self.name} turn motor')
+        self.encoderOk = hardware.signalCheck(self.absolutePositionSignal)
+        self.driveOk = hardware.sparkMaxCheck(self.motorDrive.motor)
+        self.turnOk = hardware.sparkMaxCheck(self.motorTurn.motor)
+        self.status = OK # Worst status of the three devices
+
+        # Sensor readings for the current tick (see 'refresh()')
+        self.snapshot = SwerveModuleSnapshot()
+
+        # Setpoint after turning the short way, reused every tick by 'applySetpoint()'
+        self.target = ModuleSetpoint()
+
+        # Last references sent to the motors (recorded for replays, see 'extras/replay.py')
+        self.driveReference = 0.0
+        self.turnReference = 0.0
+
+        # Last good readings of the odometry thread (see 'readPosition()')
+        self.odometryDistance = 0.0
+        self.odometryAngle = wpimath.geometry.Rotation2d()
+        # TODO: Ask if I need to add code HERE that sets the starting positions of all parts of the swervemodule
+
+    def getSignals(self):
+        '''
+        Returns the phoenix6 status signals of this module so the drivetrain can refresh every module in one batched read
+        '''
+        return (self.absolutePositionSignal,)
+
+    def refresh(self, timestamp: float):
+        '''
+        Copies the latest sensor readings into the module snapshot
+
+        The status signals returned by 'getSignals()' must have been refreshed before this is called.
+        Every other method reads from the snapshot, so all consumers see the same readings during a tick
+        '''
+        snapshot = self.snapshot
+        snapshot.timestamp = timestamp
+
+        # Absolute encoder (rotations) -> degrees
         try:
-            # Set and configure the relative encoders
-            self.motorDrive.setRelativeEncoder(
-                (0.0508 * 2.0 * 3.141592653589 * ((14.0 / 50.0) * (25.0 / 19.0) * (15.0 / 45.0))),
-                (0.0508 * (2.0 * 3.141592653589 * ((14.0 / 50.0) * (25.0 / 19.0) * (15.0 / 45.0))) / 60.0),
-            )
-
-            self.motorTurn.setRelativeEncoder(
-                (2.0 * 3.141592653589 * ((14.0 / 50.0) * (10.0 / 60.0))),
-                (2.0 * 3.141592653589 * ((14.0 / 50.0) * (10.0 / 60.0)) / 60.0)
-            )
-        except Exception as e:
-            errorMsg('Could not configure relative encoders:',e,__file__)
+            absolutePosition = self.absolutePositionSignal.value_as_double
+            encoderOk = self.encoderOk()
+        except Exception:
+            encoderOk = False
 
+        if encoderOk:
+            snapshot.absolutePosition = absolutePosition
+            snapshot.absoluteDegrees = absolutePosition * 360.0
+            snapshot.angleRadians = wpimath.angleModulus(snapshot.absoluteDegrees)
+            snapshot.angle = wpimath.geometry.Rotation2d(snapshot.angleRadians)
+            self.encoderHealth.good(timestamp)
+        else:
+            self.encoderHealth.bad(timestamp)
+
+        # Relative encoders (REV encoders are read from the periodic status frames)
         try:
-            # Set up PID constrollers
-            self.motorDrive.setPIDController(0.01, 0, 0, (1.0/73.0), [-1.0, 1.0])
-            self.motorTurn.setPIDController(0.015, 0, 0.001, 0, [-1.0, 1.0])
-        except Exception as e:
-            errorMsg('Could not obtain PID controllers:',e,__file__)
-        # TODO: Ask if I need to add code HERE that sets the starting positions of all parts of the swervemodule
+            drivePosition = self.motorDrive.relativeEncoder.getPosition()
+            driveVelocity = self.motorDrive.relativeEncoder.getVelocity()
+            driveOk = self.driveOk()
+        except Exception:
+            driveOk = False
 
-    def getPosition(self):
+        if driveOk:
+            snapshot.drivePosition = drivePosition
+            snapshot.driveVelocity = driveVelocity
+            self.driveHealth.good(timestamp)
+        else:
+            self.driveHealth.bad(timestamp)
+
+        try:
+            turnPosition = self.motorTurn.relativeEncoder.getPosition()
+            turnVelocity = self.motorTurn.relativeEncoder.getVelocity()
+            turnOk = self.turnOk()
+        except Exception:
+            turnOk = False
+
+        if turnOk:
+            snapshot.turnPosition = turnPosition
+            snapshot.turnVelocity = turnVelocity
+            self.turnHealth.good(timestamp)
+        else:
+            self.turnHealth.bad(timestamp)
+
+        self.status = max(self.encoderHealth.status, self.driveHealth.status, self.turnHealth.status)
+
+    def readPosition(self):
         '''
-        Returns the swerve module position based on encoders
+        Reads the module position straight from the sensors (used by the odometry thread, between ticks)
+
+        Only the drive position and the absolute encoder are read. A failed reading keeps the last good value,
+        health is left to 'refresh()' so device status only changes on the robot loop
         '''
         try:
-            return wpimath.kinematics.SwerveModulePosition(
-                wpimath.units.meters(self.motorDrive.relativeEncoder.getPosition()), 
+            absolutePosition = self.absolutePositionSignal.value_as_double
+            if self.encoderOk():
+                self.odometryAngle = wpimath.geometry.Rotation2d(wpimath.angleModulus(absolutePosition * 360.0))
+        except Exception:
+            pass
 
-                wpimath.geometry.Rotation2d(
-                    wpimath.angleModulus(self.absoluteEncoder.get_absolute_position().value_as_double * 360.0)
-                    )
-                )
-        except Exception as e:
-            errorMsg('Could not get position:',e,__file__)
+        try:
+            drivePosition = self.motorDrive.relativeEncoder.getPosition()
+            if self.driveOk():
+                self.odometryDistance = drivePosition
+        except Exception:
+            pass
+
+        return wpimath.kinematics.SwerveModulePosition(self.odometryDistance, self.odometryAngle)
+
+    def getPosition(self):
+        '''
+        Returns the swerve module position based on encoders
+        '''
+        return wpimath.kinematics.SwerveModulePosition(
+            wpimath.units.meters(self.snapshot.drivePosition),
+            self.snapshot.angle
+        )
     
     def getState(self):
         '''
         Returns the speed (meters/second) from the drive encoder and the rotation from the turn encoder
         '''
-        try:
-            return wpimath.kinematics.SwerveModuleState(
-                wpimath.units.meters_per_second(self.motorDrive.relativeEncoder.getVelocity()), # Speed of the drive motor
-
-                wpimath.geometry.Rotation2d(
-                    wpimath.angleModulus(self.absoluteEncoder.get_absolute_position().value_as_double * 360.0) # Angle of rotation
-                )
-            )
-        except Exception as e:
-            errorMsg('Could not get state:',e,__file__)
+        return wpimath.kinematics.SwerveModuleState(
+            wpimath.units.meters_per_second(self.snapshot.driveVelocity), # Speed of the drive motor
+            self.snapshot.angle # Angle of rotation
+        )
     
     def setDesiredState(self, desiredState):
         '''
         Sets desired state (speed & angle) of the swervemodule
         '''
 
-        try:
-            # Get the rotation of the absolute encoder
-            encoderRotation = wpimath.geometry.Rotation2d(
-                wpimath.units.degrees(
-                    float(self.absoluteEncoder.get_absolute_position().value_as_double) * 360.0)
-                )
-        except Exception as e:
-            errorMsg('Could not get encoder rotation:',e,__file__)
+        if self.status == FAULTED:
+            self.stop() # Cannot be steered or driven reliably, let the drivetrain handle it (see 'Drivetrain.updateMode()')
+            return
 
-        try:
-            # Get the currect state of the swerve module
-            state = wpimath.kinematics.SwerveModuleState.optimize(
-                desiredState, encoderRotation
-            )
-        except Exception as e:
-            errorMsg('Could not get state:',e,__file__)
+        # Get the rotation of the absolute encoder
+        encoderRotation = self.snapshot.angle
+
+        # Get the currect state of the swerve module
+        state = wpimath.kinematics.SwerveModuleState.optimize(
+            desiredState, encoderRotation
+        )
 
         state.speed *= ((state.angle - encoderRotation).cos()) # IDK check robotpy examples in swervedrive
         targetAngle = state.angle.degrees() # Target angle of the swervemodule
 
-        try:
-            # Get the target motor speed
-            targetMotorSpeed = wpimath.units.radians_per_second(
-                state.speed * wpimath.units.radians(2*3.14159) #TODO: Ask if I should use 'radians' or 'radiansToDegrees'
-            )
-        except Exception as e:
-            errorMsg('Could not get target motor speed:',e,__file__)
+        # Get the target motor speed
+        targetMotorSpeed = wpimath.units.radians_per_second(
+            state.speed * wpimath.units.radians(2*3.14159) #TODO: Ask if I should use 'radians' or 'radiansToDegrees'
+        )
 
-        try:
-            # Set refrence to the drive motor's PID controller
-            self.motorDrive.PIDController.setReference(targetMotorSpeed, rev.CANSparkMax.ControlType.kVelocity)
-        except Exception as e:
-            errorMsg('Could not set reference to drive controller:',e,__file__)
-        
-        try:
-            # Set the position of the turn motor through the relative encoder
-            self.motorTurn.relativeEncoder.setPosition(self.absoluteEncoder.get_absolute_position().value_as_double * 360.0)
-        except Exception as e:
-            errorMsg('Could not set position to relative turn encoder:',e,__file__)
+        # Set refrence to the drive motor's PID controller
+        self.motorDrive.PIDController.setReference(targetMotorSpeed, self.velocityControl)
+        self.driveReference = targetMotorSpeed
 
-        try:
-            # Set the reference to the turn motor's PId controller
-            self.motorTurn.PIDController.setReference(float(targetAngle), rev.CANSparkMax.ControlType.kPosition)
-        except Exception as e:
-            errorMsg('Could not set reference to turn controller:',e,__file__)
\ No newline at end of file
+        # Set the position of the turn motor through the relative encoder (only from a fresh absolute reading)
+        if self.encoderHealth.status == OK:
+            self.motorTurn.relativeEncoder.setPosition(self.snapshot.absoluteDegrees)
+
+        # Set the reference to the turn motor's PId controller
+        self.motorTurn.PIDController.setReference(float(targetAngle), self.positionControl)
+        self.turnReference = targetAngle
+
+    def applySetpoint(self, setpoint: ModuleSetpoint):
+        '''
+        Same as 'setDesiredState()' for a setpoint from the drivetrain's 'ControlPath', without creating any wpimath objects
+        '''
+        if self.status == FAULTED:
+            self.stop()
+            return
+
+        # Turn the short way from the absolute encoder angle, and drive slower the further the module is from the target
+        currentAngle = self.snapshot.angleRadians
+        target = self.target
+        optimize(setpoint, currentAngle, target)
+        speed = target.speed * cosineBetween(target, currentAngle)
+
+        targetMotorSpeed = speed * (2*3.14159)
+        self.motorDrive.PIDController.setReference(targetMotorSpeed, self.velocityControl)
+        self.driveReference = targetMotorSpeed
+
+        if self.encoderHealth.status == OK:
+            self.motorTurn.relativeEncoder.setPosition(self.snapshot.absoluteDegrees)
+
+        targetAngle = degrees(target.angle)
+        self.motorTurn.PIDController.setReference(targetAngle, self.positionControl)
+        self.turnReference = targetAngle
+
+    def stop(self):
+        '''
+        Stops the drive motor and leaves the turn motor where it is
+        '''
+        self.motorDrive.PIDController.setReference(0.0, self.velocityControl)
+        self.driveReference = 0.0
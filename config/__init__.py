@@ -0,0 +1 @@
+# ABOUT: The config module loads 'constants.json' once into read-only objects that the rest of the robot reads from
@@ -0,0 +1,592 @@
+# Loads 'constants.json' once into typed, read-only objects
+# Hot-path code should copy the values it needs onto itself and re-copy them when 'subscribe()' reports a reload
+import json, math, os
+from types import MappingProxyType
+
+from extras.debugmsgs import *
+
+CONSTANTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'constants.json')
+
+class ConfigError(Exception):
+    '''
+    Raised when 'constants.json' is missing a value or a value has the wrong type
+    '''
+
+class FrozenConfig:
+    '''
+    # FrozenConfig
+    Base class for the read-only configuration objects
+
+    Values are assigned once in '__init__' through '_set()'. Any later assignment raises an AttributeError
+    '''
+    __slots__ = ()
+
+    def _set(self, name: str, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'{type(self).__name__}' is read-only (use 'reload()' to change the configuration)")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"'{type(self).__name__}' is read-only")
+
+    def __repr__(self):
+        return f'{type(self).__name__}(' + ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__) + ')'
+
+def _section(data: dict, key: str, path: str = ''):
+    '''
+    Returns a nested section (json object) of the constants
+    '''
+    value = data.get(key)
+    if not isinstance(value, dict):
+        raise ConfigError(f"'{path}{key}' must be an object")
+    return value
+
+def _number(section: dict, key: str, path: str):
+    '''
+    Returns a number from a section of the constants as a float
+    '''
+    value = section.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ConfigError(f"'{path}.{key}' must be a number (got {value!r})")
+    return float(value)
+
+def _integer(section: dict, key: str, path: str):
+    '''
+    Returns an integer (CAN ids, ports, etc.) from a section of the constants
+    '''
+    value = section.get(key)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ConfigError(f"'{path}.{key}' must be an integer (got {value!r})")
+    return value
+
+def _boolean(section: dict, key: str, path: str):
+    '''
+    Returns a true/false value from a section of the constants
+    '''
+    value = section.get(key)
+    if not isinstance(value, bool):
+        raise ConfigError(f"'{path}.{key}' must be true or false (got {value!r})")
+    return value
+
+def _string(section: dict, key: str, path: str):
+    '''
+    Returns a string from a section of the constants
+    '''
+    value = section.get(key)
+    if not isinstance(value, str):
+        raise ConfigError(f"'{path}.{key}' must be a string (got {value!r})")
+    return value
+
+def _numbers(section: dict, key: str, path: str, length: int):
+    '''
+    Returns a fixed length list of numbers from a section of the constants as a tuple of floats
+    '''
+    value = section.get(key)
+    if not isinstance(value, list) or len(value) != length:
+        raise ConfigError(f"'{path}.{key}' must be a list of {length} numbers (got {value!r})")
+    for number in value:
+        if isinstance(number, bool) or not isinstance(number, (int, float)):
+            raise ConfigError(f"'{path}.{key}' must only contain numbers (got {number!r})")
+    return tuple(float(number) for number in value)
+
+def _gearing(section: dict, key: str, path: str):
+    '''
+    Returns the overall ratio of a list of [driving, driven] gear pairs
+    '''
+    stages = section.get(key)
+    if not isinstance(stages, list) or not stages:
+        raise ConfigError(f"'{path}.{key}' must be a list of [driving, driven] pairs")
+
+    ratio = 1.0
+    for stage in stages:
+        if not isinstance(stage, list) or len(stage) != 2 or not all(isinstance(teeth, (int, float)) and teeth > 0 for teeth in stage):
+            raise ConfigError(f"'{path}.{key}' has an invalid gear pair {stage!r}")
+        ratio *= stage[0] / stage[1]
+    return ratio
+
+def _names(section: dict, key: str, path: str):
+    '''
+    Returns a read-only mapping of string values (used for auton commands)
+    '''
+    value = section.get(key)
+    if not isinstance(value, dict) or not all(isinstance(name, str) for name in value.values()):
+        raise ConfigError(f"'{path}.{key}' must be an object of strings")
+    return MappingProxyType(dict(value))
+
+class MacroConfig(FrozenConfig):
+    '''
+    # MacroConfig
+    A robot method bound to a button (or a chord of buttons) and an event
+    '''
+    EVENTS = ('PRESS', 'RELEASE', 'HOLD')
+    __slots__ = ('buttons', 'event', 'method')
+
+    def __init__(self, buttons: tuple, event: str, method: str):
+        self._set('buttons', buttons) # Button names, e.g. ('L_BUMPER', 'A') for "L_BUMPER+A"
+        self._set('event', event)
+        self._set('method', method) # Name of the method on the robot
+
+def _macros(section: dict, key: str, path: str):
+    '''
+    Returns the macros of a controller as a tuple of 'MacroConfig'
+
+    Each key is a button or a chord ("L_BUMPER+A"). A string value runs on release, an object can bind
+    "PRESS", "RELEASE" and "HOLD" separately. Empty names are ignored
+    '''
+    value = section.get(key, {})
+    if not isinstance(value, dict):
+        raise ConfigError(f"'{path}.{key}' must be an object")
+
+    macros = []
+    for chord, binding in value.items():
+        buttons = tuple(button.strip() for button in chord.split('+'))
+        events = {'RELEASE': binding} if isinstance(binding, str) else binding
+
+        if not isinstance(events, dict):
+            raise ConfigError(f"'{path}.{key}.{chord}' must be a method name or an object of events")
+        for event, method in events.items():
+            if event not in MacroConfig.EVENTS or not isinstance(method, str):
+                raise ConfigError(f"'{path}.{key}.{chord}' has an invalid event {event!r} (expected one of {MacroConfig.EVENTS})")
+            if method:
+                macros.append(MacroConfig(buttons, event, method))
+    return tuple(macros)
+
+class ControllerConfig(FrozenConfig):
+    '''
+    # ControllerConfig
+    Values from 'CONTROLLER_CONSTANTS'
+    '''
+    __slots__ = (
+        'mainId', 'auxId', 'rateLimit', 'rotationRateLimit', 'translationExpo', 'rotationExpo', 'maxRotationSpeed', 'slowModeScale',
+        'macros', 'auxMacros'
+    )
+
+    def __init__(self, data: dict):
+        path = 'CONTROLLER_CONSTANTS'
+        self._set('mainId', _integer(data, 'CONTROLLER_MAIN_ID', path))
+        self._set('auxId', _integer(data, 'CONTROLLER_AUX_ID', path))
+        self._set('rateLimit', _number(data, 'CONTROLLER_RATE_LIMIT', path)) # Translation, full speeds per second
+        self._set('rotationRateLimit', _number(data, 'CONTROLLER_ROTATION_RATE_LIMIT', path))
+        self._set('translationExpo', _number(data, 'CONTROLLER_TRANSLATION_EXPO', path)) # 0 (linear) - 1 (cubic)
+        self._set('rotationExpo', _number(data, 'CONTROLLER_ROTATION_EXPO', path))
+        self._set('maxRotationSpeed', math.radians(_number(data, 'CONTROLLER_MAX_ROTATION_SPEED', path))) # Degrees/second in json, radians here
+        self._set('slowModeScale', _number(data, 'CONTROLLER_SLOW_MODE_SCALE', path))
+        for name, key in (('translationExpo', 'CONTROLLER_TRANSLATION_EXPO'), ('rotationExpo', 'CONTROLLER_ROTATION_EXPO'), ('slowModeScale', 'CONTROLLER_SLOW_MODE_SCALE')):
+            if not 0.0 <= getattr(self, name) <= 1.0:
+                raise ConfigError(f"'{path}.{key}' must be between 0 and 1 (got {getattr(self, name)})")
+        self._set('macros', _macros(data, 'MACROS', path))
+        self._set('auxMacros', _macros(data, 'AUX_MACROS', path))
+
+class SwerveModuleConfig(FrozenConfig):
+    '''
+    # SwerveModuleConfig
+    CAN ids, offset and location of a single swerve module
+    '''
+    __slots__ = ('name', 'driveMotorId', 'turnMotorId', 'encoderId', 'offset', 'location')
+
+    def __init__(self, name: str, driveMotorId: int, turnMotorId: int, encoderId: int, offset: float, location: tuple):
+        self._set('name', name)
+        self._set('driveMotorId', driveMotorId)
+        self._set('turnMotorId', turnMotorId)
+        self._set('encoderId', encoderId)
+        self._set('offset', offset)
+        self._set('location', location)
+
+class CalculationsConfig(FrozenConfig):
+    '''
+    # CalculationsConfig
+    Values from 'CALCULATIONS'
+    '''
+    __slots__ = (
+        'finalDriveRatio', 'finalTurnRatio', 'wheelCircumference',
+        'moduleMaxSpeed', 'chassisMaxSpeed',
+        'moduleMaxAngularVelocity', 'moduleMaxAngularAcceleration',
+        'motorMaxOutput', 'motorDeadband'
+    )
+
+    def __init__(self, data: dict):
+        path = 'CALCULATIONS'
+        self._set('finalDriveRatio', _number(data, 'FINAL_DRIVE_RATIO', path))
+        self._set('finalTurnRatio', _number(data, 'FINAL_TURN_RATIO', path))
+        self._set('wheelCircumference', _number(data, 'WHEEL_CIRCUMFERENCE', path))
+        self._set('moduleMaxSpeed', _number(data, 'MODULE_MAX_SPEED', path))
+        self._set('chassisMaxSpeed', _number(data, 'CHASSIS_MAX_SPEED', path))
+        self._set('moduleMaxAngularVelocity', _number(data, 'MODULE_MAX_ANGULAR_VELOCITY', path))
+        self._set('moduleMaxAngularAcceleration', _number(data, 'MODULE_MAX_ANGULAR_ACCELERATION', path))
+        self._set('motorMaxOutput', _number(data, 'MOTOR_MAX_OUTPUT', path))
+        self._set('motorDeadband', _number(data, 'MOTOR_DEADBAND', path))
+
+class ModuleConstantsConfig(FrozenConfig):
+    '''
+    # ModuleConstantsConfig
+    Values from 'MODULE_CONSTANTS' and the encoder conversion factors derived from them
+    '''
+    __slots__ = (
+        'wheelRadius', 'driveGearRatio', 'turnGearRatio',
+        'drivePositionFactor', 'driveVelocityFactor', # Motor rotations -> meters, RPM -> meters/second
+        'turnPositionFactor', 'turnVelocityFactor', # Motor rotations -> radians, RPM -> radians/second
+        'driveCurrentLimit', 'turnCurrentLimit',
+        'drivePID', 'turnPID' # (P, I, D, FF)
+    )
+
+    def __init__(self, data: dict):
+        path = 'MODULE_CONSTANTS'
+        self._set('wheelRadius', _number(data, 'WHEEL_RADIUS', path))
+        self._set('driveGearRatio', _gearing(data, 'DRIVE_GEARING', path))
+        self._set('turnGearRatio', _gearing(data, 'TURN_GEARING', path))
+
+        self._set('drivePositionFactor', self.wheelRadius * 2.0 * math.pi * self.driveGearRatio)
+        self._set('driveVelocityFactor', self.drivePositionFactor / 60.0)
+        self._set('turnPositionFactor', 2.0 * math.pi * self.turnGearRatio)
+        self._set('turnVelocityFactor', self.turnPositionFactor / 60.0)
+
+        self._set('driveCurrentLimit', _integer(data, 'DRIVE_CURRENT_LIMIT', path))
+        self._set('turnCurrentLimit', _integer(data, 'TURN_CURRENT_LIMIT', path))
+        self._set('drivePID', _numbers(data, 'DRIVE_PID_CONSTANTS', path, 4))
+        self._set('turnPID', _numbers(data, 'TURN_PID_CONSTANTS', path, 4))
+
+class MotorSetupConfig(FrozenConfig):
+    '''
+    # MotorSetupConfig
+    Values from 'MOTOR_SETUP_CONSTANTS'
+    '''
+    __slots__ = ('burnFlash', 'parallelDevices')
+
+    def __init__(self, data: dict):
+        path = 'MOTOR_SETUP_CONSTANTS'
+        self._set('burnFlash', _boolean(data, 'BURN_FLASH', path)) # Save changed settings on the motor controllers
+        self._set('parallelDevices', _integer(data, 'PARALLEL_DEVICES', path)) # Motors configured at the same time
+
+class CANBusConfig(FrozenConfig):
+    '''
+    # CANBusConfig
+    Values from 'CAN_BUS_CONSTANTS'
+    '''
+    __slots__ = ('bitrate', 'maxUtilization')
+
+    def __init__(self, data: dict):
+        path = 'CAN_BUS_CONSTANTS'
+        self._set('bitrate', _integer(data, 'BITRATE', path)) # Bits per second
+        self._set('maxUtilization', _number(data, 'MAX_UTILIZATION', path)) # Expected load (0.0 - 1.0) above which a warning is printed
+
+class PathPlannerConfig(FrozenConfig):
+    '''
+    # PathPlannerConfig
+    Values from 'PATHPLANNER_CONSTANTS'
+    '''
+    __slots__ = ('autonomousCommands', 'translationPID', 'rotationPID', 'maxSpeed', 'driveBaseRadius')
+
+    def __init__(self, data: dict):
+        path = 'PATHPLANNER_CONSTANTS'
+        self._set('autonomousCommands', _names(data, 'AUTONOMOUS_COMMANDS', path))
+        self._set('translationPID', _numbers(data, 'TRANSLATION_PID_CONSTANTS', path, 3))
+        self._set('rotationPID', _numbers(data, 'ROTATION_PID_CONSTANTS', path, 3))
+        self._set('maxSpeed', _number(data, 'MAX_SPEED', path))
+        self._set('driveBaseRadius', _number(data, 'DRIVE_BASE_RADIUS', path)) # Meters from the middle of the robot to the furthest module
+
+class PathfinderConfig(FrozenConfig):
+    '''
+    # PathfinderConfig
+    Values from 'PATHFINDER_CONSTANTS'
+    '''
+    __slots__ = ('maxAcceleration', 'maxAngularVelocity', 'maxAngularAcceleration', 'clearanceMargin')
+
+    def __init__(self, data: dict):
+        path = 'PATHFINDER_CONSTANTS'
+        self._set('maxAcceleration', _number(data, 'MAX_ACCELERATION', path)) # Meters/second^2
+        self._set('maxAngularVelocity', math.radians(_number(data, 'MAX_ANGULAR_VELOCITY', path))) # Degrees in json, radians here
+        self._set('maxAngularAcceleration', math.radians(_number(data, 'MAX_ANGULAR_ACCELERATION', path)))
+        self._set('clearanceMargin', _number(data, 'CLEARANCE_MARGIN', path)) # Meters kept between the robot and obstacles
+
+class PathCacheConfig(FrozenConfig):
+    '''
+    # PathCacheConfig
+    Values from 'PATH_CACHE_CONSTANTS'
+    '''
+    __slots__ = ('persist', 'directory', 'warmupBudget', 'rotationTolerance')
+
+    def __init__(self, data: dict):
+        path = 'PATH_CACHE_CONSTANTS'
+        self._set('persist', _boolean(data, 'PERSIST', path)) # Save generated trajectories for the next start
+        self._set('directory', _string(data, 'DIRECTORY', path) or None) # Empty -> default cache directory of the platform
+        self._set('warmupBudget', _number(data, 'WARMUP_BUDGET', path)) # Seconds of path work per disabled tick
+        self._set('rotationTolerance', math.radians(_number(data, 'ROTATION_TOLERANCE', path))) # Degrees in json, radians here
+
+class VisionConfig(FrozenConfig):
+    '''
+    # VisionConfig
+    Values from 'VISION_CONSTANTS'
+    '''
+    __slots__ = ('enabled', 'address', 'pollPeriod', 'stdDevs', 'maxPoseError')
+
+    def __init__(self, data: dict):
+        path = 'VISION_CONSTANTS'
+        self._set('enabled', _boolean(data, 'ENABLED', path))
+        self._set('address', _string(data, 'ADDRESS', path) or None) # Empty -> discover the Limelight
+        self._set('pollPeriod', _number(data, 'POLL_PERIOD', path))
+        self._set('stdDevs', _numbers(data, 'STD_DEVS', path, 3)) # x (meters), y (meters), heading (radians)
+        self._set('maxPoseError', _number(data, 'MAX_POSE_ERROR', path)) # Meters, 0 accepts every measurement
+
+class OdometryConfig(FrozenConfig):
+    '''
+    # OdometryConfig
+    Values from 'ODOMETRY_CONSTANTS'
+    '''
+    __slots__ = ('stateStdDevs', 'historySize', 'frequency', 'gyroUpdateRate', 'sampleQueueSize')
+
+    def __init__(self, data: dict):
+        path = 'ODOMETRY_CONSTANTS'
+        self._set('stateStdDevs', _numbers(data, 'STATE_STD_DEVS', path, 3)) # x (meters), y (meters), heading (radians)
+        self._set('historySize', _integer(data, 'HISTORY_SIZE', path))
+        self._set('frequency', _number(data, 'FREQUENCY', path)) # Hz of the odometry thread, 0 to update in the robot loop
+        self._set('gyroUpdateRate', _integer(data, 'GYRO_UPDATE_RATE', path)) # Hz
+        self._set('sampleQueueSize', _integer(data, 'SAMPLE_QUEUE_SIZE', path))
+
+class DiagnosticsConfig(FrozenConfig):
+    '''
+    # DiagnosticsConfig
+    Values from 'DIAGNOSTICS_CONSTANTS'
+    '''
+    __slots__ = ('profilerEnabled', 'profilerWindow', 'overrunHistory', 'startupReport', 'startupImports', 'allocationWatch', 'allocationRate')
+
+    def __init__(self, data: dict):
+        path = 'DIAGNOSTICS_CONSTANTS'
+        self._set('profilerEnabled', _boolean(data, 'PROFILER_ENABLED', path))
+        self._set('profilerWindow', _integer(data, 'PROFILER_WINDOW', path))
+        self._set('overrunHistory', _integer(data, 'OVERRUN_HISTORY', path))
+        self._set('startupReport', _boolean(data, 'STARTUP_REPORT', path)) # Boot time printed at the end of 'robotInit()'
+        self._set('startupImports', _integer(data, 'STARTUP_IMPORTS', path)) # Slowest import groups listed in it
+        self._set('allocationWatch', _boolean(data, 'ALLOCATION_WATCH', path)) # Warn when memory is kept every tick ('extras/allocations.py')
+        self._set('allocationRate', _number(data, 'ALLOCATION_RATE', path)) # Memory blocks per tick that count as kept
+
+class SchedulerConfig(FrozenConfig):
+    '''
+    # SchedulerConfig
+    Values from 'SCHEDULER_CONSTANTS'
+    '''
+    __slots__ = ('budget', 'maxDeferrals')
+
+    def __init__(self, data: dict):
+        path = 'SCHEDULER_CONSTANTS'
+        self._set('budget', _number(data, 'BUDGET', path)) # Seconds of command execution per tick before low priority commands are deferred
+        self._set('maxDeferrals', _integer(data, 'MAX_DEFERRALS', path)) # Ticks in a row a command can be deferred
+
+class HealthConfig(FrozenConfig):
+    '''
+    # HealthConfig
+    Values from 'HEALTH_CONSTANTS'
+    '''
+    __slots__ = ('faultTimeout', 'recoveryReads', 'degradedSpeedScale')
+
+    def __init__(self, data: dict):
+        path = 'HEALTH_CONSTANTS'
+        self._set('faultTimeout', _number(data, 'FAULT_TIMEOUT', path)) # Seconds without a good reading before a device is faulted
+        self._set('recoveryReads', _integer(data, 'RECOVERY_READS', path)) # Good readings in a row before a faulted device is trusted again
+        self._set('degradedSpeedScale', _number(data, 'DEGRADED_SPEED_SCALE', path)) # Fraction of the requested speed driven in degraded mode
+
+class LoggingConfig(FrozenConfig):
+    '''
+    # LoggingConfig
+    Values from 'LOGGING_CONSTANTS'
+    '''
+    __slots__ = ('enabled', 'directory', 'bufferSize', 'flushPeriod', 'maxFileSize', 'minFreeSpace', 'maxFiles', 'rateLimit', 'level', 'console')
+
+    LEVELS = ('DEBUG', 'INFO', 'SUCCESS', 'WARNING', 'ERROR') # 'INFO' and 'SUCCESS' are the same level
+
+    def __init__(self, data: dict):
+        path = 'LOGGING_CONSTANTS'
+        self._set('enabled', _boolean(data, 'ENABLED', path))
+        self._set('directory', _string(data, 'DIRECTORY', path) or None) # Empty -> default log directory of the platform
+        self._set('bufferSize', _integer(data, 'BUFFER_SIZE', path)) # Bytes
+        self._set('flushPeriod', _number(data, 'FLUSH_PERIOD', path))
+        self._set('maxFileSize', int(_number(data, 'MAX_FILE_SIZE', path) * 1e6)) # Megabytes in the file, bytes here (0 for no limit)
+        self._set('minFreeSpace', int(_number(data, 'MIN_FREE_SPACE', path) * 1e6)) # Old logs are deleted below this many free megabytes
+        self._set('maxFiles', _integer(data, 'MAX_FILES', path)) # Logs kept in the directory (0 for no limit)
+        self._set('rateLimit', _number(data, 'RATE_LIMIT', path))
+        self._set('console', _boolean(data, 'CONSOLE', path))
+
+        level = _string(data, 'LEVEL', path).upper()
+        if level not in self.LEVELS:
+            raise ConfigError(f"{path}.LEVEL must be one of {self.LEVELS}, got {level!r}")
+        self._set('level', level)
+
+class TelemetryConfig(FrozenConfig):
+    '''
+    # TelemetryConfig
+    Values from 'TELEMETRY_CONSTANTS'
+    '''
+    __slots__ = ('enabled', 'table', 'flushNetwork', 'maxRate', 'positionThreshold', 'angleThreshold', 'speedThreshold')
+
+    def __init__(self, data: dict):
+        path = 'TELEMETRY_CONSTANTS'
+        self._set('enabled', _boolean(data, 'ENABLED', path))
+        self._set('table', _string(data, 'TABLE', path)) # NetworkTables table every topic is published under
+        self._set('flushNetwork', _boolean(data, 'FLUSH_NETWORK', path)) # Send every tick instead of on the NetworkTables period
+        self._set('maxRate', _number(data, 'MAX_RATE', path)) # Most times per second a topic is sent, 0 for no cap
+        self._set('positionThreshold', _number(data, 'POSITION_THRESHOLD', path)) # Meters a value must change by to be sent again
+        self._set('angleThreshold', math.radians(_number(data, 'ANGLE_THRESHOLD', path))) # Degrees in json, radians here
+        self._set('speedThreshold', _number(data, 'SPEED_THRESHOLD', path)) # Meters/second (radians/second for rotation)
+
+class WorkerConfig(FrozenConfig):
+    '''
+    # WorkerConfig
+    Values from 'WORKER_CONSTANTS'
+    '''
+    __slots__ = ('enabled', 'threads', 'queueSize', 'latencyWindow')
+
+    def __init__(self, data: dict):
+        path = 'WORKER_CONSTANTS'
+        self._set('enabled', _boolean(data, 'ENABLED', path))
+        self._set('threads', _integer(data, 'THREADS', path)) # Threads running the jobs that are plain functions
+        self._set('queueSize', _integer(data, 'QUEUE_SIZE', path)) # Jobs waiting or running before new ones are refused
+        self._set('latencyWindow', _integer(data, 'LATENCY_WINDOW', path)) # Jobs kept for the timing report
+
+class ReplayConfig(FrozenConfig):
+    '''
+    # ReplayConfig
+    Values from 'REPLAY_CONSTANTS'
+    '''
+    __slots__ = ('record', 'directory', 'chunkTicks', 'enabledOnly', 'maxFileSize', 'maxTotalSize', 'maxFiles')
+
+    def __init__(self, data: dict):
+        path = 'REPLAY_CONSTANTS'
+        self._set('record', _boolean(data, 'RECORD', path))
+        self._set('directory', _string(data, 'DIRECTORY', path) or None) # Empty -> default replay directory of the platform
+        self._set('chunkTicks', _integer(data, 'CHUNK_TICKS', path)) # Ticks written to the file at a time
+        self._set('enabledOnly', _boolean(data, 'ENABLED_ONLY', path)) # Skip the ticks while the robot is disabled
+        self._set('maxFileSize', int(_number(data, 'MAX_FILE_SIZE', path) * 1e6)) # Megabytes in the file, bytes here (0 for no limit)
+        self._set('maxTotalSize', int(_number(data, 'MAX_TOTAL_SIZE', path) * 1e6)) # Megabytes of recordings kept in the directory
+        self._set('maxFiles', _integer(data, 'MAX_FILES', path)) # Recordings kept in the directory (0 for no limit)
+
+class AutotuneConfig(FrozenConfig):
+    '''
+    # AutotuneConfig
+    Values from 'AUTOTUNE_CONSTANTS' (model of the robot and search settings of 'extras/autotune.py')
+    '''
+    __slots__ = ('robotMass', 'turnMomentOfInertia', 'batteryVoltage', 'speedError', 'population', 'generations', 'workers')
+
+    def __init__(self, data: dict):
+        path = 'AUTOTUNE_CONSTANTS'
+        self._set('robotMass', _number(data, 'ROBOT_MASS', path)) # Kilograms, with battery and bumpers
+        self._set('turnMomentOfInertia', _number(data, 'TURN_MOMENT_OF_INERTIA', path)) # Kilograms * meters^2 of a module around its steering axis
+        self._set('batteryVoltage', _number(data, 'BATTERY_VOLTAGE', path))
+        self._set('speedError', _number(data, 'SPEED_ERROR', path)) # Fraction of the commanded chassis speed lost to wheel slip and scrub
+        self._set('population', _integer(data, 'POPULATION', path)) # Candidates scored per generation
+        self._set('generations', _integer(data, 'GENERATIONS', path))
+        self._set('workers', _integer(data, 'WORKERS', path)) # Processes scoring candidates, 0 -> one per CPU
+
+class RobotConfig(FrozenConfig):
+    '''
+    # RobotConfig
+    Every value from 'constants.json', validated and converted once
+    '''
+    __slots__ = (
+        'path', 'hostname',
+        'controller', 'calculations', 'moduleConstants', 'motorSetup', 'canBus', 'pathplanner', 'pathfinder', 'pathCache', 'vision', 'odometry', 'diagnostics', 'scheduler', 'health', 'logging', 'telemetry', 'worker', 'replay', 'autotune',
+        'frontLeft', 'frontRight', 'rearLeft', 'rearRight',
+        'modules' # (frontLeft, frontRight, rearLeft, rearRight) -> same order as the drivetrain kinematics
+    )
+
+    def __init__(self, data: dict, path: str):
+        self._set('path', path)
+        self._set('hostname', _integer(data, 'HOSTNAME', ''))
+
+        self._set('controller', ControllerConfig(_section(data, 'CONTROLLER_CONSTANTS')))
+        self._set('calculations', CalculationsConfig(_section(data, 'CALCULATIONS')))
+        self._set('moduleConstants', ModuleConstantsConfig(_section(data, 'MODULE_CONSTANTS')))
+        self._set('motorSetup', MotorSetupConfig(_section(data, 'MOTOR_SETUP_CONSTANTS')))
+        self._set('canBus', CANBusConfig(_section(data, 'CAN_BUS_CONSTANTS')))
+        self._set('pathplanner', PathPlannerConfig(_section(data, 'PATHPLANNER_CONSTANTS')))
+        self._set('pathfinder', PathfinderConfig(_section(data, 'PATHFINDER_CONSTANTS')))
+        self._set('pathCache', PathCacheConfig(_section(data, 'PATH_CACHE_CONSTANTS')))
+        self._set('vision', VisionConfig(_section(data, 'VISION_CONSTANTS')))
+        self._set('odometry', OdometryConfig(_section(data, 'ODOMETRY_CONSTANTS')))
+        self._set('diagnostics', DiagnosticsConfig(_section(data, 'DIAGNOSTICS_CONSTANTS')))
+        self._set('scheduler', SchedulerConfig(_section(data, 'SCHEDULER_CONSTANTS')))
+        self._set('health', HealthConfig(_section(data, 'HEALTH_CONSTANTS')))
+        self._set('logging', LoggingConfig(_section(data, 'LOGGING_CONSTANTS')))
+        self._set('telemetry', TelemetryConfig(_section(data, 'TELEMETRY_CONSTANTS')))
+        self._set('worker', WorkerConfig(_section(data, 'WORKER_CONSTANTS')))
+        self._set('replay', ReplayConfig(_section(data, 'REPLAY_CONSTANTS')))
+        self._set('autotune', AutotuneConfig(_section(data, 'AUTOTUNE_CONSTANTS')))
+
+        motors = _section(data, 'MOTOR_CONSTANTS')
+        offsets = _section(data, 'OFFSETS')
+
+        def module(name: str, offsetSign: float):
+            offset = _number(offsets, name, 'OFFSETS')
+            return SwerveModuleConfig(
+                name,
+                _integer(motors, f'MOTOR_DRIVE_{name}_ID', 'MOTOR_CONSTANTS'),
+                _integer(motors, f'MOTOR_TURN_{name}_ID', 'MOTOR_CONSTANTS'),
+                _integer(motors, f'ENCODER_TURN_{name}_ID', 'MOTOR_CONSTANTS'),
+                offset,
+                (offset, offsetSign * offset) # Location of the module relative to the middle of the robot
+            )
+
+        self._set('frontLeft', module('FRONT_LEFT', 1.0))
+        self._set('frontRight', module('FRONT_RIGHT', -1.0))
+        self._set('rearLeft', module('REAR_LEFT', -1.0))
+        self._set('rearRight', module('REAR_RIGHT', -1.0))
+        self._set('modules', (self.frontLeft, self.frontRight, self.rearLeft, self.rearRight))
+
+def load(path: str = CONSTANTS_PATH):
+    '''
+    Reads and validates a constants file, returning a new 'RobotConfig'
+
+    Raises a 'ConfigError' if the file cannot be read or a value is missing/invalid
+    '''
+    try:
+        with open(path) as jsonf:
+            data = json.load(jsonf)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Could not read '{path}': {e}")
+
+    if not isinstance(data, dict):
+        raise ConfigError(f"'{path}' must contain a json object")
+    return RobotConfig(data, path)
+
+_config = load()
+_subscribers = []
+
+def get():
+    '''
+    Returns the current configuration
+    '''
+    return _config
+
+def subscribe(callback):
+    '''
+    Calls 'callback(config)' every time the configuration is reloaded
+    '''
+    _subscribers.append(callback)
+
+def reload(path: str = None):
+    '''
+    Re-reads the constants file and notifies every subscriber (used for tuning values in simulation)
+
+    If the new file is invalid the current configuration is kept. Returns True if the configuration was replaced
+    '''
+    try:
+        newConfig = load(path or _config.path)
+    except ConfigError as e:
+        debugMsg(f'Config reload failed, keeping current values: {e}')
+        return False
+
+    apply(newConfig)
+    return True
+
+def apply(newConfig: RobotConfig):
+    '''
+    Replaces the configuration with one returned by 'load()' and notifies every subscriber
+
+    'load()' can run on any thread, this must run on the robot loop (subscribers change the objects it uses)
+    '''
+    global _config
+
+    _config = newConfig
+    for callback in _subscribers:
+        callback(newConfig)
+
+    successMsg(f"Reloaded '{newConfig.path}'")
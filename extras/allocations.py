@@ -0,0 +1,219 @@
+# Checks that the control path (controller -> module setpoints -> motor references) leaves no memory behind after a tick
+# Run with 'python -m extras.allocations [ticks]' (uses the simulated hardware backend). Exits with 1 if memory is kept
+# 'AllocationWatch' runs a cheaper check from 'robotPeriodic()' every time the robot code runs, and says when to run this one
+import gc
+import math
+import os
+import sys
+
+from extras.debugmsgs import *
+
+# Files of the control path. Memory is counted against the line of Python that allocated it
+CONTROL_PATH_FILES = (
+    'components/controller.py',
+    'components/inputshaping.py',
+    'components/drivetrain.py',
+    'components/swervemodule.py',
+    'components/controlpath.py',
+    'hardware/motors.py',
+    'hardware/simulation.py'
+)
+
+class AllocationResult:
+    '''
+    # AllocationResult
+    Memory kept by the control path between the start and the end of a measurement
+    '''
+    def __init__(self, ticks: int, differences: list):
+        self.ticks = ticks
+        self.differences = [difference for difference in differences if difference.size_diff or difference.count_diff]
+        self.bytes = sum(difference.size_diff for difference in self.differences)
+        self.blocks = sum(difference.count_diff for difference in self.differences)
+
+    def report(self):
+        if not self.differences:
+            successMsg(f'Control path: no memory kept over {self.ticks} ticks')
+            return
+
+        warningMsg(f'Control path kept {self.bytes} bytes in {self.blocks} blocks over {self.ticks} ticks ({self.bytes / self.ticks:.1f} bytes/tick)')
+        for difference in self.differences[:10]:
+            frame = difference.traceback[0]
+            debugMsg(f'  {frame.filename}:{frame.lineno}: {difference.size_diff:+} bytes, {difference.count_diff:+} blocks')
+
+class AllocationWatch:
+    '''
+    # AllocationWatch
+    Notices memory kept tick after tick while the robot is enabled, on the robot and in simulation
+
+    The memory blocks of the whole process ('sys.getallocatedblocks()', no tracing) are counted every 'windowTicks'
+    enabled ticks. Caches and buffers stop growing once they are full, memory kept every tick does not: a warning is
+    given once the count grew by more than 'blocksPerTick' in 'windows' windows in a row. The first 'warmupWindows'
+    windows after the robot is enabled are not counted (commands and reused objects are created then)
+    '''
+    def __init__(self, blocksPerTick: float = 0.2, windowTicks: int = 250, windows: int = 4, warmupWindows: int = 2):
+        self.blocksPerTick = blocksPerTick
+        self.windowTicks = windowTicks
+        self.windows = windows
+        self.warmupWindows = warmupWindows
+
+        self.ticks = 0 # Enabled ticks in the current window
+        self.blocks = None # Block count at the start of the current window (None while disabled)
+        self.skipped = 0 # Windows skipped since the robot was enabled
+        self.growing = 0 # Windows in a row that grew too fast
+        self.growth = 0 # Blocks gained over those windows
+        self.warned = False
+
+    def update(self, enabled: bool):
+        '''
+        Call once per tick (from 'robotPeriodic()')
+        '''
+        if not enabled:
+            self.blocks = None
+            return
+
+        if self.blocks is None:
+            self.blocks = sys.getallocatedblocks()
+            self.ticks = 0
+            self.skipped = 0
+            self.growing = 0
+            self.growth = 0
+            return
+
+        self.ticks += 1
+        if self.ticks < self.windowTicks:
+            return
+
+        blocks = sys.getallocatedblocks()
+        growth = blocks - self.blocks
+        self.blocks = blocks
+        self.ticks = 0
+        if self.skipped < self.warmupWindows:
+            self.skipped += 1
+            return
+
+        if growth <= self.blocksPerTick * self.windowTicks:
+            self.growing = 0
+            self.growth = 0
+            return
+        self.growing += 1
+        self.growth += growth
+
+        if self.growing >= self.windows and not self.warned:
+            self.warned = True # Once per run, the log would fill up otherwise
+            ticks = self.growing * self.windowTicks
+            warningMsg(f"Memory grew by {self.growth} blocks over {ticks} enabled ticks ({self.growth / ticks:.1f} blocks/tick), run 'python -m extras.allocations' to find where")
+
+class AllocationCheck:
+    '''
+    # AllocationCheck
+    Drives the simulated robot with changing controller input and compares the memory held by the control path
+    before and after, once every object it reuses has been created (warm up)
+
+    Ticks alternate between field relative (teleop) and robot relative (autonomous) driving, and the inputs go through
+    zero so the stopped path is measured too. Both snapshots are taken after the same settling input, so the reused
+    objects hold the same values (and the same number of new floats) each time
+    '''
+    SETTLE_INPUT = (0.5, -0.5, 0.5)
+    def __init__(self, robot):
+        from hardware import backend
+        from hardware.simulation import SimBackend, SimRunner
+        import wpilib.simulation
+
+        if not isinstance(backend.get(), SimBackend):
+            errorMsg('The allocation check needs the simulated hardware backend (ROBOT_HARDWARE_BACKEND=sim)', None)
+
+        self.runner = SimRunner(robot)
+        self.robot = robot
+        self.driverStation = wpilib.simulation.DriverStationSim
+        self.stepTiming = wpilib.simulation.stepTimingAsync
+
+        # Nothing else should run Python code while memory is traced
+        if robot.recorder is not None:
+            robot.recorder.stop()
+            robot.recorder = None
+        drivetrain = robot.drivetrain
+        if drivetrain.odometryThread is not None:
+            drivetrain.odometryThread.stop()
+            drivetrain.odometryThread = None
+
+        self.port = robot.controller.wpilibController.getPort()
+        self.driverStation.setJoystickAxisCount(self.port, 6)
+        self.runner.setMode('teleop')
+
+        # Controller input of every tick (left X, left Y, right X), made before anything is traced
+        self.inputs = tuple(
+            (math.sin(tick * 0.05), math.cos(tick * 0.031), math.sin(tick * 0.017) if tick % 200 < 150 else 0.0)
+            for tick in range(1000)
+        )
+
+    def tick(self, index: int, inputs: tuple = None):
+        leftX, leftY, rightX = inputs or self.inputs[index % len(self.inputs)]
+        driverStation = self.driverStation
+        driverStation.setJoystickAxis(self.port, 0, leftX)
+        driverStation.setJoystickAxis(self.port, 1, leftY)
+        driverStation.setJoystickAxis(self.port, 4, rightX)
+        driverStation.notifyNewData()
+        self.stepTiming(self.runner.period)
+
+        self.robot.driveWithJoystick(index % 2 == 0)
+
+    def settle(self, ticks: int = 100):
+        '''
+        Drives with 'SETTLE_INPUT' until the slew rate limiters reach it
+        '''
+        for index in range(ticks):
+            self.tick(index, self.SETTLE_INPUT)
+
+    def run(self, ticks: int = 5000, warmup: int = 1000):
+        '''
+        Runs 'warmup' ticks, then measures 'ticks' more. Returns an 'AllocationResult'
+        '''
+        import tracemalloc # Not imported with the module, the robot code only needs 'AllocationWatch'
+
+        for index in range(warmup):
+            self.tick(index)
+
+        # Floats are recycled through a free list, so one made before tracing started can end up in a reused object
+        # and look like memory that went away. Start tracing before the robot is created (see 'main()')
+        if not tracemalloc.is_tracing():
+            warningMsg('Memory tracing started after the robot was created, the result may be off by a few floats')
+            tracemalloc.start()
+
+        filters = [tracemalloc.Filter(True, os.path.join('*', path)) for path in CONTROL_PATH_FILES]
+        self.settle()
+        gc.collect()
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+
+        for index in range(warmup, warmup + ticks):
+            self.tick(index)
+        self.settle()
+        gc.collect()
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        tracemalloc.stop()
+
+        return AllocationResult(ticks, after.compare_to(before, 'lineno'))
+
+def main(arguments: list):
+    # wpilib looks for 'deploy' next to the main script when it is first imported, so pretend to be 'robot.py'
+    import __main__
+    robotDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __main__.__file__ = os.path.join(robotDirectory, 'robot.py')
+    sys.path.insert(0, robotDirectory)
+
+    import tracemalloc
+    tracemalloc.start() # Before any object of the robot code exists
+
+    from hardware import backend
+    from hardware.simulation import SimBackend
+    backend.use(SimBackend())
+    import robot
+
+    check = AllocationCheck(robot.terrance())
+    result = check.run(int(arguments[0]) if arguments else 5000)
+    from extras.logger import logger, DEBUG
+    logger.level = DEBUG # The robot prints from 'LOGGING_CONSTANTS.LEVEL' up, the report is printed in full
+    result.report()
+    return 1 if result.differences else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
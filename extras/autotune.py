@@ -0,0 +1,530 @@
+# Searches the PID gains of the swerve modules and of the path follower on a model of the robot, and writes the best ones
+# to a copy of the constants for review ('constants.proposal.json', next to 'constants.json')
+# Run with 'python -m extras.autotune [drive] [turn] [chassis]' (every loop by default). Candidates are scored on a
+# process pool, so a search takes a few minutes instead of hours of robot time
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from extras.debugmsgs import *
+
+PROPOSAL_FILE = 'constants.proposal.json'
+SEED = 668 # Same candidates on every run with the same constants
+
+SPARK_MAX_PERIOD = 0.001 # The SPARK MAX runs its PID loop at 1 kHz
+ROBOT_PERIOD = 0.02 # New references are sent (and PathPlanner's controllers run) every robot tick
+CHASSIS_SUBSTEPS = 4 # Steps of the chassis model per robot tick
+
+# The NEO's built-in encoder: 42 counts per rotation, with the velocity averaged over the last 32 ms
+NEO_COUNTS_PER_ROTATION = 42
+NEO_VELOCITY_WINDOW = 32 # SPARK MAX periods
+
+# Drive velocity references (fractions of the free speed) and turn angle references (degrees, at most 90 degrees apart
+# like after 'optimize()'), each held for the given seconds
+DRIVE_STEPS = (0.25, 0.75, -0.5, 0.0)
+DRIVE_STEP_TIME = 0.4
+TURN_STEPS = (20.0, 110.0, 65.0, -25.0)
+TURN_STEP_TIME = 0.3
+
+# Paths the chassis follows: start (x, y, degrees of travel), waypoints, end, (start heading, end heading) of the robot
+REFERENCE_PATHS = (
+    ((0.0, 0.0, 0.0), (), (3.0, 0.0, 0.0), (0.0, 90.0)), # Straight while turning
+    ((0.0, 0.0, 0.0), ((1.0, 0.75), (2.0, -0.75)), (3.0, 0.0, 0.0), (0.0, 180.0)), # S-curve
+    ((0.0, 0.0, 0.0), ((1.5, 1.5),), (0.0, 3.0, 180.0), (0.0, -90.0)) # U-turn
+)
+PATH_HOLD_TIME = 1.0 # Seconds the end of a path is held, so settling is scored too
+START_ERROR = (0.1, -0.1, math.radians(8.0)) # Pose error (meters, radians) the robot starts every path with
+
+CHATTER_WEIGHT = 0.05 # Cost of the output changing every step (noise amplified by D shakes the mechanism)
+UNSTABLE_COST = 1e6 # Cost of a candidate that diverges
+
+# Loops that can be tuned: where their gains are in 'constants.json', and the (lowest, highest, can be turned off) value
+# searched for each gain. None keeps the value from the constants
+LOOPS = {
+    'drive': {
+        'keys': (('MODULE_CONSTANTS', 'DRIVE_PID_CONSTANTS', 4),),
+        'names': ('P', 'I', 'D', 'FF'),
+        'bounds': ((1e-4, 1.0, False), (1e-7, 1e-2, True), (1e-4, 1.0, True), (0.01, 1.0, False))
+    },
+    'turn': {
+        'keys': (('MODULE_CONSTANTS', 'TURN_PID_CONSTANTS', 4),),
+        'names': ('P', 'I', 'D', 'FF'),
+        'bounds': ((1e-4, 1.0, False), (1e-8, 1e-3, True), (1e-4, 1.0, True), None)
+    },
+    'chassis': {
+        'keys': (('PATHPLANNER_CONSTANTS', 'TRANSLATION_PID_CONSTANTS', 3), ('PATHPLANNER_CONSTANTS', 'ROTATION_PID_CONSTANTS', 3)),
+        'names': ('translation P', 'translation I', 'translation D', 'rotation P', 'rotation I', 'rotation D'),
+        'bounds': ((0.05, 20.0, False), (1e-3, 5.0, True), (1e-4, 1.0, True), (0.05, 20.0, False), (1e-3, 5.0, True), (1e-4, 1.0, True))
+    }
+}
+
+def referencePaths(maxSpeed: float, maxAcceleration: float):
+    '''
+    Samples every 'REFERENCE_PATHS' once per robot tick, as tuples of the field relative targets PathPlanner's
+    controllers get: (x, y, x velocity, y velocity, heading, angular velocity) in meters and radians
+    '''
+    from wpimath.geometry import Pose2d, Rotation2d, Translation2d
+    from wpimath.trajectory import TrajectoryConfig, TrajectoryGenerator
+
+    paths = []
+    for start, waypoints, end, (startHeading, endHeading) in REFERENCE_PATHS:
+        trajectory = TrajectoryGenerator.generateTrajectory(
+            Pose2d(start[0], start[1], Rotation2d.fromDegrees(start[2])),
+            [Translation2d(x, y) for x, y in waypoints],
+            Pose2d(end[0], end[1], Rotation2d.fromDegrees(end[2])),
+            TrajectoryConfig(maxSpeed, maxAcceleration)
+        )
+        duration = trajectory.totalTime()
+        startHeading = math.radians(startHeading)
+        turn = math.radians(endHeading) - startHeading
+
+        path = []
+        for tick in range(int(round((duration + PATH_HOLD_TIME) / ROBOT_PERIOD)) + 1):
+            progress = min(tick * ROBOT_PERIOD / duration, 1.0)
+            state = trajectory.sample(progress * duration)
+            speed = state.velocity if progress < 1.0 else 0.0
+            direction = state.pose.rotation()
+
+            # The robot turns from the start to the end heading along the path, smoothly starting and stopping
+            heading = startHeading + turn * progress * progress * (3.0 - 2.0 * progress)
+            angularVelocity = turn * 6.0 * progress * (1.0 - progress) / duration
+            path.append((state.pose.X(), state.pose.Y(), speed * direction.cos(), speed * direction.sin(), heading, angularVelocity))
+        paths.append(tuple(path))
+    return tuple(paths)
+
+class RobotModel:
+    '''
+    # RobotModel
+    Model of a swerve module (NEO drive and turn motors, each behind a SPARK MAX) and of the chassis following a path,
+    scoring a set of gains for each loop ('driveCost()', 'turnCost()' and 'chassisCost()', lower is better)
+
+    Built from the constants in the main process and copied to every worker, so it only holds plain values
+    '''
+    def __init__(self, config):
+        from wpimath.system.plant import DCMotor
+        neo = DCMotor.NEO(1)
+        constants = config.moduleConstants
+        settings = config.autotune
+
+        self.resistance = neo.R # Ohms
+        self.Kv = neo.Kv # Radians/second per volt
+        self.Kt = neo.Kt # Newton meters per amp
+        self.batteryVoltage = settings.batteryVoltage
+
+        # Drive motor: a quarter of the robot, seen through the gearing and the wheel
+        self.driveRatio = constants.wheelRadius * constants.driveGearRatio # Meters of wheel travel per motor radian
+        self.driveInertia = settings.robotMass / 4.0 * self.driveRatio ** 2
+        self.driveCurrentLimit = constants.driveCurrentLimit
+        self.drivePositionFactor = constants.drivePositionFactor
+        self.driveFreeSpeed = self.Kv * self.batteryVoltage * self.driveRatio # Meters/second
+
+        # Turn motor: the module turning around its steering axis
+        self.turnRatio = constants.turnGearRatio # Module radians per motor radian
+        self.turnInertia = settings.turnMomentOfInertia * self.turnRatio ** 2
+        self.turnCurrentLimit = constants.turnCurrentLimit
+        self.turnPositionFactor = constants.turnPositionFactor
+
+        # Chassis: the wheel speeds follow the commanded ones with the lag of the drive loop (see 'driveLag()'), limited
+        # by the traction the current limit gives, and lose 'speedError' of it to slip and scrub
+        self.maxAcceleration = 4.0 * self.Kt * self.driveCurrentLimit / self.driveRatio / settings.robotMass
+        self.maxSpeed = min(config.pathplanner.maxSpeed, self.driveFreeSpeed)
+        self.driveBaseRadius = config.pathplanner.driveBaseRadius
+        self.maxAngularVelocity = self.maxSpeed / self.driveBaseRadius
+        self.speedError = settings.speedError
+        self.driveTimeConstant = 0.1 # Seconds, replaced by the lag of the drive gains before the chassis is tuned
+
+        # Paths are driven a little slower than the robot can go, leaving room for the controllers to catch up
+        self.paths = referencePaths(self.maxSpeed * 0.8, min(config.pathfinder.maxAcceleration, self.maxAcceleration * 0.8))
+
+    def motorStep(self, velocity: float, voltage: float, inertia: float, currentLimit: float):
+        '''
+        Advances a NEO (with 'inertia' seen from the motor) by one SPARK MAX period. Returns its new velocity (radians/second)
+        '''
+        current = (voltage - velocity / self.Kv) / self.resistance
+        if current > currentLimit:
+            return velocity + self.Kt * currentLimit / inertia * SPARK_MAX_PERIOD
+        if current < -currentLimit:
+            return velocity - self.Kt * currentLimit / inertia * SPARK_MAX_PERIOD
+
+        # Back EMF is integrated implicitly, the turn motor's time constant is only about twice the period
+        gain = self.Kt / (self.resistance * inertia) * SPARK_MAX_PERIOD
+        return (velocity + gain * voltage) / (1.0 + gain / self.Kv)
+
+    def driveCost(self, gains: tuple, trace: list = None):
+        '''
+        Scores the drive velocity loop (P, I, D, FF) on steps of the velocity reference. The SPARK MAX sees the velocity
+        of the NEO's encoder, converted to meters/second. The wheel speed of every period is added to 'trace' if given
+        '''
+        P, I, D, FF = gains
+        countsPerRadian = NEO_COUNTS_PER_ROTATION / (2.0 * math.pi)
+        velocityScale = self.drivePositionFactor / NEO_COUNTS_PER_ROTATION / (NEO_VELOCITY_WINDOW * SPARK_MAX_PERIOD) # Counts over the window -> meters/second
+        window = [0] * NEO_VELOCITY_WINDOW # Encoder counts of the last periods
+        ticks = int(round(DRIVE_STEP_TIME / SPARK_MAX_PERIOD))
+
+        velocity = position = 0.0 # Motor radians/second, radians
+        accumulator = lastError = lastOutput = chatter = 0.0
+        reference = 0.0
+        cost = 0.0
+        index = 0
+        for step in DRIVE_STEPS:
+            target = step * self.driveFreeSpeed
+            change = abs(target - reference)
+            direction = 1.0 if target >= reference else -1.0
+            reference = target
+            error = overshoot = 0.0
+
+            for _ in range(ticks):
+                counts = math.floor(position * countsPerRadian)
+                measured = (counts - window[index % NEO_VELOCITY_WINDOW]) * velocityScale
+                window[index % NEO_VELOCITY_WINDOW] = counts
+                index += 1
+
+                # The SPARK MAX's PID: gains are per period, not per second
+                loopError = reference - measured
+                accumulator += loopError
+                output = P * loopError + I * accumulator + D * (loopError - lastError) + FF * reference
+                output = max(-1.0, min(1.0, output))
+                lastError = loopError
+                chatter += abs(output - lastOutput)
+                lastOutput = output
+
+                velocity = self.motorStep(velocity, output * self.batteryVoltage, self.driveInertia, self.driveCurrentLimit)
+                position += velocity * SPARK_MAX_PERIOD
+
+                speed = velocity * self.driveRatio
+                error += abs(reference - speed)
+                overshoot = max(overshoot, (speed - reference) * direction)
+                if trace is not None:
+                    trace.append(speed)
+
+            if change > 0.0:
+                cost += error / (change * ticks) + 2.0 * overshoot / change
+
+        cost = cost / len(DRIVE_STEPS) + CHATTER_WEIGHT * chatter / index
+        return cost if math.isfinite(cost) else UNSTABLE_COST
+
+    def driveLag(self, gains: tuple):
+        '''
+        Time constant (seconds) of the wheel speed following a step of the velocity reference with the given drive gains
+        '''
+        trace = []
+        self.driveCost(gains, trace)
+        target = DRIVE_STEPS[0] * self.driveFreeSpeed
+        for index, speed in enumerate(trace[:int(round(DRIVE_STEP_TIME / SPARK_MAX_PERIOD))]):
+            if speed >= target * (1.0 - math.exp(-1.0)):
+                return max(index, 1) * SPARK_MAX_PERIOD
+        return DRIVE_STEP_TIME # Never got there
+
+    def turnCost(self, gains: tuple):
+        '''
+        Scores the turn position loop (P, I, D, FF) on steps of the module angle
+
+        Like 'SwerveModule.applySetpoint()', the reference is in degrees and the turn encoder is set to the absolute
+        encoder angle (degrees) every robot tick. Between ticks it counts in the units of its conversion factor
+        '''
+        P, I, D, FF = gains
+        countsPerRadian = NEO_COUNTS_PER_ROTATION / (2.0 * math.pi)
+        countScale = self.turnPositionFactor / NEO_COUNTS_PER_ROTATION # Counts -> encoder units
+        ticks = int(round(TURN_STEP_TIME / SPARK_MAX_PERIOD))
+        resetTicks = int(round(ROBOT_PERIOD / SPARK_MAX_PERIOD))
+
+        velocity = position = 0.0 # Motor radians/second, radians
+        encoder = 0.0 # Encoder position at the last reset
+        resetCounts = 0
+        accumulator = lastError = lastOutput = chatter = 0.0
+        reference = 0.0
+        cost = 0.0
+        index = 0
+        for target in TURN_STEPS:
+            change = abs(target - reference)
+            direction = 1.0 if target >= reference else -1.0
+            reference = target
+            error = overshoot = 0.0
+
+            for _ in range(ticks):
+                counts = math.floor(position * countsPerRadian)
+                angle = math.degrees(position * self.turnRatio)
+                if index % resetTicks == 0:
+                    encoder = angle
+                    resetCounts = counts
+                index += 1
+
+                loopError = reference - (encoder + (counts - resetCounts) * countScale)
+                accumulator += loopError
+                output = P * loopError + I * accumulator + D * (loopError - lastError) + FF * reference
+                output = max(-1.0, min(1.0, output))
+                lastError = loopError
+                chatter += abs(output - lastOutput)
+                lastOutput = output
+
+                velocity = self.motorStep(velocity, output * self.batteryVoltage, self.turnInertia, self.turnCurrentLimit)
+                position += velocity * SPARK_MAX_PERIOD
+
+                error += abs(reference - angle)
+                overshoot = max(overshoot, (angle - reference) * direction)
+
+            cost += error / (change * ticks) + 2.0 * overshoot / change
+
+        cost = cost / len(TURN_STEPS) + CHATTER_WEIGHT * chatter / index
+        return cost if math.isfinite(cost) else UNSTABLE_COST
+
+    def chassisCost(self, gains: tuple):
+        '''
+        Scores PathPlanner's translation (P, I, D) and rotation (P, I, D) controllers on the reference paths
+        '''
+        return sum(self.followPath(path, gains) for path in self.paths) / len(self.paths)
+
+    def followPath(self, path: tuple, gains: tuple):
+        '''
+        Follows one reference path the way PathPlanner's holonomic controller does (speed of the path plus a PID on the
+        pose error, from a fresh controller). Returns the RMS and final pose errors, with headings weighted by the
+        drive base radius
+        '''
+        translationP, translationI, translationD, rotationP, rotationI, rotationD = gains
+        dt = ROBOT_PERIOD / CHASSIS_SUBSTEPS
+        lag = 1.0 - math.exp(-dt / self.driveTimeConstant)
+        maxChange = self.maxAcceleration * dt
+        scale = 1.0 - self.speedError
+
+        x, y, heading = START_ERROR
+        vx = vy = omega = 0.0
+        integralX = integralY = integralHeading = 0.0
+        lastX = lastY = lastHeading = 0.0 # wpimath's PIDController starts from no previous error
+        lastCommand = (0.0, 0.0, 0.0)
+        squaredError = squaredHeadingError = chatter = 0.0
+
+        for targetX, targetY, targetVx, targetVy, targetHeading, targetOmega in path:
+            errorX = targetX - x
+            errorY = targetY - y
+            errorHeading = math.remainder(targetHeading - heading, 2.0 * math.pi) # Continuous input
+            if abs(errorX) + abs(errorY) > 5.0:
+                return UNSTABLE_COST
+            squaredError += errorX * errorX + errorY * errorY
+            squaredHeadingError += errorHeading * errorHeading
+
+            integralX += errorX * ROBOT_PERIOD
+            integralY += errorY * ROBOT_PERIOD
+            integralHeading += errorHeading * ROBOT_PERIOD
+            commandX = targetVx + translationP * errorX + translationI * integralX + translationD * (errorX - lastX) / ROBOT_PERIOD
+            commandY = targetVy + translationP * errorY + translationI * integralY + translationD * (errorY - lastY) / ROBOT_PERIOD
+            commandOmega = targetOmega + rotationP * errorHeading + rotationI * integralHeading + rotationD * (errorHeading - lastHeading) / ROBOT_PERIOD
+            lastX, lastY, lastHeading = errorX, errorY, errorHeading
+
+            # The drivetrain cannot go faster than its modules
+            speed = math.hypot(commandX, commandY)
+            if speed > self.maxSpeed:
+                commandX *= self.maxSpeed / speed
+                commandY *= self.maxSpeed / speed
+            commandOmega = max(-self.maxAngularVelocity, min(self.maxAngularVelocity, commandOmega))
+            chatter += abs(commandX - lastCommand[0]) + abs(commandY - lastCommand[1]) + abs(commandOmega - lastCommand[2]) * self.driveBaseRadius
+            lastCommand = (commandX, commandY, commandOmega)
+
+            for _ in range(CHASSIS_SUBSTEPS):
+                changeX = (commandX * scale - vx) * lag
+                changeY = (commandY * scale - vy) * lag
+                change = math.hypot(changeX, changeY)
+                if change > maxChange:
+                    changeX *= maxChange / change
+                    changeY *= maxChange / change
+                vx += changeX
+                vy += changeY
+                omega += (commandOmega * scale - omega) * lag
+
+                x += vx * dt
+                y += vy * dt
+                heading += omega * dt
+
+        ticks = len(path)
+        finalError = math.hypot(errorX, errorY) + abs(errorHeading) * self.driveBaseRadius
+        cost = math.sqrt(squaredError / ticks) + math.sqrt(squaredHeadingError / ticks) * self.driveBaseRadius + finalError + CHATTER_WEIGHT * chatter / ticks
+        return cost if math.isfinite(cost) else UNSTABLE_COST
+
+# Model of the worker process (see '_startWorker()')
+_model = None
+
+def _startWorker(model: RobotModel):
+    global _model
+    _model = model
+
+def _evaluate(task: tuple):
+    '''
+    Scores one candidate on a worker: 'task' is (loop name, gains)
+    '''
+    loop, gains = task
+    return getattr(_model, loop + 'Cost')(gains)
+
+class SearchResult:
+    '''
+    # SearchResult
+    Best gains found for one loop, next to the gains from the constants
+    '''
+    def __init__(self, loop: str, currentGains: tuple, currentCost: float, gains: tuple, cost: float, evaluations: int, seconds: float):
+        self.loop = loop
+        self.currentGains = currentGains
+        self.currentCost = currentCost
+        self.gains = gains
+        self.cost = cost
+        self.evaluations = evaluations
+        self.seconds = seconds
+
+    def report(self):
+        successMsg(f'{self.loop}: cost {self.currentCost:.4g} -> {self.cost:.4g} ({self.evaluations} candidates in {self.seconds:.1f} s)')
+        for name, current, gain in zip(LOOPS[self.loop]['names'], self.currentGains, self.gains):
+            debugMsg(f'  {name}: {current:.6g} -> {gain:.6g}')
+
+class GainSearch:
+    '''
+    # GainSearch
+    Cross-entropy search of the gains of one loop: every generation is sampled around the best candidates of the last
+    one and scored in parallel. Gains are searched in log space (they span several orders of magnitude), and a gain that
+    can be turned off gets one more decade at the bottom of its range that maps to 0
+
+    The gains from the constants are scored first, so the result is never worse than them
+    '''
+    ELITE_FRACTION = 0.25
+    MIN_SPREAD = 0.02 # Decades
+    SMOOTHING = 0.7 # Weight of the new generation in the distribution
+
+    def __init__(self, loop: str, currentGains: tuple):
+        self.loop = loop
+        self.bounds = LOOPS[loop]['bounds']
+        self.currentGains = tuple(currentGains)
+
+        # Distribution (center, spread) of each searched gain, in log10
+        self.centers = []
+        self.spreads = []
+        for bound, gain in zip(self.bounds, self.currentGains):
+            if bound is None:
+                self.centers.append(None)
+                self.spreads.append(None)
+                continue
+            low, high, canBeOff = bound
+            lowest = self.lowest(bound)
+            self.centers.append(math.log10(min(gain, high)) if gain >= low else (lowest + math.log10(low)) / 2.0)
+            self.spreads.append((math.log10(high) - lowest) / 4.0)
+
+    @staticmethod
+    def lowest(bound: tuple):
+        low, high, canBeOff = bound
+        return math.log10(low) - (1.0 if canBeOff else 0.0)
+
+    def sample(self, rng: random.Random):
+        gains = []
+        for bound, gain, center, spread in zip(self.bounds, self.currentGains, self.centers, self.spreads):
+            if bound is None:
+                gains.append(gain)
+                continue
+            value = min(max(rng.gauss(center, spread), self.lowest(bound)), math.log10(bound[1]))
+            gains.append(0.0 if value < math.log10(bound[0]) else 10.0 ** value)
+        return tuple(gains)
+
+    def fit(self, elites: list):
+        '''
+        Moves the distribution towards the best candidates of a generation
+        '''
+        for index, bound in enumerate(self.bounds):
+            if bound is None:
+                continue
+            values = [math.log10(gains[index]) if gains[index] > 0.0 else self.lowest(bound) for gains in elites]
+            center = sum(values) / len(values)
+            spread = math.sqrt(sum((value - center) ** 2 for value in values) / len(values))
+            self.centers[index] = self.SMOOTHING * center + (1.0 - self.SMOOTHING) * self.centers[index]
+            self.spreads[index] = max(self.SMOOTHING * spread + (1.0 - self.SMOOTHING) * self.spreads[index], self.MIN_SPREAD)
+
+    def run(self, pool: ProcessPoolExecutor, population: int, generations: int, rng: random.Random, workers: int = 1):
+        '''
+        Runs the search on 'pool' (which must have been started with '_startWorker()'). Returns a 'SearchResult'
+        '''
+        start = time.perf_counter()
+        chunkSize = max(1, population // (workers * 4))
+        candidates = [self.currentGains] + [self.sample(rng) for _ in range(population - 1)]
+        currentCost = None
+        best = (math.inf, self.currentGains)
+        evaluations = 0
+
+        for generation in range(generations):
+            if generation:
+                candidates = [self.sample(rng) for _ in range(population)]
+            costs = list(pool.map(_evaluate, [(self.loop, gains) for gains in candidates], chunksize=chunkSize))
+            evaluations += len(candidates)
+            if currentCost is None:
+                currentCost = costs[0]
+
+            ranked = sorted(zip(costs, candidates), key=lambda candidate: candidate[0])
+            if ranked[0][0] < best[0]:
+                best = ranked[0]
+            self.fit([gains for _, gains in ranked[:max(2, int(population * self.ELITE_FRACTION))]])
+
+        return SearchResult(self.loop, self.currentGains, currentCost, best[1], best[0], evaluations, time.perf_counter() - start)
+
+def writeProposal(config, results: list, path: str):
+    '''
+    Writes a copy of the constants with the gains of every result, and checks that it loads
+    '''
+    from config import robotconfig
+
+    with open(config.path) as jsonf:
+        data = json.load(jsonf)
+
+    for result in results:
+        gains = iter(result.gains)
+        for section, key, length in LOOPS[result.loop]['keys']:
+            data[section][key] = [float(f'{next(gains):.6g}') for _ in range(length)]
+            data[section]['//' + key] = f'Proposed by extras/autotune.py (model cost {result.currentCost:.4g} -> {result.cost:.4g})'
+
+    with open(path, 'w') as jsonf:
+        json.dump(data, jsonf, indent='\t')
+        jsonf.write('\n')
+
+    robotconfig.load(path) # Raises a 'ConfigError' if something went wrong
+
+def main(arguments: list):
+    loops = arguments or list(LOOPS)
+    if any(loop not in LOOPS for loop in loops):
+        print(f'Usage: python -m extras.autotune [{"] [".join(LOOPS)}]')
+        return 1
+
+    robotDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, robotDirectory)
+    from config import robotconfig
+
+    config = robotconfig.get()
+    settings = config.autotune
+    workers = settings.workers or os.cpu_count() or 1
+    model = RobotModel(config)
+    rng = random.Random(SEED)
+
+    currentGains = {
+        'drive': config.moduleConstants.drivePID,
+        'turn': config.moduleConstants.turnPID,
+        'chassis': config.pathplanner.translationPID + config.pathplanner.rotationPID
+    }
+
+    start = time.perf_counter()
+    results = []
+    for loop in LOOPS: # The drive loop goes first, the chassis follows the wheel speeds through it
+        if loop not in loops:
+            continue
+
+        if loop == 'chassis':
+            driveGains = next((result.gains for result in results if result.loop == 'drive'), currentGains['drive'])
+            model.driveTimeConstant = model.driveLag(driveGains)
+            debugMsg(f'Wheel speeds follow the drive references with a {model.driveTimeConstant * 1000.0:.0f} ms time constant')
+
+        search = GainSearch(loop, currentGains[loop])
+        with ProcessPoolExecutor(max_workers=workers, initializer=_startWorker, initargs=(model,)) as pool:
+            result = search.run(pool, settings.population, settings.generations, rng, workers)
+        result.report()
+        results.append(result)
+
+    path = os.path.join(os.path.dirname(config.path), PROPOSAL_FILE)
+    writeProposal(config, results, path)
+    successMsg(f"Wrote the proposed gains to '{path}' ({time.perf_counter() - start:.0f} s on {workers} workers). Review them on the robot before copying them to 'constants.json'")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,42 +1,41 @@
+from extras.logger import logger, DEBUG, INFO, WARNING, ERROR
+
 scriptFile = None
 def init(file):
     global scriptFile
     scriptFile = file
 
-# Functions for different output messages (they are colorfull so they are easy to spot)
+# Functions for different output messages. They go through 'extras.logger', which records them in the log file
+# and prints them from its writer thread, so calling them never waits on the console
 def debugMsg(message: str):
     '''
-    Print message with different formatting based on operating system
+    Logs a debug message
     '''
-    print('DEBUG: ' + str(message))
+    logger.log(DEBUG, str(message))
 
 def successMsg(message: str):
     '''
-    Print message with different formatting based on operating system
+    Logs a success message
+    '''
+    logger.log(INFO, str(message))
+
+def warningMsg(message: str):
+    '''
+    Logs a warning (something is wrong, but the robot can keep running)
     '''
-    print('SUCCESS: ' + str(message))
+    logger.log(WARNING, str(message))
 
 def errorMsg(message: str, error: Exception, optionalScriptFile=None):
     '''
-    Print message with different formatting based on operating system
-    '''
-    if optionalScriptFile != None:
-        try:
-            raise Exception('ERROR: ' 
-                + str(message) + '\n\n\t' 
-                + f'{optionalScriptFile}' + '\n\t> '+ 
-                str(error) + f' -> [Line: {error.__traceback__.tb_lineno}]')
-        except:
-            raise Exception('ERROR: ' 
-                + str(message)
-            ) # Print bare minimum error
+    Logs an error and raises it as an Exception (with the script file and line number of the original error if known)
+    '''
+    file = optionalScriptFile if optionalScriptFile != None else scriptFile
+    traceback = getattr(error, '__traceback__', None)
+
+    if traceback is not None:
+        text = str(message) + '\n\n\t' + f'{file}' + '\n\t> ' + str(error) + f' -> [Line: {traceback.tb_lineno}]'
     else:
-        try:
-            raise Exception('ERROR: ' 
-                + str(message) + '\n\n\t' 
-                + f'{scriptFile}' + '\n\t> '+ 
-                str(error) + f' -> [Line: {error.__traceback__.tb_lineno}]')
-        except:
-            raise Exception('ERROR: ' 
-                + str(message)
-            ) # Print bare minimum error
\ No newline at end of file
+        text = str(message) # Bare minimum error
+
+    logger.log(ERROR, text)
+    raise Exception('ERROR: ' + text)
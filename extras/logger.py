@@ -0,0 +1,347 @@
+# Structured logging without console or file I/O on the robot loop (see 'LOGGING_CONSTANTS' in 'constants.json')
+# Records are packed into a preallocated ring buffer and written to a WPILog file (readable by AdvantageScope) by a background thread
+from collections import deque
+import shutil
+import struct
+import threading
+import time
+import os
+
+# Severity levels of text messages
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'SUCCESS', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()} # 'LEVEL' in 'constants.json' -> level
+LEVELS['INFO'] = INFO
+
+# WPILog record header: 2 byte entry id, 2 byte payload size, 8 byte timestamp (microseconds)
+# Bit field of the first byte: (entry id length - 1) | (payload size length - 1) << 2 | (timestamp length - 1) << 4
+RECORD_HEADER_BITS = 1 | (1 << 2) | (7 << 4)
+RECORD_HEADER = struct.Struct('<BHHQ')
+MAX_PAYLOAD = 0xFFFF
+
+class LogChannel:
+    '''
+    # LogChannel
+    A WPILog entry with a fixed record layout, precompiled so 'append()' is a single 'pack_into' into the ring buffer
+
+    Get channels from 'logger.doubleChannel()'/'logger.doubleArrayChannel()' once and keep them
+    '''
+    __slots__ = ('logger', 'entryId', 'name', 'type', 'record', 'size')
+
+    def __init__(self, logger, entryId: int, name: str, type: str, record: struct.Struct):
+        self.logger = logger
+        self.entryId = entryId
+        self.name = name
+        self.type = type
+        self.record = record # Header + payload, None for variable size payloads
+        self.size = record.size if record is not None else 0
+
+    def append(self, *values: float, timestamp: float = None):
+        '''
+        Records the values (one for 'double', the declared count for 'double[]') at 'timestamp' (seconds, defaults to now)
+        '''
+        logger = self.logger
+        if not logger.running:
+            return
+
+        if timestamp is None:
+            timestamp = logger.clock()
+
+        with logger.lock:
+            offset = logger._reserve(self.size)
+            if offset < 0:
+                logger.dropped += 1
+                return
+            self.record.pack_into(logger.buffer, offset, RECORD_HEADER_BITS, self.entryId, self.size - RECORD_HEADER.size, int(timestamp * 1e6), *values)
+            logger._write = offset + self.size
+
+class Logger:
+    '''
+    # Logger
+    Ring-buffered WPILog writer with severity levels and per-message rate limiting
+
+    The robot loop only packs bytes into a preallocated buffer. A background thread writes the buffer to the log file
+    and prints messages to the console. If the buffer fills up (the disk is too slow), new records are dropped and counted
+
+    Like WPILib's DataLogManager, the oldest logs in the directory are deleted when a file is started and the disk has
+    less than 'minFreeSpace' bytes free (or there are more than 'maxFiles' logs). If that is not enough, nothing more is
+    written to disk. A file is closed and a new one started once it reaches 'maxFileSize' bytes (0 for no limit)
+
+    Until 'start()' is called messages are printed directly and numeric channels are ignored
+    '''
+    def __init__(self):
+        self.running = False
+        self.clock = time.monotonic # Seconds, replaced by the robot clock in 'start()'
+        self.level = DEBUG # Lowest level printed to the console
+        self.rateLimit = 1.0 # Seconds between two copies of the same message
+        self.console = True
+        self.path = None
+        self.directory = None
+        self.maxFileSize = 0
+        self.minFreeSpace = 0
+        self.maxFiles = 0
+        self.files = 0 # Files started so far
+
+        self.channels = []
+        self.lock = threading.Lock() # Held only while reserving/packing a record or moving the read position
+        self.buffer = bytearray(0)
+        self.dropped = 0 # Records that did not fit in the buffer
+
+        self._read = 0 # Oldest unwritten byte
+        self._write = 0 # Next free byte
+        self._wrap = -1 # End of the data before the write position wrapped back to 0 (-1 if it has not wrapped)
+
+        self._messages = deque(maxlen=256) # Texts waiting to be printed, the oldest are dropped if the thread falls behind
+        self._lastMessages = {} # Message -> [time it was last emitted, copies suppressed since then]
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+
+        self.messageChannel = self._register('messages', 'string', None)
+
+    def start(self, directory: str, bufferSize: int = 1 << 20, flushPeriod: float = 0.1, rateLimit: float = 1.0,
+              level: int = INFO, console: bool = True, clock=None, maxFileSize: int = 0, minFreeSpace: int = 0, maxFiles: int = 0):
+        '''
+        Opens a new log file in 'directory' and starts the writer thread
+
+        'clock' returns the robot time in seconds (FPGA time on the robot), so log timestamps match sensor timestamps
+        '''
+        if self.running:
+            return
+
+        self.directory = directory
+        self.maxFileSize = maxFileSize
+        self.minFreeSpace = minFreeSpace
+        self.maxFiles = maxFiles
+        self.flushPeriod = flushPeriod
+        self.rateLimit = rateLimit
+        self.level = level
+        self.console = console
+        if clock is not None:
+            self.clock = clock
+
+        os.makedirs(directory, exist_ok=True)
+        self._file = self._startFile()
+        if self._file is None:
+            return
+
+        self.buffer = bytearray(bufferSize)
+        self._read = self._write = 0
+        self._wrap = -1
+
+        self._stop.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='LogWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Writes everything still in the buffer and closes the log file
+        '''
+        if not self.running:
+            return
+        self.running = False
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(2.0)
+
+    def flush(self):
+        '''
+        Asks the writer thread to write the buffer now (does not wait for it)
+        '''
+        self._wake.set()
+
+    def doubleChannel(self, name: str):
+        return self._register(name, 'double', struct.Struct('<BHHQd'))
+
+    def doubleArrayChannel(self, name: str, length: int):
+        return self._register(name, 'double[]', struct.Struct(f'<BHHQ{length}d'))
+
+    def _register(self, name: str, type: str, record: struct.Struct):
+        for channel in self.channels:
+            if channel.name == name:
+                if channel.type != type or (channel.record is not None and channel.record.size != record.size):
+                    raise ValueError(f"Log channel '{name}' already exists with a different type")
+                return channel
+
+        channel = LogChannel(self, len(self.channels) + 1, name, type, record) # Entry 0 is reserved for control records
+        self.channels.append(channel)
+        if self.running:
+            self._appendBytes(self._startRecord(channel))
+        return channel
+
+    def _startFile(self):
+        '''
+        Deletes old logs if needed, then opens a new file with the header and a start record for every channel.
+        Returns None if the disk is still too full
+        '''
+        if not self._prune():
+            print(f'ERROR: Less than {self.minFreeSpace / 1e6:.0f} MB free in \'{self.directory}\', not writing a log file')
+            return None
+
+        self.files += 1
+        self.path = os.path.join(self.directory, time.strftime('robot_%Y%m%d_%H%M%S') + f'_{self.files:03d}.wpilog')
+        file = open(self.path, 'wb', buffering=0)
+        extraHeader = b'robotpy'
+        file.write(b'WPILOG' + struct.pack('<HI', 0x0100, len(extraHeader)) + extraHeader)
+        file.write(b''.join(self._startRecord(channel) for channel in self.channels))
+        return file
+
+    def _prune(self):
+        '''
+        Deletes the oldest '.wpilog' files of the directory until there is 'minFreeSpace' free and room for one more
+        file within 'maxFiles'. Returns False if there is still not enough free space
+        '''
+        if not self.minFreeSpace and not self.maxFiles:
+            return True
+
+        logs = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.wpilog') and entry.is_file():
+                logs.append((entry.stat().st_mtime, entry.path))
+        logs.sort() # Oldest first
+
+        files = len(logs) + 1
+        for _, path in logs:
+            if (not self.maxFiles or files <= self.maxFiles) and shutil.disk_usage(self.directory).free >= self.minFreeSpace:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"WARNING: Could not delete old log '{path}': {e}")
+                continue
+            print(f"DEBUG: Deleted old log '{path}'")
+            files -= 1
+
+        return shutil.disk_usage(self.directory).free >= self.minFreeSpace
+
+    def _startRecord(self, channel: LogChannel):
+        name = channel.name.encode()
+        type = channel.type.encode()
+        payload = struct.pack(f'<BII{len(name)}sI{len(type)}sI', 0, channel.entryId, len(name), name, len(type), type, 0)
+        return RECORD_HEADER.pack(RECORD_HEADER_BITS, 0, len(payload), int(self.clock() * 1e6)) + payload
+
+    def log(self, level: int, message: str):
+        '''
+        Records a text message and prints it (from the writer thread) if its level is high enough
+
+        The same message is emitted at most once per 'rateLimit' seconds; the number of suppressed copies is added to the next one
+        '''
+        now = self.clock()
+        last = self._lastMessages.get(message)
+        if last is not None and now - last[0] < self.rateLimit:
+            last[1] += 1
+            return
+
+        text = f'{LEVEL_NAMES.get(level, level)}: {message}'
+        if last is not None and last[1]:
+            text += f' (repeated {last[1]} more times)'
+
+        if len(self._lastMessages) >= 1024:
+            self._lastMessages.clear() # Bound the memory used by messages with changing text
+        self._lastMessages[message] = [now, 0]
+
+        if not self.running:
+            if level >= self.level:
+                print(text)
+            return
+
+        if level >= self.level:
+            self._messages.append(text)
+
+        payload = text.encode()[:MAX_PAYLOAD]
+        self._appendBytes(RECORD_HEADER.pack(RECORD_HEADER_BITS, self.messageChannel.entryId, len(payload), int(now * 1e6)) + payload)
+
+        if level >= ERROR:
+            self._wake.set() # Errors often come right before a crash, write them out now
+
+    def _appendBytes(self, data: bytes):
+        with self.lock:
+            offset = self._reserve(len(data))
+            if offset < 0:
+                self.dropped += 1
+                return
+            self.buffer[offset:offset + len(data)] = data
+            self._write = offset + len(data)
+
+    def _reserve(self, size: int):
+        '''
+        Returns where a record of 'size' bytes can be written (-1 if the buffer is full). Call with 'lock' held
+
+        Records are never split: if one does not fit before the end of the buffer, writing wraps back to the start
+        '''
+        read = self._read
+        write = self._write
+
+        if self._wrap < 0: # Data is in [read, write)
+            if len(self.buffer) - write >= size:
+                return write
+            if read > size: # Keep at least one free byte so 'read == write' always means empty
+                self._wrap = write
+                return 0
+            return -1
+
+        # Data is in [read, wrap) and [0, write)
+        return write if read - write > size else -1
+
+    def _run(self):
+        file = self._file
+        try:
+            while True:
+                self._wake.wait(self.flushPeriod)
+                self._wake.clear()
+                stopping = self._stop.is_set() # Checked before writing, so everything recorded before 'stop()' is written
+
+                self._writeBuffer(file)
+
+                while self._messages:
+                    text = self._messages.popleft()
+                    if self.console:
+                        print(text)
+
+                if self.dropped:
+                    with self.lock:
+                        dropped, self.dropped = self.dropped, 0
+                    print(f'WARNING: Log buffer full, dropped {dropped} records')
+
+                if stopping:
+                    break
+
+                if self.maxFileSize and file.tell() >= self.maxFileSize:
+                    file.close()
+                    file = self._file = self._startFile()
+                    if file is None: # Disk full: messages are printed directly from now on, nothing else is written
+                        self.running = False
+                        break
+        except OSError as e:
+            self.running = False
+            print(f'ERROR: Log writer stopped: {e}')
+        finally:
+            if file is not None:
+                file.close()
+
+    def _writeBuffer(self, file):
+        with self.lock:
+            read, write, wrap = self._read, self._write, self._wrap
+
+        view = memoryview(self.buffer)
+        if wrap >= 0:
+            file.write(view[read:wrap])
+            read = 0
+            with self.lock:
+                self._read = 0
+                self._wrap = -1
+
+        if write > read:
+            file.write(view[read:write])
+            with self.lock:
+                self._read = write
+        view.release()
+
+# Shared logger used by 'extras.debugmsgs' and the robot components (prints directly until 'start()' is called)
+logger = Logger()
@@ -0,0 +1,233 @@
+# Opt-in timing of the periodic loop and its stages (see 'DIAGNOSTICS_CONSTANTS' in 'constants.json')
+from array import array
+from time import perf_counter_ns
+import functools
+
+from extras.debugmsgs import *
+
+class RingBuffer:
+    '''
+    # RingBuffer
+    Fixed-size, array-backed buffer of integer samples (nanoseconds). The oldest sample is overwritten when full
+    '''
+    __slots__ = ('samples', 'size', 'index', 'count')
+
+    def __init__(self, size: int):
+        self.samples = array('q', bytes(8 * size))
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value: int):
+        self.samples[self.index] = value
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+        if self.count < self.size:
+            self.count += 1
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+    def percentiles(self, *fractions: float):
+        '''
+        Returns the requested percentiles (0.0 - 1.0) of the samples in the buffer. Sorts a copy, so do not call this every tick
+        '''
+        if self.count == 0:
+            return tuple(0 for _ in fractions)
+        ordered = sorted(self.samples[:self.count])
+        return tuple(ordered[min(self.count - 1, int(fraction * self.count))] for fraction in fractions)
+
+class ProfilerStage:
+    '''
+    # ProfilerStage
+    Timing statistics of a single named stage. Can be used as a context manager ('with stage:')
+    '''
+    __slots__ = ('profiler', 'name', 'window', 'calls', 'maxNs', 'startNs', 'childNs', 'loopSelfNs', 'touched')
+
+    def __init__(self, profiler, name: str, windowSize: int):
+        self.profiler = profiler
+        self.name = name
+        self.window = RingBuffer(windowSize)
+        self.calls = 0
+        self.maxNs = 0
+        self.startNs = 0
+        self.childNs = 0 # Time spent in stages nested inside this one (current call)
+        self.loopSelfNs = 0 # Time spent in this stage minus nested stages (current loop)
+        self.touched = False # Entered during the current loop
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler._enter(self)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.profiler.enabled:
+            self.profiler._exit(self)
+        return False
+
+    def record(self, elapsedNs: int):
+        self.window.append(elapsedNs)
+        self.calls += 1
+        if elapsedNs > self.maxNs:
+            self.maxNs = elapsedNs
+
+    def reset(self, windowSize: int = None):
+        if windowSize is not None and windowSize != self.window.size:
+            self.window = RingBuffer(windowSize)
+        self.window.clear()
+        self.calls = 0
+        self.maxNs = 0
+        self.loopSelfNs = 0
+        self.touched = False
+
+class LoopProfiler:
+    '''
+    # LoopProfiler
+    Times each periodic phase and named sub-stage with 'perf_counter_ns' and detects loop overruns
+
+    A loop starts when the first stage is entered and ends with 'endLoop()' (called after 'robotPeriodic').
+    Overruns are blamed on the stage with the most exclusive time (its time minus nested stages) in that loop
+    '''
+    def __init__(self, enabled: bool = False, windowSize: int = 1024, overrunHistory: int = 64, budgetSeconds: float = 0.02):
+        self.enabled = False
+        self.stages = {}
+        self.configure(enabled, windowSize, overrunHistory, budgetSeconds)
+
+    def configure(self, enabled: bool, windowSize: int, overrunHistory: int, budgetSeconds: float):
+        '''
+        Enables/disables the profiler and resizes its buffers. Clears every recorded sample
+        '''
+        self.enabled = enabled
+        self.windowSize = windowSize
+        self.budgetNs = int(budgetSeconds * 1e9)
+
+        for stage in self.stages.values():
+            stage.reset(windowSize) # Stages are kept because 'timed()' wrappers hold on to them
+
+        self.loop = ProfilerStage(self, 'loop', windowSize)
+        self._stack = [] # Stages currently being timed (outermost first)
+        self._touched = [] # Stages entered during the current loop
+        self._loopStartNs = 0
+
+        # Overrun history (fixed size, oldest entries are overwritten)
+        self.overruns = 0
+        self.overrunDurations = RingBuffer(overrunHistory)
+        self.overrunStages = [None] * overrunHistory
+
+    def stage(self, name: str):
+        '''
+        Returns the stage with the given name (created on first use). Look stages up once and keep them if they are used every tick
+        '''
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = ProfilerStage(self, name, self.windowSize)
+        return stage
+
+    def timed(self, name: str, endsLoop: bool = False):
+        '''
+        Decorator that times every call of a function as a stage
+
+        Use 'endsLoop=True' on the last method of the periodic loop ('robotPeriodic')
+        '''
+        stage = self.stage(name)
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                self._enter(stage)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._exit(stage)
+                    if endsLoop:
+                        self.endLoop()
+            return wrapper
+        return decorator
+
+    def _enter(self, stage: ProfilerStage):
+        if not self._stack and self._loopStartNs == 0:
+            self._loopStartNs = perf_counter_ns() # First stage of a new loop
+
+        if not stage.touched:
+            stage.touched = True
+            self._touched.append(stage)
+
+        stage.childNs = 0
+        self._stack.append(stage)
+        stage.startNs = perf_counter_ns()
+
+    def _exit(self, stage: ProfilerStage):
+        elapsedNs = perf_counter_ns() - stage.startNs
+        self._stack.pop()
+
+        if self._stack:
+            self._stack[-1].childNs += elapsedNs
+
+        stage.record(elapsedNs)
+        stage.loopSelfNs += elapsedNs - stage.childNs
+
+    def endLoop(self):
+        '''
+        Closes the current loop, recording its total time and checking it against the budget
+        '''
+        if not self.enabled or self._loopStartNs == 0:
+            return
+
+        elapsedNs = perf_counter_ns() - self._loopStartNs
+        self._loopStartNs = 0
+        self.loop.record(elapsedNs)
+
+        worst = None
+        for stage in self._touched:
+            if worst is None or stage.loopSelfNs > worst.loopSelfNs:
+                worst = stage
+
+        if elapsedNs > self.budgetNs:
+            self.overrunStages[self.overrunDurations.index] = worst.name if worst is not None else None
+            self.overrunDurations.append(elapsedNs)
+            self.overruns += 1
+
+        for stage in self._touched:
+            stage.loopSelfNs = 0
+            stage.touched = False
+        self._touched.clear()
+
+    def report(self, title: str = 'Loop timing'):
+        '''
+        Prints a summary of every stage (p50/p99/max in milliseconds) and the most recent overruns
+        '''
+        if not self.enabled:
+            return
+
+        debugMsg(f'{title}: {self.loop.calls} loops, {self.overruns} overruns (budget {self.budgetNs / 1e6:.1f} ms)')
+        for stage in (self.loop, *self.stages.values()):
+            if stage.calls == 0:
+                continue
+            p50, p99 = stage.window.percentiles(0.5, 0.99)
+            debugMsg(f'  {stage.name}: {stage.calls} calls, p50 {p50 / 1e6:.3f} ms, p99 {p99 / 1e6:.3f} ms, max {stage.maxNs / 1e6:.3f} ms')
+
+        overrunDurations = self.overrunDurations
+        for i in range(overrunDurations.count):
+            index = (overrunDurations.index - overrunDurations.count + i) % overrunDurations.size
+            debugMsg(f'  overrun: {overrunDurations.samples[index] / 1e6:.3f} ms in {self.overrunStages[index]}')
+
+    def reset(self):
+        '''
+        Clears every recorded sample while keeping the stages
+        '''
+        for stage in self.stages.values():
+            stage.reset()
+        self.loop.reset()
+        self._stack.clear()
+        self._touched.clear()
+        self._loopStartNs = 0
+        self.overruns = 0
+        self.overrunDurations.clear()
+
+# Shared profiler used by the robot and its components (disabled until 'configure()' is called)
+profiler = LoopProfiler()
@@ -0,0 +1,518 @@
+# Records the inputs and motor setpoints of every tick, and replays recordings off-robot to check code changes against real driving
+# Run a replay with 'python -m extras.replay <file.rprl>' (uses the simulated hardware backend)
+from array import array
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+from extras.debugmsgs import *
+
+FORMAT_VERSION = 2
+
+# File header: magic, format version, number of columns, length of the column names (utf-8, separated by newlines)
+FILE_HEADER = struct.Struct('<4sHHI')
+FILE_MAGIC = b'RPRL'
+
+# Every chunk starts with: magic, number of ticks. Then each column is stored as 'ticks' float64 values (column after column)
+CHUNK_HEADER = struct.Struct('<4sI')
+CHUNK_MAGIC = b'CHNK'
+
+# Value of the 'mode' column
+MODES = ('disabled', 'autonomous', 'teleop', 'test')
+
+# Controller values recorded for the main controller (the aux controller is only used for macros)
+AXES = ('leftX', 'leftY', 'leftTrigger', 'rightTrigger', 'rightX', 'rightY') # Raw axis 0 - 5 of an Xbox controller
+
+# Readings of each swerve module (copied from its 'SwerveModuleSnapshot')
+MODULE_INPUTS = ('absolutePosition', 'drivePosition', 'driveVelocity', 'turnPosition', 'turnVelocity')
+
+# Fused pose at the start of the tick. Replays of ticks recorded with the odometry thread start from it, since the
+# thread integrated readings between the ticks that are not in the recording
+POSE = ('poseX', 'poseY', 'poseHeading')
+
+# Motor references of each swerve module (what a replay is checked against)
+MODULE_OUTPUTS = ('driveReference', 'turnReference')
+
+def columnNames(moduleNames: tuple):
+    '''
+    Returns the names of every recorded column, in file order
+    '''
+    names = ['timestamp', 'mode', 'allianceStation', *AXES, 'buttons', 'auxButtons', 'gyroYaw', 'odometryFrequency', *POSE]
+    for name in moduleNames:
+        names.extend(f'{name}.{field}' for field in MODULE_INPUTS)
+    for name in moduleNames:
+        names.extend(f'{name}.{field}' for field in MODULE_OUTPUTS)
+    return names
+
+def allianceStation():
+    '''
+    Returns the driver station position as a number (0 unknown, 1 - 3 red, 4 - 6 blue, same as 'hal.AllianceStationID')
+    '''
+    import wpilib
+    alliance = wpilib.DriverStation.getAlliance()
+    if alliance is None:
+        return 0
+    location = wpilib.DriverStation.getLocation() or 1
+    return location if alliance == wpilib.DriverStation.Alliance.kRed else 3 + location
+
+def currentMode():
+    import wpilib
+    if wpilib.DriverStation.isDisabled():
+        return 0
+    if wpilib.DriverStation.isAutonomous():
+        return 1
+    if wpilib.DriverStation.isTest():
+        return 3
+    return 2
+
+class ReplayRecorder:
+    '''
+    # ReplayRecorder
+    Records one row of inputs and outputs per tick into preallocated column arrays
+
+    Call 'record()' at the end of 'robotPeriodic()'. Every 'chunkTicks' ticks the columns are handed to a background
+    thread that appends them to the file, so the robot loop never writes to disk. The file is only created once the
+    first chunk is written
+
+    With 'enabledOnly' nothing is recorded while the robot is disabled. A file is closed and a new one started once it
+    reaches 'maxFileSize' bytes, and whenever a file is started the oldest recordings in 'directory' are deleted until
+    at most 'maxFiles' files and 'maxTotalSize' bytes are left (0 for no limit)
+    '''
+    def __init__(self, robot, directory: str, chunkTicks: int = 500, enabledOnly: bool = True,
+                 maxFileSize: int = 0, maxTotalSize: int = 0, maxFiles: int = 0):
+        import wpilib
+        self.robot = robot
+        self.directory = directory
+        self.chunkTicks = chunkTicks
+        self.enabledOnly = enabledOnly
+        self.maxFileSize = maxFileSize
+        self.maxTotalSize = maxTotalSize
+        self.maxFiles = maxFiles
+        self.path = None # File being written (set by the writer thread)
+        self.files = 0 # Files started so far
+
+        self.modules = robot.drivetrain.modules
+        odometryThread = robot.drivetrain.odometryThread
+        self.odometryFrequency = round(1.0 / odometryThread.period) if odometryThread is not None else 0 # 0 for the robot loop
+        self.names = columnNames(tuple(module.name for module in self.modules))
+        self.columns = self._newColumns()
+        self.index = 0
+        self.ticks = 0
+
+        controllerPort = robot.controller.wpilibController.getPort()
+        auxPort = robot.auxController.wpilibController.getPort()
+        self.readButtons = lambda: wpilib.DriverStation.getStickButtons(controllerPort)
+        self.readAuxButtons = lambda: wpilib.DriverStation.getStickButtons(auxPort)
+        self.readAxes = tuple((lambda axis=axis: wpilib.DriverStation.getStickAxis(controllerPort, axis)) for axis in range(len(AXES)))
+
+        self._chunks = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='ReplayWriter', daemon=True)
+        self._thread.start()
+
+    def _newColumns(self):
+        return [array('d', bytes(8 * self.chunkTicks)) for _ in self.names]
+
+    def record(self):
+        '''
+        Adds the current tick (sensor snapshots, controller state, mode and the motor references set this tick)
+        '''
+        mode = currentMode()
+        if mode == 0 and self.enabledOnly:
+            self.flush() # Written as soon as the robot is disabled
+            return
+
+        drivetrain = self.robot.drivetrain
+        columns = self.columns
+        index = self.index
+
+        # Written straight into the columns, in the order of 'columnNames()'
+        columns[0][index] = drivetrain.hardware.getTimestamp()
+        columns[1][index] = mode
+        columns[2][index] = allianceStation()
+        column = 3
+        for readAxis in self.readAxes:
+            columns[column][index] = readAxis()
+            column += 1
+        columns[column][index] = self.readButtons()
+        columns[column + 1][index] = self.readAuxButtons()
+        columns[column + 2][index] = drivetrain.gyroYaw # The reading the drivetrain used, which may come from the odometry thread
+        columns[column + 3][index] = self.odometryFrequency
+        pose = drivetrain.tickPose
+        columns[column + 4][index] = pose.X()
+        columns[column + 5][index] = pose.Y()
+        columns[column + 6][index] = pose.rotation().radians()
+        column += 7
+
+        for module in self.modules:
+            snapshot = module.snapshot
+            columns[column][index] = snapshot.absolutePosition
+            columns[column + 1][index] = snapshot.drivePosition
+            columns[column + 2][index] = snapshot.driveVelocity
+            columns[column + 3][index] = snapshot.turnPosition
+            columns[column + 4][index] = snapshot.turnVelocity
+            column += len(MODULE_INPUTS)
+        for module in self.modules:
+            columns[column][index] = module.driveReference
+            columns[column + 1][index] = module.turnReference
+            column += len(MODULE_OUTPUTS)
+
+        self.index = index + 1
+        self.ticks += 1
+        if self.index == self.chunkTicks:
+            self.flush()
+
+    def flush(self):
+        '''
+        Hands the recorded ticks to the writer thread and starts a new chunk
+        '''
+        if self.index == 0:
+            return
+        self._chunks.put((self.index, self.columns))
+        self.columns = self._newColumns()
+        self.index = 0
+
+    def stop(self):
+        '''
+        Writes the last (partial) chunk and waits for the writer thread
+        '''
+        self.flush()
+        self._chunks.put(None)
+        self._thread.join(2.0)
+
+    def _run(self):
+        file = None
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    break
+
+                count, columns = chunk
+                chunkSize = CHUNK_HEADER.size + 8 * count * len(columns)
+                if file is not None and self.maxFileSize and file.tell() + chunkSize > self.maxFileSize:
+                    file.close()
+                    file = None
+                if file is None:
+                    file = self._startFile()
+
+                file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, count))
+                for column in columns:
+                    file.write(memoryview(column)[:count].cast('B'))
+                file.flush()
+        except OSError as e:
+            warningMsg(f'Replay recording stopped: {e}')
+        finally:
+            if file is not None:
+                file.close()
+
+    def _startFile(self):
+        '''
+        Deletes the oldest recordings past the limits, then opens a new file and writes its header
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        self.files += 1
+        self.path = os.path.join(self.directory, time.strftime('robot_%Y%m%d_%H%M%S') + f'_{self.files:03d}.rprl')
+        headerNames = '\n'.join(self.names).encode()
+        headerNames += b'\0' * (-(FILE_HEADER.size + len(headerNames)) % 8) # Keep the columns 8 byte aligned
+        self._prune(FILE_HEADER.size + len(headerNames))
+
+        file = open(self.path, 'wb')
+        file.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, len(self.names), len(headerNames)) + headerNames)
+        return file
+
+    def _prune(self, newSize: int):
+        '''
+        Deletes the oldest '.rprl' files of the directory until the new file fits within 'maxFiles' and 'maxTotalSize'
+        '''
+        if not self.maxFiles and not self.maxTotalSize:
+            return
+
+        recordings = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.rprl') and entry.is_file():
+                stat = entry.stat()
+                recordings.append((stat.st_mtime, entry.path, stat.st_size))
+        recordings.sort() # Oldest first
+
+        files = len(recordings) + 1
+        totalSize = sum(size for _, _, size in recordings) + newSize
+        for _, path, size in recordings:
+            if (not self.maxFiles or files <= self.maxFiles) and (not self.maxTotalSize or totalSize <= self.maxTotalSize):
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                warningMsg(f"Could not delete old replay recording '{path}': {e}")
+                continue
+            debugMsg(f"Deleted old replay recording '{path}'")
+            files -= 1
+            totalSize -= size
+
+class ReplayChunk:
+    '''
+    # ReplayChunk
+    Columns of consecutive ticks, as float64 memoryviews straight into the memory-mapped file (nothing is copied)
+    '''
+    __slots__ = ('count', 'columns')
+
+    def __init__(self, count: int, columns: dict):
+        self.count = count
+        self.columns = columns # Column name -> memoryview
+
+    def release(self):
+        for column in self.columns.values():
+            column.release()
+
+class ReplayFile:
+    '''
+    # ReplayFile
+    Reads a recording through a memory map, one chunk at a time, so files larger than the memory can be replayed
+
+    Use as a context manager and release (or drop) every chunk before the file is closed
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, formatVersion, columnCount, namesLength = FILE_HEADER.unpack_from(self._map)
+        if magic != FILE_MAGIC or formatVersion != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"'{path}' is not a replay recording (or was written by another version)")
+
+        names = bytes(self._map[FILE_HEADER.size:FILE_HEADER.size + namesLength]).rstrip(b'\0').decode()
+        self.names = names.split('\n')
+        if len(self.names) != columnCount:
+            self.close()
+            raise ValueError(f"'{path}' has a damaged header")
+        self.dataOffset = FILE_HEADER.size + namesLength
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def chunks(self):
+        '''
+        Yields every complete chunk of the file in order (a chunk cut off by a crash while recording is skipped)
+        '''
+        view = memoryview(self._map)
+        offset = self.dataOffset
+        size = len(self._map)
+        try:
+            while offset + CHUNK_HEADER.size <= size:
+                magic, count = CHUNK_HEADER.unpack_from(self._map, offset)
+                offset += CHUNK_HEADER.size
+                end = offset + 8 * count * len(self.names)
+                if magic != CHUNK_MAGIC or end > size:
+                    break
+
+                columns = {}
+                for name in self.names:
+                    columns[name] = view[offset:offset + 8 * count].cast('d')
+                    offset += 8 * count
+                yield ReplayChunk(count, columns)
+        finally:
+            view.release()
+
+class ReplayResult:
+    '''
+    # ReplayResult
+    Differences between the motor references of a replay and the recorded ones
+    '''
+    def __init__(self, outputs: list):
+        self.ticks = 0
+        self.mismatchedTicks = 0
+        self.firstMismatch = None # Recorded timestamp of the first tick with a difference
+        self.maxErrors = {name: 0.0 for name in outputs}
+        self.recordedPoses = 0 # Ticks recorded with the odometry thread, started from the recorded pose
+        self.odometryFrequency = 0
+        self.seconds = 0.0 # Wall time the replay took
+
+    def report(self):
+        rate = self.ticks / self.seconds if self.seconds else 0.0
+        debugMsg(f'Replayed {self.ticks} ticks in {self.seconds:.2f}s ({rate:.0f} ticks/s)')
+        if self.recordedPoses:
+            debugMsg(f'{self.recordedPoses} ticks were recorded with the {self.odometryFrequency:.0f} Hz odometry thread, '
+                     'they start from the recorded pose (odometry itself is not checked on them)')
+        if not self.mismatchedTicks:
+            successMsg('Every motor reference matched the recording')
+            return
+        warningMsg(f'{self.mismatchedTicks} ticks differ from the recording (first at {self.firstMismatch:.3f}s)')
+        for name, error in self.maxErrors.items():
+            if error:
+                debugMsg(f'  {name}: max difference {error:.6g}')
+
+class Replayer:
+    '''
+    # Replayer
+    Feeds a recording through the robot code on the simulated hardware, as fast as the code runs
+
+    Each tick the recorded sensor readings are written into the simulated devices, the recorded controller state and
+    mode into the simulated driver station, then the periodic methods run and the motor references are compared
+    to the recorded ones. Odometry is updated from the robot loop (not its thread), so replays are deterministic
+
+    The odometry thread of the robot integrates readings between the ticks, which are not recorded. Ticks recorded with
+    it start from the pose it had reached, so the commands see the same pose as on the robot
+    '''
+    def __init__(self, robot, tolerance: float = 1e-6):
+        from hardware import backend
+        from hardware.simulation import SimBackend, SimRunner
+        import wpilib.simulation
+        import hal
+
+        self.backend = backend.get()
+        if not isinstance(self.backend, SimBackend):
+            errorMsg('Replays need the simulated hardware backend (ROBOT_HARDWARE_BACKEND=sim)', None)
+
+        self.runner = SimRunner(robot, self.backend)
+        self.robot = robot
+        self.tolerance = tolerance
+        self.driverStation = wpilib.simulation.DriverStationSim
+        self.allianceStations = tuple(hal.AllianceStationID(value) for value in range(len(hal.AllianceStationID.__members__)))
+
+        if robot.recorder is not None:
+            robot.recorder.stop() # Do not record the replay (nothing was written yet, so no file is created)
+            robot.recorder = None
+        drivetrain = robot.drivetrain
+        if drivetrain.odometryThread is not None:
+            drivetrain.odometryThread.stop()
+            drivetrain.odometryThread = None
+
+        self.controllerPort = robot.controller.wpilibController.getPort()
+        self.auxPort = robot.auxController.wpilibController.getPort()
+        for port in (self.controllerPort, self.auxPort):
+            self.driverStation.setJoystickAxisCount(port, len(AXES))
+            self.driverStation.setJoystickButtonCount(port, 10)
+
+    def run(self, path: str):
+        '''
+        Replays a recording and returns a 'ReplayResult'
+        '''
+        robot = self.robot
+        from wpimath.geometry import Pose2d, Rotation2d
+
+        drivetrain = robot.drivetrain
+        modules = drivetrain.modules
+        gyro = drivetrain.navx
+        clock = self.backend.clock
+        driverStation = self.driverStation
+        tolerance = self.tolerance
+
+        # (name, module, attribute) of every recorded output
+        outputs = [(f'{module.name}.{field}', module, field) for module in modules for field in MODULE_OUTPUTS]
+        result = ReplayResult([name for name, _, _ in outputs])
+        start = time.perf_counter()
+
+        with ReplayFile(path) as recording:
+            missing = [name for name in columnNames(tuple(module.name for module in modules)) if name not in recording.names]
+            if missing:
+                errorMsg(f"'{path}' does not match this robot (missing columns {missing})", None)
+
+            previousTimestamp = None
+            for chunk in recording.chunks():
+                columns = chunk.columns
+                timestamps = columns['timestamp']
+                modes = columns['mode']
+                stations = columns['allianceStation']
+                axes = [columns[name] for name in AXES]
+                buttons = columns['buttons']
+                auxButtons = columns['auxButtons']
+                gyroYaws = columns['gyroYaw']
+                odometryFrequencies = columns['odometryFrequency']
+                poseXs, poseYs, poseHeadings = (columns[name] for name in POSE)
+                moduleInputs = [[columns[f'{module.name}.{field}'] for field in MODULE_INPUTS] for module in modules]
+                recordedOutputs = [columns[name] for name, _, _ in outputs]
+
+                for index in range(chunk.count):
+                    timestamp = timestamps[index]
+
+                    # wpilib time (slew rate limiters, timers) advances by the recorded loop period, in whole
+                    # microseconds like the FPGA clock (a float period just under 20 ms would lose one every tick)
+                    microseconds = round(timestamp * 1e6)
+                    if previousTimestamp is not None and microseconds > previousTimestamp:
+                        self.runner.wpilibSim.stepTimingAsync((microseconds - previousTimestamp) / 1e6)
+                    previousTimestamp = microseconds
+                    clock.time = timestamp
+
+                    driverStation.setAllianceStationId(self.allianceStations[int(stations[index])])
+                    for axis, values in enumerate(axes):
+                        driverStation.setJoystickAxis(self.controllerPort, axis, values[index])
+                    driverStation.setJoystickButtons(self.controllerPort, int(buttons[index]))
+                    driverStation.setJoystickButtons(self.auxPort, int(auxButtons[index]))
+                    driverStation.notifyNewData()
+                    self.runner.setMode(MODES[int(modes[index])])
+
+                    gyro.angle = gyroYaws[index] + gyro.offset # Recorded yaw is already zeroed
+                    for module, (absolutePositions, drivePositions, driveVelocities, turnPositions, turnVelocities) in zip(modules, moduleInputs):
+                        module.absolutePositionSignal.value_as_double = absolutePositions[index]
+                        driveEncoder = module.motorDrive.relativeEncoder
+                        driveEncoder.position = drivePositions[index]
+                        driveEncoder.velocity = driveVelocities[index]
+                        turnEncoder = module.motorTurn.relativeEncoder
+                        turnEncoder.position = turnPositions[index]
+                        turnEncoder.velocity = turnVelocities[index]
+
+                    if odometryFrequencies[index] > 0:
+                        drivetrain.resetOdometry(Pose2d(poseXs[index], poseYs[index], Rotation2d(poseHeadings[index])))
+                        result.recordedPoses += 1
+                        result.odometryFrequency = odometryFrequencies[index]
+
+                    getattr(robot, self.runner.mode + 'Periodic')()
+                    robot.robotPeriodic()
+
+                    mismatch = False
+                    for (name, module, field), recorded in zip(outputs, recordedOutputs):
+                        error = abs(getattr(module, field) - recorded[index])
+                        if error > tolerance:
+                            mismatch = True
+                            if error > result.maxErrors[name]:
+                                result.maxErrors[name] = error
+                    if mismatch:
+                        result.mismatchedTicks += 1
+                        if result.firstMismatch is None:
+                            result.firstMismatch = timestamp
+                    result.ticks += 1
+
+                # Drop every view into the file before moving on (the memory map cannot close while they exist)
+                del timestamps, modes, stations, axes, buttons, auxButtons, gyroYaws, odometryFrequencies, poseXs, poseYs, poseHeadings
+                del moduleInputs, recordedOutputs, columns
+                chunk.release()
+
+        result.seconds = time.perf_counter() - start
+        return result
+
+def main(arguments: list):
+    if not arguments:
+        print('Usage: python -m extras.replay <recording.rprl> [tolerance]')
+        return 1
+
+    # wpilib looks for 'deploy' next to the main script when it is first imported, so pretend to be 'robot.py'
+    import __main__
+    robotDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __main__.__file__ = os.path.join(robotDirectory, 'robot.py')
+    sys.path.insert(0, robotDirectory)
+
+    from hardware import backend
+    from hardware.simulation import SimBackend
+    backend.use(SimBackend())
+    import robot
+
+    replayer = Replayer(robot.terrance(), float(arguments[1]) if len(arguments) > 1 else 1e-6)
+    result = replayer.run(arguments[0])
+    from extras.logger import logger, DEBUG
+    logger.level = DEBUG # The robot prints from 'LOGGING_CONSTANTS.LEVEL' up, the report is printed in full
+    result.report()
+    return 1 if result.mismatchedTicks else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,210 @@
+# Times the boot of the robot code: the import of every module and each part of 'robotInit()'
+# 'startup.begin()' runs before anything else is imported (top of 'robot.py'), the report is printed once 'robotInit()' is done.
+# Run 'python -m extras.startup [budget ms]' to boot the robot code in simulation and print it (exits with 1 if over the budget)
+import os
+import sys
+import threading
+from time import perf_counter_ns
+
+ROBOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class StartupStage:
+    '''
+    # StartupStage
+    A timed part of 'robotInit()', used as a context manager ('with startup.stage(name):')
+    '''
+    __slots__ = ('startup', 'name', 'startNs', 'elapsedNs')
+
+    def __init__(self, startup, name: str):
+        self.startup = startup
+        self.name = name
+        self.startNs = 0
+        self.elapsedNs = 0
+
+    def __enter__(self):
+        self.startNs = perf_counter_ns()
+        if self.startup.initNs == 0:
+            self.startup.initNs = self.startNs
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.elapsedNs = perf_counter_ns() - self.startNs
+        self.startup.stages.append(self)
+        return False
+
+class _TimedLoader:
+    '''
+    # _TimedLoader
+    Stands in for the loader of a module while it is executed, then puts the real loader back on the module
+    '''
+    def __init__(self, startup, loader, group: str):
+        self.startup = startup
+        self.loader = loader
+        self.group = group
+
+    def __getattr__(self, name: str):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        self.startup._timeModule(self.loader, module, self.group)
+
+class StartupProfiler:
+    '''
+    # StartupProfiler
+    Import and initialization timing of the robot code boot
+
+    Import time is counted per module without the modules it imports itself, and added up per top level package for
+    libraries ('numpy', 'wpilib', ...) and per module for the robot code, so the groups add up to the total. Only
+    imports on the thread that called 'begin()' are counted: lazy imports on background threads do not hold up the boot
+    '''
+    def __init__(self):
+        self.running = False
+        self.beginNs = 0
+        self.initNs = 0 # Start of the first 'robotInit()' stage
+        self.endNs = 0
+        self.imports = {} # Group -> [nanoseconds, modules]
+        self.stages = [] # 'StartupStage' in the order they finished
+        self._threadId = None
+        self._childNs = [] # Time of the nested imports of every module being executed (innermost last)
+
+    def begin(self):
+        '''
+        Starts timing imports (call before importing anything else)
+        '''
+        if self.running:
+            return
+        self.running = True
+        self.beginNs = perf_counter_ns()
+        self._threadId = threading.get_ident()
+        sys.meta_path.insert(0, self)
+
+    def stage(self, name: str):
+        '''
+        Context manager that times one part of 'robotInit()' (a subsystem, the controllers, ...)
+        '''
+        return StartupStage(self, name)
+
+    def end(self):
+        '''
+        Stops timing imports (at the end of 'robotInit()')
+        '''
+        if not self.running:
+            return
+        self.running = False
+        self.endNs = perf_counter_ns()
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def totals(self):
+        '''
+        Milliseconds (total, loading 'robot.py', 'robotInit()', imports) from 'begin()' to 'end()'
+        '''
+        endNs = self.endNs or perf_counter_ns()
+        initNs = self.initNs or endNs
+        importNs = sum(groupNs for groupNs, modules in self.imports.values())
+        return (endNs - self.beginNs) / 1e6, (initNs - self.beginNs) / 1e6, (endNs - initNs) / 1e6, importNs / 1e6
+
+    def report(self, slowestImports: int = 10, output=None):
+        '''
+        Prints the boot time, the 'slowestImports' slowest import groups and every 'robotInit()' stage, through 'output'
+        (a function that takes one line, 'debugMsg()' by default)
+        '''
+        if output is None:
+            # Imported here, so this module imports nothing it would not time
+            from extras.debugmsgs import debugMsg
+            output = debugMsg
+
+        if self.beginNs == 0:
+            return
+        total, load, init, imports = self.totals()
+        modules = sum(count for groupNs, count in self.imports.values())
+        output(f'Startup: {total:.1f} ms (robot.py loaded in {load:.1f} ms, robotInit {init:.1f} ms), imports {imports:.1f} ms over {modules} modules')
+
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)[:slowestImports]
+        for group, (groupNs, count) in slowest:
+            output(f"  import {group}: {groupNs / 1e6:.1f} ms ({count} module{'s' if count > 1 else ''})")
+        for stage in self.stages:
+            output(f'  init {stage.name}: {stage.elapsedNs / 1e6:.1f} ms')
+
+    # Meta path finder: wraps the loader of every module found by the other finders
+    def find_spec(self, name: str, path=None, target=None):
+        if threading.get_ident() != self._threadId:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+
+        # Robot code per module, libraries per top level package
+        origin = spec.origin or ''
+        group = name if origin.startswith(ROBOT_DIRECTORY + os.sep) else name.partition('.')[0]
+        spec.loader = _TimedLoader(self, spec.loader, group)
+        return spec
+
+    def _timeModule(self, loader, module, group: str):
+        self._childNs.append(0)
+        startNs = perf_counter_ns()
+        try:
+            loader.exec_module(module)
+        finally:
+            elapsedNs = perf_counter_ns() - startNs
+            childNs = self._childNs.pop()
+            if self._childNs:
+                self._childNs[-1] += elapsedNs
+
+            times = self.imports.get(group)
+            if times is None:
+                times = self.imports[group] = [0, 0]
+            times[0] += elapsedNs - childNs
+            times[1] += 1
+
+# Shared startup profiler ('begin()' is called at the top of 'robot.py')
+startup = StartupProfiler()
+
+def main(arguments: list):
+    # The instance 'robot.py' uses (this file runs as '__main__', a second copy of the module), started before anything else
+    from extras.startup import startup
+    startup.begin()
+
+    # wpilib looks for 'deploy' next to the main script when it is first imported, so pretend to be 'robot.py'
+    import __main__
+    __main__.__file__ = os.path.join(ROBOT_DIRECTORY, 'robot.py')
+    sys.path.insert(0, ROBOT_DIRECTORY)
+
+    from hardware import backend
+    from hardware.simulation import SimBackend, SimRunner
+    backend.use(SimBackend())
+    import robot
+
+    SimRunner(robot.terrance()) # Runs 'robotInit()', which logs the report if enabled
+
+    # Only shown on the console if the robot logs at the 'DEBUG' level, otherwise printed here
+    from config import robotconfig
+    from extras.logger import logger, DEBUG
+    diagnostics = robotconfig.get().diagnostics
+    if not diagnostics.startupReport or logger.level > DEBUG:
+        startup.report(diagnostics.startupImports, print)
+
+    total = startup.totals()[0]
+    if arguments and total > float(arguments[0]):
+        from extras.debugmsgs import warningMsg
+        warningMsg(f'Startup took {total:.1f} ms, over the budget of {float(arguments[0]):.1f} ms')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
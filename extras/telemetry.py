@@ -0,0 +1,225 @@
+# Dashboard telemetry over NetworkTables, published in one batch per tick (see 'TELEMETRY_CONSTANTS' in 'constants.json')
+# Related values are packed into one struct or array topic, and a topic is only sent when a value changed by more than
+# its threshold, at most at its rate cap. Structs are packed into preallocated bytes, no wpimath objects are created
+import struct
+import time
+
+import ntcore
+import wpiutil.wpistruct as wpistruct
+
+from extras.debugmsgs import *
+
+RATE_CAP_SLACK = 0.002 # Seconds a topic can be sent early, so loop timing jitter does not make a capped topic skip a tick
+
+class TelemetryTopic:
+    '''
+    # TelemetryTopic
+    A NetworkTables topic with a fixed layout of doubles, published by 'telemetry.flush()' when it changed
+
+    Get topics from 'telemetry.doubleArrayTopic()'/'telemetry.structTopic()'/'telemetry.structArrayTopic()' once and keep them
+    '''
+    __slots__ = (
+        'telemetry', 'name', 'typeString', 'structType', 'length', 'thresholds', 'period',
+        'record', 'buffer', 'publisher',
+        'published', # Values last sent (None before the first time)
+        'staged', # Newest values that changed enough, waiting for 'flush()' (None if there are none)
+        'nextTime', # Earliest time the topic can be sent again (rate cap)
+        'publishes', 'unchanged', 'capped' # Counters since the last 'telemetry.report()'
+    )
+
+    def __init__(self, telemetry, name: str, typeString: str, structType, length: int, thresholds: tuple, maxRate: float):
+        self.telemetry = telemetry
+        self.name = name
+        self.typeString = typeString # 'double[]', or the struct type string ('struct:Pose2d', 'struct:SwerveModuleState[]')
+        self.structType = structType # wpimath class of the struct (None for 'double[]')
+        self.length = length
+        self.thresholds = thresholds # One per value
+        self.period = 1.0 / maxRate if maxRate > 0.0 else 0.0
+
+        # Structs are sent as raw bytes in the struct layout (little endian doubles)
+        self.record = struct.Struct(f'<{length}d') if typeString != 'double[]' else None
+        self.buffer = bytearray(self.record.size) if self.record is not None else None
+        self.publisher = None # Created by 'telemetry.start()'
+
+        self.published = None
+        self.staged = None
+        self.nextTime = 0.0
+        self.publishes = 0
+        self.unchanged = 0
+        self.capped = 0
+
+    def set(self, *values: float):
+        '''
+        Stages the values (the declared count, in struct field order) if any of them changed by more than the threshold
+        '''
+        if self.publisher is None:
+            return
+
+        # Once staged, the newest values are sent whatever they are
+        if self.staged is None:
+            published = self.published
+            if published is not None:
+                for index, threshold in enumerate(self.thresholds):
+                    difference = values[index] - published[index]
+                    if difference > threshold or difference < -threshold:
+                        break
+                else:
+                    self.unchanged += 1
+                    return
+            self.telemetry.pending.append(self)
+        self.staged = values
+
+    def _publish(self, values: tuple):
+        if self.record is None:
+            self.publisher.set(values)
+        else:
+            self.record.pack_into(self.buffer, 0, *values)
+            self.publisher.set(self.buffer)
+        self.published = values
+        self.publishes += 1
+
+class Telemetry:
+    '''
+    # Telemetry
+    Batched NetworkTables publisher
+
+    Components create their topics when they are constructed and 'set()' them during the tick. 'flush()' is called once
+    at the end of the tick and sends every staged topic whose rate cap allows it (the others keep their newest values
+    for a later tick). With 'flushNetwork' the values are handed to the network right away instead of on NetworkTables'
+    own period
+
+    Until 'start()' is called (or when telemetry is disabled) 'set()' returns right away
+    '''
+    def __init__(self):
+        self.running = False
+        self.clock = time.monotonic # Seconds, replaced by the robot clock in 'start()'
+        self.instance = None
+        self.options = None
+        self.table = ''
+        self.flushNetwork = False
+        self.topics = []
+        self.pending = [] # Topics with staged values, in the order they were first staged
+        self.flushes = 0
+
+    def start(self, table: str, flushNetwork: bool = False, periodic: float = 0.02, clock=None, instance=None):
+        '''
+        Creates a publisher for every topic (made so far and later) under 'table'
+
+        'periodic' is how often NetworkTables sends values on its own, 'clock' returns the robot time in seconds
+        (for the rate caps) and 'instance' is the NetworkTableInstance to publish to (the default one if not given)
+        '''
+        if self.running:
+            return
+
+        self.instance = instance or ntcore.NetworkTableInstance.getDefault()
+        self.table = table.strip('/')
+        self.flushNetwork = flushNetwork
+        self.options = ntcore.PubSubOptions(periodic=periodic)
+        if clock is not None:
+            self.clock = clock
+        self.running = True
+        for topic in self.topics:
+            self._createPublisher(topic)
+
+    def doubleArrayTopic(self, name: str, length: int, threshold: float = 0.0, maxRate: float = 0.0):
+        '''
+        Topic of 'length' doubles. 'maxRate' is the most times per second it is sent (0 for every tick it changes)
+        '''
+        return self._register(name, 'double[]', None, length, (threshold,) * length, maxRate)
+
+    def structTopic(self, name: str, type, threshold=0.0, maxRate: float = 0.0):
+        '''
+        Topic of one wpimath struct made only of doubles ('Pose2d', 'ChassisSpeeds', ...), set with its fields in order
+
+        'threshold' can be one number or one per field (when the fields have different units)
+        '''
+        fields = self._structLength(type)
+        return self._register(name, wpistruct.getTypeString(type), type, fields, self._thresholds(threshold, fields), maxRate)
+
+    def structArrayTopic(self, name: str, type, count: int, threshold=0.0, maxRate: float = 0.0):
+        '''
+        Topic of 'count' structs ('SwerveModuleState[]', ...), set with the fields of every struct one after the other
+        '''
+        fields = self._structLength(type)
+        return self._register(name, wpistruct.getTypeString(type) + '[]', type, fields * count, self._thresholds(threshold, fields) * count, maxRate)
+
+    def flush(self):
+        '''
+        Sends the staged topics. Call once per tick, after everything was set
+        '''
+        self.flushes += 1
+        pending = self.pending
+        if not pending:
+            return
+
+        now = self.clock()
+        waiting = 0
+        for topic in pending:
+            if now < topic.nextTime:
+                topic.capped += 1
+                pending[waiting] = topic # Kept for a later tick
+                waiting += 1
+                continue
+
+            topic._publish(topic.staged)
+            topic.staged = None
+            topic.nextTime = now + topic.period - RATE_CAP_SLACK
+        del pending[waiting:]
+
+        if self.flushNetwork:
+            self.instance.flush()
+
+    def report(self):
+        '''
+        Prints how much of what was set has been sent since the last report, and resets the counters
+        '''
+        if not self.running:
+            return
+        publishes = sum(topic.publishes for topic in self.topics)
+        unchanged = sum(topic.unchanged for topic in self.topics)
+        capped = sum(topic.capped for topic in self.topics)
+        debugMsg(f'Telemetry: {publishes} topic updates sent over {self.flushes} ticks, {unchanged} skipped (within thresholds), {capped} delayed by rate caps')
+        for topic in self.topics:
+            topic.publishes = topic.unchanged = topic.capped = 0
+        self.flushes = 0
+
+    def _register(self, name: str, typeString: str, structType, length: int, thresholds: tuple, maxRate: float):
+        for topic in self.topics:
+            if topic.name == name:
+                if topic.typeString != typeString or topic.length != length:
+                    raise ValueError(f"Telemetry topic '{name}' already exists with a different type")
+                return topic
+
+        topic = TelemetryTopic(self, name, typeString, structType, length, thresholds, maxRate)
+        self.topics.append(topic)
+        if self.running:
+            self._createPublisher(topic)
+        return topic
+
+    def _createPublisher(self, topic: TelemetryTopic):
+        path = f'/{self.table}/{topic.name}'
+        if topic.typeString == 'double[]':
+            topic.publisher = self.instance.getDoubleArrayTopic(path).publish(self.options)
+            return
+
+        # Dashboards decode a raw struct topic with the schemas of the struct and of the structs inside it
+        wpistruct.forEachNested(topic.structType, lambda typeString, schema: self.instance.addSchema(typeString, 'structschema', schema))
+        self.instance.addSchema(wpistruct.getTypeString(topic.structType), 'structschema', wpistruct.getSchema(topic.structType))
+        topic.publisher = self.instance.getRawTopic(path).publish(topic.typeString, self.options)
+
+    @staticmethod
+    def _thresholds(threshold, fields: int):
+        if isinstance(threshold, (int, float)):
+            return (float(threshold),) * fields
+        if len(threshold) != fields:
+            raise ValueError(f'Expected {fields} thresholds (one per field), got {len(threshold)}')
+        return tuple(float(value) for value in threshold)
+
+    @staticmethod
+    def _structLength(type):
+        size = wpistruct.getSize(type)
+        if size % 8:
+            raise ValueError(f"'{type.__name__}' is not a struct made only of doubles")
+        return size // 8
+
+telemetry = Telemetry()
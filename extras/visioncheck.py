@@ -0,0 +1,171 @@
+# Checks the Limelight ingest path without a camera: 'parseResults()' against recorded results, then the ingest thread
+# of 'LimelightCamera' fed by a fake camera (new target, repeated result, no target, read errors, stopping)
+# Run with 'python -m extras.visioncheck' (uses the simulated hardware backend clock). Exits with 1 if a check fails
+import os
+import sys
+import threading
+import time
+
+from extras.debugmsgs import *
+
+# Results as the Limelight sends them (trimmed to the fields 'parseResults()' reads)
+TARGET_RESULTS = {
+    'v': 1, 'pID': 1, 'ts': 1000.0, 'cl': 12.0, 'tl': 8.0,
+    'Fiducial': [{'fID': 4}, {'fID': 7}],
+    'botpose_wpiblue': [1.5, 2.5, 0.0, 0.0, 0.0, 90.0, 20.0, 2.0, 3.1, 0.3, 45.0]
+}
+NESTED_RESULTS = {'Results': dict(TARGET_RESULTS, ts=1001.0)} # Older firmware
+NO_TARGET_RESULTS = {
+    'v': 0, 'pID': 1, 'ts': 1002.0, 'cl': 12.0, 'tl': 0.0,
+    'Fiducial': [],
+    'botpose_wpiblue': [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 20.0, 0.0, 0.0, 0.0, 0.0]
+}
+SHORT_POSE_RESULTS = dict(TARGET_RESULTS, ts=1003.0, botpose_wpiblue=[1.5, 2.5, 0.0]) # Cut off pose array
+
+class FakeLimelight:
+    '''
+    # FakeLimelight
+    Stands in for 'limelight.Limelight': returns the results last given to 'show()', or raises while 'failing' is set
+    '''
+    def __init__(self):
+        self.results = {}
+        self.failing = False
+        self.reads = 0 # Number of calls to 'get_latest_results()'
+        self._read = threading.Condition()
+
+    def show(self, results: dict):
+        self.results = results
+
+    def get_latest_results(self):
+        with self._read:
+            self.reads += 1
+            self._read.notify_all()
+        if self.failing:
+            raise ConnectionError('Fake Limelight is failing')
+        return self.results
+
+    def waitForReads(self, count: int, timeout: float = 2.0):
+        '''
+        Waits until the camera has been read 'count' more times (returns False if it took longer than 'timeout')
+        '''
+        with self._read:
+            target = self.reads + count
+            return self._read.wait_for(lambda: self.reads >= target, timeout)
+
+class VisionCheck:
+    '''
+    # VisionCheck
+    Runs every check and collects the ones that failed
+    '''
+    def __init__(self, clock):
+        self.clock = clock # 'SimClock' of the simulated backend, frames are stamped with it
+        self.failures = []
+        self.checks = 0
+
+    def expect(self, condition: bool, description: str):
+        self.checks += 1
+        if not condition:
+            self.failures.append(description)
+
+    def checkParse(self):
+        from hardware.vision import parseResults
+
+        self.expect(parseResults({}, 1, 5.0) is None, 'empty results are not published')
+        self.expect(parseResults(None, 1, 5.0) is None, 'missing results are not published')
+
+        frame = parseResults(TARGET_RESULTS, 3, 5.0)
+        self.expect(frame is not None and frame.sequence == 3, 'a target is published with its sequence number')
+        if frame is not None:
+            self.expect(abs(frame.latency - 0.020) < 1e-9, 'latency is capture + targeting latency in seconds')
+            self.expect(abs(frame.captureTimestamp - 4.980) < 1e-9, 'capture time is the receive time minus the latency')
+            self.expect(frame.fiducialIds == (4, 7), 'every AprilTag in view is kept')
+            self.expect(frame.robotPose == (1.5, 2.5, 0.0, 0.0, 0.0, 90.0), 'the robot pose is the first six botpose values')
+            self.expect(frame.pipelineId == 1, 'the pipeline id is kept')
+
+        frame = parseResults(NESTED_RESULTS, 1, 5.0)
+        self.expect(frame is not None and frame.robotPose is not None, "results nested under 'Results' are read")
+
+        frame = parseResults(NO_TARGET_RESULTS, 1, 5.0)
+        self.expect(frame is not None and frame.robotPose is None and frame.fiducialIds == (), 'no target gives no pose')
+
+        frame = parseResults(SHORT_POSE_RESULTS, 1, 5.0)
+        self.expect(frame is not None and frame.robotPose is None, 'a cut off botpose gives no pose')
+
+    def checkThread(self):
+        from hardware.vision import LimelightCamera
+
+        fake = FakeLimelight()
+        camera = LimelightCamera(pollPeriod=0.001, client=fake)
+        try:
+            self.expect(fake.waitForReads(5), 'the ingest thread reads the camera')
+            self.expect(camera.getLatest() is None and camera.frames == 0, 'nothing is published before the first result')
+
+            # New target
+            self.clock.advance(1.0)
+            fake.show(TARGET_RESULTS)
+            fake.waitForReads(5)
+            first = camera.getLatest()
+            self.expect(first is not None and first.sequence == 1, 'a new result is published')
+            if first is not None:
+                self.expect(first.robotPose is not None, 'a published target has a pose')
+                self.expect(abs(first.captureTimestamp - (self.clock.time - 0.020)) < 1e-9, 'frames are stamped with the robot clock')
+
+            # Stale: the camera keeps returning the same result
+            self.clock.advance(1.0)
+            fake.show(dict(TARGET_RESULTS))
+            fake.waitForReads(20)
+            self.expect(camera.getLatest() is first and camera.frames == 1, 'a repeated result is not published again')
+
+            # Target lost
+            fake.show(NO_TARGET_RESULTS)
+            fake.waitForReads(5)
+            lost = camera.getLatest()
+            self.expect(lost is not None and lost.sequence == 2, 'a result without a target is published')
+            if lost is not None:
+                self.expect(lost.robotPose is None, 'a result without a target has no pose')
+
+            # Camera stops answering
+            fake.failing = True
+            fake.waitForReads(10)
+            self.expect(camera.errors >= 10, 'failed reads are counted')
+            self.expect(camera.getLatest() is lost, 'the last frame is kept while reads fail')
+
+            # Camera comes back
+            fake.failing = False
+            fake.show(NESTED_RESULTS)
+            fake.waitForReads(5)
+            back = camera.getLatest()
+            self.expect(back is not None and back.sequence == 3, 'results are published again once reads succeed')
+        finally:
+            camera.stop()
+
+        self.expect(not camera._thread.is_alive(), "'stop()' ends the ingest thread")
+        reads = fake.reads
+        time.sleep(0.02)
+        self.expect(fake.reads == reads, 'the camera is not read after stopping')
+
+    def report(self):
+        if not self.failures:
+            successMsg(f'Vision: {self.checks} checks passed')
+            return
+
+        warningMsg(f'Vision: {len(self.failures)} of {self.checks} checks failed')
+        for failure in self.failures:
+            debugMsg(f'  {failure}')
+
+def main(arguments: list):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from hardware import backend
+    from hardware.simulation import SimBackend
+    simulation = SimBackend()
+    backend.use(simulation)
+
+    check = VisionCheck(simulation.clock)
+    check.checkParse()
+    check.checkThread()
+    check.report()
+    return 1 if check.failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
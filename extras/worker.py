@@ -0,0 +1,293 @@
+# Background worker for jobs that do not have to finish within a tick (file loading, parsing, network discovery, ...)
+# An asyncio event loop runs on its own thread: coroutines run on the loop, plain functions on a small thread pool.
+# The robot loop submits jobs and checks them without waiting, callbacks of finished jobs run on the robot loop in 'poll()'
+# asyncio is imported on the worker thread when it starts, not while the robot code boots
+import inspect
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter_ns
+
+from extras.debugmsgs import *
+from extras.profiler import RingBuffer
+
+# States of a job
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+class Job:
+    '''
+    # Job
+    A function submitted to the worker. Every method can be called from the robot loop without blocking
+
+    The worker thread only assigns attributes, and 'state' last, so a finished state means the result is there
+    '''
+    __slots__ = (
+        'name', 'function', 'arguments', 'onDone', 'modeScoped', 'isCoroutine',
+        'state', 'value', 'error',
+        'submittedNs', 'startedNs', 'finishedNs',
+        'task' # asyncio task while the job is on the loop
+    )
+
+    def __init__(self, name: str, function, arguments: tuple, onDone, modeScoped: bool):
+        self.name = name
+        self.function = function
+        self.arguments = arguments
+        self.onDone = onDone # Called with the job by 'worker.poll()' once it is done or failed (not if cancelled)
+        self.modeScoped = modeScoped # Cancelled when autonomous or teleop ends
+        self.isCoroutine = inspect.iscoroutinefunction(function)
+        self.state = QUEUED
+        self.value = None
+        self.error = None
+        self.submittedNs = perf_counter_ns()
+        self.startedNs = 0
+        self.finishedNs = 0
+        self.task = None
+
+    def done(self):
+        '''
+        True once the job finished, failed or was cancelled
+        '''
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def result(self, default=None):
+        '''
+        Returns what the function returned, or 'default' if it has not finished (or failed, see 'error')
+        '''
+        return self.value if self.state == DONE else default
+
+class Worker:
+    '''
+    # Worker
+    Event loop thread and thread pool shared by the robot code (see 'WORKER_CONSTANTS' in 'constants.json')
+
+    At most 'queueSize' jobs can be waiting or running: 'submit()' returns None when the queue is full instead of
+    waiting. A function already running on the thread pool cannot be stopped, cancelling it only throws its result away
+    (it still counts against 'queueSize' until it returns)
+
+    Jobs are accepted once the event loop is up, shortly after 'start()' (until then 'submit()' returns None)
+    '''
+    def __init__(self):
+        self.running = False
+        self.loop = None
+        self.executor = None
+        self.queueSize = 0
+        self._thread = None
+        self._ready = threading.Event() # Set once the event loop is up
+
+        self.jobs = set() # Waiting or running
+        self.finished = deque() # Done or failed jobs whose 'onDone' still has to be called by 'poll()'
+        self.lock = threading.Lock() # Held while 'jobs' changes
+
+        self.waitTimes = RingBuffer(1) # Nanoseconds from submit to start
+        self.runTimes = RingBuffer(1) # Nanoseconds from start to finish
+        self.resetMetrics()
+
+    def start(self, threads: int = 2, queueSize: int = 32, latencyWindow: int = 256):
+        '''
+        Starts the event loop thread (without waiting for it). 'threads' run the plain functions, 'latencyWindow' jobs
+        are kept for the timings
+        '''
+        if self._thread is not None:
+            return
+
+        self.queueSize = queueSize
+        self.waitTimes = RingBuffer(latencyWindow)
+        self.runTimes = RingBuffer(latencyWindow)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='WorkerPool')
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name='Worker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Cancels every job and stops the event loop thread and the thread pool
+        '''
+        if self._thread is None:
+            return
+        self._ready.wait(2.0) # Still starting
+        self.running = False
+        self.cancelAll()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(2.0)
+        self._thread = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, function, *arguments, name: str = None, onDone=None, modeScoped: bool = True):
+        '''
+        Runs 'function(*arguments)' in the background: on the event loop if it is a coroutine function, on the
+        thread pool otherwise. Returns the 'Job', or None if the worker is not running or the queue is full
+
+        'onDone(job)' is called from 'poll()' on the robot loop. 'modeScoped' jobs are cancelled when autonomous or teleop ends
+        '''
+        if not self.running:
+            return None
+
+        job = Job(name or getattr(function, '__name__', 'job'), function, arguments, onDone, modeScoped)
+        with self.lock:
+            if len(self.jobs) >= self.queueSize:
+                self.rejected += 1
+                debugMsg(f"Worker queue is full, job '{job.name}' was not submitted")
+                return None
+            self.jobs.add(job)
+            self.maxDepth = max(self.maxDepth, len(self.jobs))
+
+        self.loop.call_soon_threadsafe(self._startJob, job)
+        return job
+
+    def cancel(self, job: Job):
+        '''
+        Cancels a job that has not finished (returns False if it already had)
+        '''
+        with self.lock:
+            if job not in self.jobs or job.state == CANCELLED:
+                return False
+            # A function running on the thread pool keeps its thread until it returns, '_finish()' removes it then
+            onThread = job.state == RUNNING and not job.isCoroutine
+            if not onThread:
+                self.jobs.discard(job)
+            job.state = CANCELLED
+        self.cancelledJobs += 1
+
+        if self.running and not onThread:
+            self.loop.call_soon_threadsafe(self._cancelTask, job)
+        return True
+
+    def cancelAll(self, modeScoped: bool = False):
+        '''
+        Cancels every unfinished job ('modeScoped' only the ones submitted with 'modeScoped=True'). Returns how many were cancelled
+        '''
+        with self.lock:
+            jobs = [job for job in self.jobs if job.modeScoped or not modeScoped]
+        return sum(self.cancel(job) for job in jobs)
+
+    def poll(self):
+        '''
+        Calls 'onDone' of the jobs that finished since the last call (call once per tick from the robot loop)
+        '''
+        finished = self.finished
+        while finished:
+            job = finished.popleft()
+            try:
+                job.onDone(job)
+            except Exception as e: # A failing callback should not stop the others (or the robot loop)
+                debugMsg(f"Callback of job '{job.name}' failed: {e}")
+
+    def depth(self):
+        '''
+        Jobs waiting or running
+        '''
+        return len(self.jobs)
+
+    def report(self):
+        '''
+        Prints the job counts and timings (p50/p99 in milliseconds) since the last report, and resets them
+        '''
+        if not self.running:
+            return
+        waitP50, waitP99 = self.waitTimes.percentiles(0.5, 0.99)
+        runP50, runP99 = self.runTimes.percentiles(0.5, 0.99)
+        debugMsg(
+            f'Worker: {self.completed} done, {self.failed} failed, {self.cancelledJobs} cancelled, {self.rejected} rejected, '
+            f'queue depth {self.depth()} (max {self.maxDepth}), '
+            f'wait p50 {waitP50 / 1e6:.2f} ms p99 {waitP99 / 1e6:.2f} ms, run p50 {runP50 / 1e6:.2f} ms p99 {runP99 / 1e6:.2f} ms'
+        )
+        self.resetMetrics()
+
+    def resetMetrics(self):
+        self.completed = 0
+        self.failed = 0
+        self.cancelledJobs = 0
+        self.rejected = 0
+        self.maxDepth = len(self.jobs)
+        self.waitTimes.clear()
+        self.runTimes.clear()
+
+    def _run(self):
+        import asyncio
+
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        asyncio.set_event_loop(self.loop)
+        self.running = True
+        self._ready.set()
+        self.loop.run_forever()
+
+        # Stopped: cancel what is left on the loop and let the tasks finish cancelling
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def _startJob(self, job: Job):
+        if job.state == CANCELLED:
+            return
+        job.task = self.loop.create_task(self._runJob(job))
+
+    def _cancelTask(self, job: Job):
+        if job.task is not None:
+            job.task.cancel()
+
+    async def _runJob(self, job: Job):
+        import asyncio
+
+        try:
+            if job.isCoroutine:
+                if not self._started(job):
+                    return
+                value = await job.function(*job.arguments)
+            else:
+                value = await self.loop.run_in_executor(None, self._call, job)
+        except asyncio.CancelledError: # Cancelled, or the worker stopped
+            with self.lock:
+                self.jobs.discard(job)
+            return
+        except Exception as e:
+            self._finish(job, FAILED, None, e)
+            return
+        self._finish(job, DONE, value, None)
+
+    def _call(self, job: Job):
+        # On a thread of the pool. A job cancelled while it waited for a thread is not run
+        if not self._started(job):
+            return None
+        return job.function(*job.arguments)
+
+    def _started(self, job: Job):
+        with self.lock:
+            if job.state == CANCELLED:
+                return False
+            job.startedNs = perf_counter_ns()
+            job.state = RUNNING
+            return True
+
+    def _finish(self, job: Job, state: str, value, error: Exception):
+        job.finishedNs = perf_counter_ns()
+        with self.lock:
+            self.jobs.discard(job)
+            if job.state == CANCELLED: # Cancelled while it ran on the thread pool
+                return
+            job.value = value
+            job.error = error
+            job.state = state
+            if state == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+                debugMsg(f"Job '{job.name}' failed: {error}")
+            self.waitTimes.append(job.startedNs - job.submittedNs)
+            self.runTimes.append(job.finishedNs - job.startedNs)
+
+        if job.onDone is not None:
+            self.finished.append(job)
+
+# Shared worker used by the robot and its components (not running until 'start()' is called)
+worker = Worker()
@@ -0,0 +1,165 @@
+# Chooses where hardware devices come from: the real vendor libraries (default) or simulated devices
+# Select the simulated devices with the environment variable ROBOT_HARDWARE_BACKEND=sim, or call 'use()' before 'robotInit()'
+import os
+
+from extras.debugmsgs import *
+
+class RealBackend:
+    '''
+    # RealBackend
+    Creates devices through the vendor libraries (rev, phoenix6, navx). Needs the real devices on the CAN bus/SPI port
+
+    The vendor libraries are only imported when a device is created, so the robot code can be imported without them
+    '''
+    name = 'real'
+
+    def createSparkMax(self, channel: int, brushless: bool):
+        import rev
+        return rev.CANSparkMax(channel, rev.CANSparkMax.MotorType.kBrushless if brushless else rev.CANSparkMax.MotorType.kBrushed)
+
+    def createCANcoder(self, channel: int, canbus: str = ''):
+        import phoenix6
+        return phoenix6.hardware.CANcoder(channel, canbus)
+
+    def createTalonFX(self, channel: int, canbus: str = ''):
+        import phoenix6
+        return phoenix6.hardware.TalonFX(channel, canbus)
+
+    def createGyro(self, updateRate: int = None):
+        '''
+        Creates the navX on the MXP SPI port. 'updateRate' (Hz, up to 200) replaces its default of 50 updates per second
+        '''
+        import navx
+        if updateRate is None:
+            return navx.AHRS.create_spi()
+        return navx.AHRS.create_spi(update_rate_hz=updateRate)
+
+    def refreshSignals(self, signals: tuple):
+        '''
+        Refreshes phoenix6 status signals in one batched read
+        '''
+        import phoenix6
+        phoenix6.BaseStatusSignal.refresh_all(*signals)
+
+    def signalCheck(self, signal):
+        '''
+        Returns a function that tells if the last refresh of a phoenix6 status signal succeeded
+        '''
+        return lambda: signal.status.is_ok()
+
+    def sparkMaxCheck(self, motor):
+        '''
+        Returns a function that tells if the last call to a CANSparkMax succeeded
+        '''
+        import rev
+        ok = rev.REVLibError.kOk
+        return lambda: motor.getLastError() == ok
+
+    def gyroCheck(self, gyro):
+        '''
+        Returns a function that tells if the navX is connected
+        '''
+        return gyro.isConnected
+
+    def getTimestamp(self):
+        '''
+        Returns the FPGA time in seconds
+        '''
+        import wpilib
+        return wpilib.Timer.getFPGATimestamp()
+
+    def idleMode(self, brake: bool):
+        import rev
+        return rev.CANSparkMax.IdleMode.kBrake if brake else rev.CANSparkMax.IdleMode.kCoast
+
+    def controlType(self, name: str):
+        '''
+        Returns a CANSparkMax control type ('kVelocity', 'kPosition', ...)
+        '''
+        import rev
+        return getattr(rev.CANSparkMax.ControlType, name)
+
+    def configureTalonFX(self, motor, config):
+        '''
+        Reads the whole configuration of a TalonFX, changes the values of a 'motors.TalonFXConfig' that differ and applies
+        them in one transaction (only if something changed). Returns the names of the changed values
+        '''
+        import phoenix6
+
+        # Current configuration of the Kraken (values that are not set here are kept)
+        configuration = phoenix6.configs.TalonFXConfiguration()
+        status = motor.configurator.refresh(configuration)
+        if not status.is_ok():
+            raise RuntimeError(f'could not read the configuration ({status.name})')
+
+        neutralMode = phoenix6.signals.NeutralModeValue.BRAKE if config.brake else phoenix6.signals.NeutralModeValue.COAST
+
+        # (name, config object, attribute, desired value)
+        values = (
+            ('brake', configuration.motor_output, 'neutral_mode', neutralMode),
+            ('enableStatorCurrentLimit', configuration.current_limits, 'stator_current_limit_enable', config.enableStatorCurrentLimit),
+            ('statorCurrentLimit', configuration.current_limits, 'stator_current_limit', config.statorCurrentLimit),
+            ('KP', configuration.slot0, 'k_p', config.KP),
+            ('KI', configuration.slot0, 'k_i', config.KI),
+            ('KD', configuration.slot0, 'k_d', config.KD),
+            ('KV', configuration.slot0, 'k_v', config.KV)
+        )
+
+        changed = []
+        for name, configs, attribute, value in values:
+            current = getattr(configs, attribute)
+            if current != value and not (isinstance(value, float) and abs(current - value) <= 1e-6 * max(1.0, abs(value))):
+                setattr(configs, attribute, value)
+                changed.append(name)
+
+        if changed:
+            status = motor.configurator.apply(configuration)
+            if not status.is_ok():
+                raise RuntimeError(f'could not apply the configuration ({status.name})')
+        return changed
+
+    def setStatusFramePeriods(self, motor, periods: tuple):
+        '''
+        Sets the period (ms) of CANSparkMax status frames 0 - 6
+        '''
+        import rev
+        for index, period in enumerate(periods):
+            motor.setPeriodicFramePeriod(getattr(rev.CANSparkMax.PeriodicFrame, f'kStatus{index}'), period)
+
+    def setSignalRates(self, device, rates: dict):
+        '''
+        Sets the update rate (Hz) of phoenix6 status signals ({signal getter name: rate}) and turns every other signal off
+        '''
+        for getter, rate in rates.items():
+            getattr(device, getter)().set_update_frequency(rate)
+        device.optimize_bus_utilization()
+
+    def velocityRequest(self, slot: int, enableFOC: bool):
+        import phoenix6
+        return phoenix6.controls.VelocityDutyCycle(0).with_slot(slot).with_enable_foc(enableFOC)
+
+    def followerRequest(self, masterChannel: int, opposeMasterDirection: bool):
+        import phoenix6
+        return phoenix6.controls.Follower(masterChannel, opposeMasterDirection)
+
+_backend = None
+
+def use(backend):
+    '''
+    Sets the backend used to create every device from now on. Must be called before any device is created
+    '''
+    global _backend
+    _backend = backend
+    debugMsg(f'Using {backend.name} hardware backend')
+
+def get():
+    '''
+    Returns the current backend (chosen from ROBOT_HARDWARE_BACKEND the first time it is needed)
+    '''
+    if _backend is None:
+        if os.environ.get('ROBOT_HARDWARE_BACKEND', 'real').lower() == 'sim':
+            from hardware.simulation import SimBackend
+            use(SimBackend())
+        else:
+            use(RealBackend())
+    return _backend
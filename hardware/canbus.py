@@ -0,0 +1,123 @@
+# Status frame rates of every CAN device, picked from what the code reads from it, and the bus load they add up to
+# Devices get a role ('drive', 'turn', 'leader', 'follower', 'absoluteEncoder'); every frame the role does not use is slowed down or turned off
+from extras.debugmsgs import *
+
+# Bits of one 8 byte CAN frame with an extended (29 bit) id: 128 bits plus typical bit stuffing
+FRAME_BITS = 150
+
+# Longest period (ms) a SPARK MAX accepts, the frame is effectively turned off
+DISABLED_PERIOD = 65535
+
+# Replaced by the rate of the odometry thread (see 'ODOMETRY_CONSTANTS.FREQUENCY')
+ODOMETRY = 'odometry'
+
+# Period (ms) of SPARK MAX status frames 0 - 6 for each role
+# 0: applied output and faults (read by followers) / 1: velocity, temperature, voltage, current / 2: position
+# 3: analog sensor / 4: alternate encoder / 5, 6: duty cycle absolute encoder
+SPARK_MAX_DEFAULT_PERIODS = (10, 20, 20, 50, 20, 200, 200)
+SPARK_MAX_PROFILES = {
+    'drive': (100, 20, ODOMETRY, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD), # Position for odometry, velocity once per tick
+    'turn': (100, 20, 20, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD), # Read once per tick (the angle comes from the CANcoder)
+    'leader': (10, 20, 20, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD), # Followers copy status 0
+    'follower': (100, 500, 500, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD, DISABLED_PERIOD) # Nothing is read from it
+}
+
+# Update rate (Hz) of the phoenix6 status signals read from each role. 'optimize_bus_utilization()' turns every other signal off
+PHOENIX_PROFILES = {
+    'absoluteEncoder': {'get_absolute_position': ODOMETRY},
+    'drive': {'get_position': ODOMETRY, 'get_velocity': 50.0},
+    'turn': {'get_position': 50.0, 'get_velocity': 50.0},
+    'leader': {'get_position': 50.0, 'get_velocity': 50.0, 'get_duty_cycle': 100.0, 'get_motor_voltage': 100.0, 'get_torque_current': 100.0}, # Followers copy these
+    'follower': {}
+}
+
+# Signals phoenix6 devices keep sending after 'optimize_bus_utilization()' (device status, roughly)
+PHOENIX_KEEPALIVE_RATE = 4.0
+
+# Frames per second the roboRIO sends to a device of each role (setpoints and encoder resets from the 50 Hz loop)
+CONTROL_RATES = {'drive': 50.0, 'turn': 100.0, 'leader': 50.0, 'follower': 0.0, 'absoluteEncoder': 0.0}
+
+def _rate(value, odometryFrequency: float):
+    '''
+    Resolves 'ODOMETRY' to the odometry rate in Hz (the robot loop rate if odometry runs in the loop)
+    '''
+    if value == ODOMETRY:
+        return odometryFrequency if odometryFrequency > 0 else 50.0
+    return value
+
+def sparkMaxPeriods(role: str, odometryFrequency: float):
+    '''
+    Returns the status frame periods (ms) of a SPARK MAX role, or the firmware defaults if 'role' is None
+    '''
+    if role is None:
+        return SPARK_MAX_DEFAULT_PERIODS
+    if role not in SPARK_MAX_PROFILES:
+        errorMsg(f"Unknown CAN device role '{role}' (expected one of {tuple(SPARK_MAX_PROFILES)})", None)
+    return tuple(
+        max(1, round(1000.0 / _rate(period, odometryFrequency))) if period == ODOMETRY else period
+        for period in SPARK_MAX_PROFILES[role]
+    )
+
+def phoenixRates(role: str, odometryFrequency: float):
+    '''
+    Returns the signal update rates (Hz) of a phoenix6 device role ({signal getter name: rate})
+    '''
+    if role not in PHOENIX_PROFILES:
+        errorMsg(f"Unknown CAN device role '{role}' (expected one of {tuple(PHOENIX_PROFILES)})", None)
+    return {signal: float(_rate(rate, odometryFrequency)) for signal, rate in PHOENIX_PROFILES[role].items()}
+
+def sparkMaxFrameRate(periods: tuple, role: str):
+    '''
+    Frames per second on the bus for a SPARK MAX with the given status frame periods
+    '''
+    return sum(1000.0 / period for period in periods if period < DISABLED_PERIOD) + CONTROL_RATES.get(role, 50.0)
+
+def phoenixFrameRate(rates: dict, role: str):
+    '''
+    Frames per second on the bus for a phoenix6 device (counting one frame per signal, phoenix6 often packs several)
+    '''
+    return sum(rates.values()) + PHOENIX_KEEPALIVE_RATE + CONTROL_RATES.get(role, 0.0)
+
+class BusLoad:
+    '''
+    # BusLoad
+    Expected frames per second of every CAN device, added when the device is created
+
+    'utilization()' is the share of the bus bandwidth they use. Above ~70% frames start waiting for the bus,
+    which shows up as late sensor readings
+    '''
+    def __init__(self, bitrate: int = 1000000):
+        self.bitrate = bitrate
+        self.devices = {} # Name -> (role, frames per second)
+
+    def configure(self, bitrate: int):
+        self.bitrate = bitrate
+
+    def add(self, name: str, role: str, framesPerSecond: float):
+        self.devices[name] = (role or 'default', framesPerSecond)
+
+    def framesPerSecond(self):
+        return sum(framesPerSecond for _, framesPerSecond in self.devices.values())
+
+    def utilization(self):
+        return self.framesPerSecond() * FRAME_BITS / self.bitrate
+
+    def report(self, maxUtilization: float = 1.0):
+        '''
+        Prints the expected load per role, and a warning if the total is above 'maxUtilization' (0.0 - 1.0)
+        '''
+        roles = {}
+        for role, framesPerSecond in self.devices.values():
+            count, total = roles.get(role, (0, 0.0))
+            roles[role] = (count + 1, total + framesPerSecond)
+
+        utilization = self.utilization()
+        debugMsg(f'CAN bus: {len(self.devices)} devices, {self.framesPerSecond():.0f} frames/s, {utilization:.0%} of {self.bitrate / 1e6:g} Mbit/s')
+        for role, (count, total) in sorted(roles.items()):
+            debugMsg(f'  {role}: {count} devices, {total:.0f} frames/s')
+
+        if utilization > maxUtilization:
+            warningMsg(f'Expected CAN bus load {utilization:.0%} is above {maxUtilization:.0%}, slow down the status frames of some devices')
+
+# Shared estimate for every device on the robot's CAN bus
+busLoad = BusLoad()
@@ -0,0 +1,99 @@
+# Tracks whether each device is giving good readings, so a device that drops off the bus costs counters instead of exceptions
+from extras.debugmsgs import *
+
+# Device status (ordered, so the worst status of several devices is their 'max()')
+OK = 0 # Last reading was good
+STALE = 1 # Last reading failed, the last good value is being used
+FAULTED = 2 # No good reading for 'faultTimeout' seconds (or not recovered yet)
+
+STATUS_NAMES = ('OK', 'STALE', 'FAULTED')
+
+class DeviceHealth:
+    '''
+    # DeviceHealth
+    Status of a single device, updated with 'good()'/'bad()' after every reading
+
+    A failed reading makes the device STALE. If it stays failed for 'faultTimeout' seconds it becomes FAULTED, and it
+    only returns to OK after 'recoveryReads' good readings in a row (so a flaky connection does not flap on and off)
+    '''
+    __slots__ = ('monitor', 'name', 'status', 'lastGoodTimestamp', 'staleSince', 'goodReads', 'failures')
+
+    def __init__(self, monitor, name: str):
+        self.monitor = monitor
+        self.name = name
+        self.status = OK
+        self.lastGoodTimestamp = None
+        self.staleSince = 0.0
+        self.goodReads = 0 # Good readings in a row while FAULTED
+        self.failures = 0 # Failed readings since the robot started
+
+    def good(self, timestamp: float):
+        self.lastGoodTimestamp = timestamp
+        if self.status == OK:
+            return
+
+        if self.status == FAULTED:
+            self.goodReads += 1
+            if self.goodReads < self.monitor.recoveryReads:
+                return
+        self._setStatus(OK, timestamp)
+
+    def bad(self, timestamp: float):
+        self.failures += 1
+        if self.status == OK:
+            self.staleSince = timestamp
+            self._setStatus(STALE, timestamp)
+        elif self.status == STALE:
+            if timestamp - self.staleSince >= self.monitor.faultTimeout:
+                self._setStatus(FAULTED, timestamp)
+        else:
+            self.goodReads = 0
+
+    def _setStatus(self, status: int, timestamp: float):
+        previous = self.status
+        self.status = status
+        self.goodReads = 0
+        self.monitor.changes += 1
+
+        # Only status changes are reported, so a device that stays failed costs nothing but the counters
+        if status == FAULTED:
+            warningMsg(f'{self.name} FAULTED at {timestamp:.3f}s ({self.failures} failed readings)')
+        elif previous == FAULTED:
+            successMsg(f'{self.name} recovered at {timestamp:.3f}s')
+
+class HealthMonitor:
+    '''
+    # HealthMonitor
+    Owns the 'DeviceHealth' of every device. 'changes' increases on every status change, so users can check for
+    changes once per tick with a single integer comparison
+    '''
+    def __init__(self, faultTimeout: float = 0.1, recoveryReads: int = 25):
+        self.devices = {}
+        self.changes = 0
+        self.configure(faultTimeout, recoveryReads)
+
+    def configure(self, faultTimeout: float, recoveryReads: int):
+        self.faultTimeout = faultTimeout # Seconds
+        self.recoveryReads = recoveryReads
+
+    def device(self, name: str):
+        '''
+        Returns the health of the device with the given name (created on first use)
+        '''
+        device = self.devices.get(name)
+        if device is None:
+            device = self.devices[name] = DeviceHealth(self, name)
+        return device
+
+    def report(self):
+        '''
+        Prints the status and failure count of every device that has failed at least once
+        '''
+        failed = [device for device in self.devices.values() if device.failures]
+        if failed:
+            debugMsg('Device health:')
+        for device in failed:
+            debugMsg(f'  {device.name}: {STATUS_NAMES[device.status]}, {device.failures} failed readings')
+
+# Shared monitor used by the robot components
+health = HealthMonitor()
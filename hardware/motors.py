@@ -1,117 +1,246 @@
 # Module for controlling different motors
+# Motors are configured declaratively: each motor gets its full configuration up front, and 'motorConfigurator' only
+# sends the settings that differ from what is already on the device (every device at the same time)
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import math
+
 from extras.debugmsgs import *
 
-import rev
-import phoenix6
+from hardware import backend
+from hardware.canbus import busLoad, sparkMaxPeriods, sparkMaxFrameRate, phoenixRates, phoenixFrameRate
+from config import robotconfig
+
+class SparkMaxConfig:
+    '''
+    # SparkMaxConfig
+    Everything configured on a CANSparkMax
+    '''
+    __slots__ = ('smartCurrentLimit', 'inverted', 'brake', 'positionConversionFactor', 'velocityConversionFactor', 'PID', 'outputRange', 'role')
+
+    def __init__(self,
+                smartCurrentLimit: int,
+                inverted = True,
+                brake = True, # Brake mode (motor brakes when not doing anything), coast if False
+                positionConversionFactor = 1.0,
+                velocityConversionFactor = 1.0,
+                PID = (0.0, 0.0, 0.0, 0.0), # (P, I, D, FF)
+                outputRange = (-1.0, 1.0),
+                role = None): # Status frame profile ('drive', 'turn', 'leader', 'follower', see 'hardware/canbus.py'), None keeps the defaults
+        self.smartCurrentLimit = smartCurrentLimit
+        self.inverted = inverted
+        self.brake = brake
+        self.positionConversionFactor = positionConversionFactor
+        self.velocityConversionFactor = velocityConversionFactor
+        self.PID = tuple(PID)
+        self.outputRange = tuple(outputRange)
+        self.role = role
+
+# (name, read the value on the device, write a value) of every CANSparkMax setting, with 'spark' a 'CANSparkMax' below
+# Settings the firmware cannot report ('read' is None) are written on every start and never burned to flash on their own
+SPARK_MAX_SETTINGS = (
+    ('inverted', lambda spark: spark.motor.getInverted(), lambda spark, value: spark.motor.setInverted(value)),
+    ('idleMode', lambda spark: spark.motor.getIdleMode(), lambda spark, value: spark.motor.setIdleMode(value)),
+    ('smartCurrentLimit', None, lambda spark, value: spark.motor.setSmartCurrentLimit(value)),
+    ('statusFramePeriods', None, lambda spark, value: backend.get().setStatusFramePeriods(spark.motor, value)), # Never saved by the firmware
+    ('feedbackDevice', None, lambda spark, value: spark.PIDController.setFeedbackDevice(value)),
+    ('positionConversionFactor', lambda spark: spark.relativeEncoder.getPositionConversionFactor(), lambda spark, value: spark.relativeEncoder.setPositionConversionFactor(value)),
+    ('velocityConversionFactor', lambda spark: spark.relativeEncoder.getVelocityConversionFactor(), lambda spark, value: spark.relativeEncoder.setVelocityConversionFactor(value)),
+    ('P', lambda spark: spark.PIDController.getP(), lambda spark, value: spark.PIDController.setP(value)),
+    ('I', lambda spark: spark.PIDController.getI(), lambda spark, value: spark.PIDController.setI(value)),
+    ('D', lambda spark: spark.PIDController.getD(), lambda spark, value: spark.PIDController.setD(value)),
+    ('FF', lambda spark: spark.PIDController.getFF(), lambda spark, value: spark.PIDController.setFF(value)),
+    ('outputRange', lambda spark: (spark.PIDController.getOutputMin(), spark.PIDController.getOutputMax()), lambda spark, value: spark.PIDController.setOutputRange(*value)),
+)
+
+def _matches(current, desired):
+    '''
+    Compares a value read from a device with the desired one (devices store floats with single precision)
+    '''
+    if isinstance(desired, tuple):
+        return isinstance(current, tuple) and len(current) == len(desired) and all(_matches(a, b) for a, b in zip(current, desired))
+    if isinstance(desired, float):
+        return isinstance(current, (int, float)) and math.isclose(current, desired, rel_tol=1e-6, abs_tol=1e-9)
+    return current == desired
 
 class CANSparkMax:
     '''
     # CANSparkMax
     Class for configuring and setting up a CANSparkMax motor
+
+    Creating the motor sends nothing to it. The configuration is applied by 'configure()', which 'motorConfigurator'
+    calls for every motor at once (see 'MotorConfigurator.configureAll()')
     '''
-    def __init__(self, 
+    def __init__(self,
                 channel: int,
-                smartCurrentLimit: int,
-                brushless = True,
-                restoreFactoryDefaults = True, 
-                setInverted = True, 
-                idleMode = rev.CANSparkMax.IdleMode.kBrake):
-        
-        self.motor = rev.CANSparkMax(channel,
-            rev.CANSparkMax.MotorType.kBrushless if brushless else rev.CANSparkMax.MotorType.kBrushed
-        )
-
-        # Configure motor
-        self.motor.restoreFactoryDefaults(restoreFactoryDefaults) # Resets the motor to factory settings
-        self.motor.setInverted(setInverted) # Invert the motor
-        self.motor.setIdleMode(idleMode) # Sets the idle mode of the motor to brake (Motor brakes when not doing anything)
-        self.motor.setSmartCurrentLimit(smartCurrentLimit) # Sets current limit for the motor
-
-        # Encoder(s) which can be set to CANSparkMax
-        self.relativeEncoder = None
-        self.alternateEncoder = None
-
-        # Controller(s) which can be set to CANSparkMax
-        self.PIDController = None
-
-    def setRelativeEncoder(self, positionConversionFactor: float, velocityConversionFactor: float):
-        '''
-        Configures and sets up a relative encoder to the motor
-        '''
-        self.relativeEncoder = self.motor.getEncoder()
+                config: SparkMaxConfig,
+                brushless = True):
 
-        # Configure relative encoder conversion factor (Velocity values for the external turn encoder and the built in drive encoder)
-        self.relativeEncoder.setPositionConversionFactor(positionConversionFactor)
-        self.relativeEncoder.setVelocityConversionFactor(velocityConversionFactor)
+        hardware = backend.get()
+        self.name = f'CANSparkMax {channel}'
+        self.config = config
+        self.motor = hardware.createSparkMax(channel, brushless)
 
-    def setPIDController(self, P: float, I: float, D: float, FF: float, outputRange: float):
-        '''
-        Configures and sets up a PID controller to the motor
+        # Encoder and PID controller of the motor (getting them does not talk to the device)
+        self.relativeEncoder = self.motor.getEncoder()
+        self.PIDController = self.motor.getPIDController()
+
+        # Status frames the code reads from this motor, and the frames they add to the CAN bus
+        statusFramePeriods = sparkMaxPeriods(config.role, robotconfig.get().odometry.frequency)
+        busLoad.add(self.name, config.role, sparkMaxFrameRate(statusFramePeriods, config.role))
+
+        # Values of every setting in 'SPARK_MAX_SETTINGS' (None leaves a setting as it is)
+        P, I, D, FF = config.PID
+        self.settings = {
+            'inverted': config.inverted,
+            'idleMode': hardware.idleMode(brake=config.brake),
+            'smartCurrentLimit': config.smartCurrentLimit,
+            'statusFramePeriods': statusFramePeriods if config.role is not None else None,
+            'feedbackDevice': self.relativeEncoder,
+            'positionConversionFactor': float(config.positionConversionFactor),
+            'velocityConversionFactor': float(config.velocityConversionFactor),
+            'P': float(P), 'I': float(I), 'D': float(D), 'FF': float(FF),
+            'outputRange': tuple(float(limit) for limit in config.outputRange)
+        }
+
+        motorConfigurator.add(self.name, self.configure)
+
+    def configure(self, burnFlash: bool = False):
         '''
-        if self.relativeEncoder == None:
-            errorMsg('Cannot create PID controller without a relative encoder being set',None)
+        Reads every setting back from the motor and writes only the ones that differ. Returns the names of the changed settings
 
-        self.PIDController = self.motor.getPIDController()
-        self.PIDController.setFeedbackDevice(self.relativeEncoder)
+        With 'burnFlash' the configuration is saved on the motor when something changed, so the next start has nothing to write
+        '''
+        changed = []
+        for name, read, write in SPARK_MAX_SETTINGS:
+            value = self.settings[name]
+            if value is None:
+                continue
+            if read is None:
+                write(self, value) # Cannot be compared
+            elif not _matches(read(self), value):
+                write(self, value)
+                changed.append(name)
+
+        if changed and burnFlash:
+            self.motor.burnFlash()
+        return changed
+
+class TalonFXConfig:
+    '''
+    # TalonFXConfig
+    Everything configured on a TalonFX (Kraken)
+    '''
+    __slots__ = ('brake', 'enableStatorCurrentLimit', 'statorCurrentLimit', 'KP', 'KI', 'KD', 'KV', 'role')
 
-        self.PIDController.setP(P)
-        self.PIDController.setI(I)
-        self.PIDController.setD(D)
-        self.PIDController.setFF(FF)
-        self.PIDController.setOutputRange(outputRange[0], outputRange[1])
+    def __init__(self,
+                brake = False, # Neutral mode (coast by default)
+                enableStatorCurrentLimit = True,
+                statorCurrentLimit = 25.0,
+                KP = 0.0,
+                KI = 0.0,
+                KD = 0.0,
+                KV = 0.0,
+                role = None): # Status signal profile ('drive', 'turn', 'leader', 'follower', see 'hardware/canbus.py'), None keeps the defaults
+        self.brake = brake
+        self.enableStatorCurrentLimit = enableStatorCurrentLimit
+        self.statorCurrentLimit = float(statorCurrentLimit)
+        self.KP = float(KP)
+        self.KI = float(KI)
+        self.KD = float(KD)
+        self.KV = float(KV)
+        self.role = role
 
 class KrakenMotor:
     '''
     # KrakenMotor
     Class for configuring and setting up a Kraken motor
+
+    Configured like a 'CANSparkMax' (by 'motorConfigurator'). The TalonFX reports its whole configuration in one read
+    and takes the changes in a single apply, which it always saves to flash
     '''
     def __init__(self,
         channel: int,
         canbus = '',
-        velocity = 0,
-        neutralMode = phoenix6.signals.NeutralModeValue.COAST,
-        enableStatorCurrentLimit = True,
-        statorCurrentLimit = 25.0,
-        KP = 0,
-        KI = 0,
-        KD = 0,
-        KV = 0,
+        config: TalonFXConfig = None,
         velocityWithSlot = 0,
         velocityWithEnableFOC = False):
 
+        hardware = backend.get()
+        self.name = f'TalonFX {channel}'
+        self.config = config or TalonFXConfig()
+
         # Initialize the motor with the channel and canbus
-        self.motor = phoenix6.hardware.TalonFX(channel, canbus)
+        self.motor = hardware.createTalonFX(channel, canbus)
 
         # Initialize the velocity duty cycle
-        self.velocity = phoenix6.controls.VelocityDutyCycle(0)
+        self.velocity = hardware.velocityRequest(velocityWithSlot, velocityWithEnableFOC)
 
-        # Initialize the configurators of the Kraken motor
-        self.outputConfig = phoenix6.configs.MotorOutputConfigs()
-        self.limitConfig = phoenix6.configs.CurrentLimitsConfigs()
-        self.slot0Config = phoenix6.configs.Slot0Configs()
+        # Status signals the code reads from this motor (None keeps the phoenix6 defaults, counted as the 'leader' profile)
+        self.signalRates = phoenixRates(self.config.role, robotconfig.get().odometry.frequency) if self.config.role is not None else None
+        busLoad.add(self.name, self.config.role, phoenixFrameRate(self.signalRates or phoenixRates('leader', 0.0), self.config.role))
 
-        # Configure Kraken settings
-        self.outputConfig.with_neutral_mode(neutralMode)
+        motorConfigurator.add(self.name, self.configure)
+
+    def configure(self, burnFlash: bool = False):
+        '''
+        Applies the settings that differ from the motor's configuration. Returns the names of the changed settings
+        '''
+        hardware = backend.get()
+        changed = hardware.configureTalonFX(self.motor, self.config)
+        if self.signalRates is not None:
+            hardware.setSignalRates(self.motor, self.signalRates) # Signal rates are not part of the saved configuration
+        return changed
 
-        self.limitConfig.with_supply_current_limit_enable(enableStatorCurrentLimit)
-        self.limitConfig.with_stator_current_limit(statorCurrentLimit)
+    def linkTo(self, masterChannel: int, opposeMasterDirection: bool):
+        '''
+        Sets the controlls of the motor equal to the controlls of another Kraken motor
+        '''
+        self.motor.set_control(backend.get().followerRequest(masterChannel, opposeMasterDirection))
 
-        # Configure Kraken PID values
-        self.slot0Config.with_k_p(KP)
-        self.slot0Config.with_k_i(KI)
-        self.slot0Config.with_k_d(KD)
-        self.slot0Config.with_k_v(KV)
+class MotorConfigurator:
+    '''
+    # MotorConfigurator
+    Collects the motors created since the last 'configureAll()' and configures them together
 
-        # Apply the configurators to the Kraken
-        self.motor.configurator.apply(self.outputConfig)
-        self.motor.configurator.apply(self.limitConfig)
-        self.motor.configurator.apply(self.slot0Config)
+    Each motor is configured on its own worker thread, so the CAN round trips of different devices overlap instead of
+    adding up. A motor that cannot be configured is reported and skipped (its health is tracked like any other device)
+    '''
+    def __init__(self):
+        self.pending = [] # (name, configure function)
 
-        self.velocity.with_slot(velocityWithSlot)
-        self.velocity.with_enable_foc(velocityWithEnableFOC)
+    def add(self, name: str, configure):
+        self.pending.append((name, configure))
 
-    def linkTo(self, masterChannel: int, opposeMasterDirection: bool):
+    def configureAll(self, burnFlash: bool = False, parallelDevices: int = 8):
         '''
-        Sets the controlls of the motor equal to the controlls of another Kraken motor
+        Configures every pending motor and waits for them. Returns the number of settings that were changed
         '''
-        self.motor.set_control(phoenix6.controls.Follower(masterChannel, opposeMasterDirection))
\ No newline at end of file
+        pending, self.pending = self.pending, []
+        if not pending:
+            return 0
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelDevices, len(pending))), thread_name_prefix='MotorConfig') as pool:
+            futures = [(name, pool.submit(configure, burnFlash)) for name, configure in pending]
+
+        changedSettings = 0
+        failed = 0
+        for name, future in futures:
+            try:
+                changed = future.result()
+            except Exception as e:
+                failed += 1
+                warningMsg(f'Could not configure {name}: {e}')
+                continue
+
+            if changed:
+                changedSettings += len(changed)
+                debugMsg(f'{name}: updated {", ".join(changed)}')
+
+        elapsed = (perf_counter() - start) * 1000.0
+        debugMsg(f'Configured {len(pending) - failed}/{len(pending)} devices in {elapsed:.1f} ms ({changedSettings} settings changed)')
+        return changedSettings
+
+# Shared configurator used by every motor
+motorConfigurator = MotorConfigurator()
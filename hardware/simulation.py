@@ -0,0 +1,520 @@
+# Simulated stand-ins for the robot hardware, used to run the robot loop off-robot (see 'hardware/backend.py')
+# Every device is stepped on a deterministic fixed-step clock, so the loop can run much faster than real time
+import math
+
+from wpimath.geometry import Rotation2d
+
+from extras.debugmsgs import *
+from config import robotconfig
+
+class SimClock:
+    '''
+    # SimClock
+    Fixed-step clock that replaces the FPGA timer while simulating
+    '''
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def advance(self, seconds: float):
+        self.time += seconds
+
+class SimStatusSignal:
+    '''
+    # SimStatusSignal
+    Stand-in for a phoenix6 StatusSignal. 'value_as_double' is updated by the owning device
+    '''
+    __slots__ = ('value_as_double', 'timestamp', 'ok')
+
+    def __init__(self, value: float = 0.0):
+        self.value_as_double = value
+        self.timestamp = 0.0
+        self.ok = True # False while the owning device is disconnected
+
+    @property
+    def value(self):
+        return self.value_as_double
+
+    def refresh(self):
+        return self
+
+class SimEncoder:
+    '''
+    # SimEncoder
+    Stand-in for the relative encoder of a CANSparkMax. Positions/velocities are reported in converted units
+    '''
+    def __init__(self):
+        self.position = 0.0
+        self.velocity = 0.0
+        self.positionConversionFactor = 1.0
+        self.velocityConversionFactor = 1.0
+
+    def getPosition(self):
+        return self.position
+
+    def getVelocity(self):
+        return self.velocity
+
+    def setPosition(self, position: float):
+        self.position = position
+
+    def setPositionConversionFactor(self, factor: float):
+        self.positionConversionFactor = factor
+
+    def setVelocityConversionFactor(self, factor: float):
+        self.velocityConversionFactor = factor
+
+    def getPositionConversionFactor(self):
+        return self.positionConversionFactor
+
+    def getVelocityConversionFactor(self):
+        return self.velocityConversionFactor
+
+class SimPIDController:
+    '''
+    # SimPIDController
+    Stand-in for the PID controller of a CANSparkMax. Stores the gains and the last reference
+    '''
+    def __init__(self):
+        self.P = self.I = self.D = self.FF = 0.0
+        self.outputMin = -1.0
+        self.outputMax = 1.0
+        self.feedbackDevice = None
+        self.reference = 0.0
+        self.controlType = None
+
+    def setFeedbackDevice(self, device):
+        self.feedbackDevice = device
+
+    def setP(self, value: float):
+        self.P = value
+
+    def setI(self, value: float):
+        self.I = value
+
+    def setD(self, value: float):
+        self.D = value
+
+    def setFF(self, value: float):
+        self.FF = value
+
+    def setOutputRange(self, minimum: float, maximum: float):
+        self.outputMin = minimum
+        self.outputMax = maximum
+
+    def getP(self):
+        return self.P
+
+    def getI(self):
+        return self.I
+
+    def getD(self):
+        return self.D
+
+    def getFF(self):
+        return self.FF
+
+    def getOutputMin(self):
+        return self.outputMin
+
+    def getOutputMax(self):
+        return self.outputMax
+
+    def setReference(self, value: float, controlType):
+        self.reference = value
+        self.controlType = controlType
+
+class SimSparkMax:
+    '''
+    # SimSparkMax
+    Stand-in for a rev.CANSparkMax with a first-order model of the motor responding to its PID reference
+
+    'freeSpeed' is in motor rotations per minute, 'timeConstant' in seconds
+    '''
+    def __init__(self, channel: int, freeSpeed: float = 5676.0, timeConstant: float = 0.05):
+        self.channel = channel
+        self.freeSpeed = freeSpeed
+        self.timeConstant = timeConstant
+
+        self.connected = True
+        self.inverted = False
+        self.idleMode = SimBackend.IDLE_BRAKE
+        self.smartCurrentLimit = 0
+        self.output = 0.0 # Duty cycle set with 'set()'
+
+        self.encoder = SimEncoder()
+        self.pidController = SimPIDController()
+        self.flashBurns = 0
+
+    def restoreFactoryDefaults(self, persist: bool = False):
+        self.__init__(self.channel, self.freeSpeed, self.timeConstant)
+
+    def setInverted(self, inverted: bool):
+        self.inverted = inverted
+
+    def getInverted(self):
+        return self.inverted
+
+    def setIdleMode(self, idleMode):
+        self.idleMode = idleMode
+
+    def getIdleMode(self):
+        return self.idleMode
+
+    def setSmartCurrentLimit(self, limit: int):
+        self.smartCurrentLimit = limit
+
+    def burnFlash(self):
+        self.flashBurns += 1
+
+    def set(self, output: float):
+        self.output = output
+        self.pidController.controlType = None
+
+    def getEncoder(self):
+        return self.encoder
+
+    def getPIDController(self):
+        return self.pidController
+
+    def step(self, dt: float):
+        '''
+        Advances the motor by 'dt' seconds and returns how far the encoder moved (converted units)
+        '''
+        encoder = self.encoder
+        pidController = self.pidController
+        maxVelocity = self.freeSpeed * encoder.velocityConversionFactor # Converted units per second
+        response = 1.0 - math.exp(-dt / self.timeConstant)
+
+        if not self.connected:
+            # Without CAN frames the motor controller times out and stops driving the motor
+            encoder.velocity -= encoder.velocity * response
+            delta = encoder.velocity * dt
+        elif pidController.controlType == SimBackend.CONTROL_POSITION:
+            # Position control: close a fraction of the remaining error each step, limited by the free speed
+            delta = (pidController.reference - encoder.position) * response
+            limit = abs(maxVelocity) * dt
+            delta = max(-limit, min(limit, delta))
+            encoder.velocity = delta / dt
+        else:
+            if pidController.controlType == SimBackend.CONTROL_VELOCITY:
+                target = pidController.reference
+            else:
+                target = self.output * maxVelocity
+
+            target = max(-abs(maxVelocity), min(abs(maxVelocity), target))
+            encoder.velocity += (target - encoder.velocity) * response
+            delta = encoder.velocity * dt
+
+        encoder.position += delta
+        return delta
+
+class SimCANcoder:
+    '''
+    # SimCANcoder
+    Stand-in for a phoenix6 CANcoder. Reports the absolute position of a mechanism in rotations (-0.5 to 0.5)
+    '''
+    def __init__(self, channel: int):
+        self.channel = channel
+        self.rotations = 0.0 # Unwrapped mechanism position
+        self.absolutePosition = SimStatusSignal()
+
+    def get_absolute_position(self):
+        return self.absolutePosition
+
+    def setConnected(self, connected: bool):
+        self.absolutePosition.ok = connected
+
+    def setRotations(self, rotations: float, timestamp: float):
+        self.rotations = rotations
+        if not self.absolutePosition.ok:
+            return # Disconnected, the signal keeps its last value
+        self.absolutePosition.value_as_double = rotations - math.floor(rotations + 0.5)
+        self.absolutePosition.timestamp = timestamp
+
+class SimGyro:
+    '''
+    # SimGyro
+    Stand-in for the navX. Yaw is integrated from the simulated chassis rotation (counter-clockwise positive)
+    '''
+    def __init__(self):
+        self.angle = 0.0 # Radians, counter-clockwise positive
+        self.offset = 0.0
+        self.connected = True
+
+    def isConnected(self):
+        return self.connected
+
+    def zeroYaw(self):
+        self.offset = self.angle
+
+    def getRotation2d(self):
+        return Rotation2d(self.angle - self.offset)
+
+    def getAngle(self):
+        return -math.degrees(self.angle - self.offset) # navX reports clockwise positive degrees
+
+    def getYaw(self):
+        return math.remainder(self.getAngle(), 360.0)
+
+class SimTalonFX:
+    '''
+    # SimTalonFX
+    Stand-in for a phoenix6 TalonFX. Records the applied configuration and control request
+    '''
+    def __init__(self, channel: int, canbus: str = ''):
+        self.channel = channel
+        self.canbus = canbus
+        self.configuration = {}
+        self.applies = 0 # Configuration transactions
+        self.control = None
+
+    def set_control(self, request):
+        self.control = request
+
+class SimSwerveModule:
+    '''
+    # SimSwerveModule
+    Links the simulated drive motor, turn motor and absolute encoder of a swerve module
+
+    The turn mechanism follows the turn encoder (its conversion factor is treated as radians of the module)
+    '''
+    def __init__(self, moduleConfig, drive: SimSparkMax, turn: SimSparkMax, encoder: SimCANcoder):
+        self.location = moduleConfig.location
+        self.drive = drive
+        self.turn = turn
+        self.encoder = encoder
+        self.angle = 0.0 # Module angle in radians
+
+    def step(self, dt: float, timestamp: float):
+        self.drive.step(dt)
+        self.angle += self.turn.step(dt)
+        self.encoder.setRotations(self.angle / (2.0 * math.pi), timestamp)
+
+    def getVelocity(self):
+        '''
+        Returns the (x, y) velocity of the module in drive encoder units per second
+        '''
+        speed = self.drive.encoder.velocity
+        return speed * math.cos(self.angle), speed * math.sin(self.angle)
+
+class SimBackend:
+    '''
+    # SimBackend
+    Creates simulated devices instead of real ones. Devices that belong to a swerve module in 'constants.json'
+    are linked through a 'SimSwerveModule', and the gyro follows the rotation of the simulated chassis
+
+    Call 'step()' once per loop to advance the clock and every device
+    '''
+    name = 'sim'
+
+    IDLE_BRAKE = 'brake'
+    IDLE_COAST = 'coast'
+    CONTROL_VELOCITY = 'kVelocity'
+    CONTROL_POSITION = 'kPosition'
+
+    def __init__(self, config = None):
+        config = config or robotconfig.get()
+        self.clock = SimClock()
+
+        self.sparkMaxes = {}
+        self.cancoders = {}
+        self.talonFXs = {}
+        self.gyro = SimGyro()
+
+        # Build the devices of every swerve module up front so they can be linked together
+        self.modules = []
+        for moduleConfig in config.modules:
+            drive = self.sparkMaxes[moduleConfig.driveMotorId] = SimSparkMax(moduleConfig.driveMotorId)
+            turn = self.sparkMaxes[moduleConfig.turnMotorId] = SimSparkMax(moduleConfig.turnMotorId)
+            encoder = self.cancoders[moduleConfig.encoderId] = SimCANcoder(moduleConfig.encoderId)
+            self.modules.append(SimSwerveModule(moduleConfig, drive, turn, encoder))
+
+        self.moduleMotors = set(id(motor) for module in self.modules for motor in (module.drive, module.turn))
+
+        # Precompute the sum of squared module distances used to find the chassis rotation
+        self.radiusSquaredSum = sum(module.location[0] ** 2 + module.location[1] ** 2 for module in self.modules) or 1.0
+
+    def createSparkMax(self, channel: int, brushless: bool):
+        if channel not in self.sparkMaxes:
+            self.sparkMaxes[channel] = SimSparkMax(channel)
+        return self.sparkMaxes[channel]
+
+    def createCANcoder(self, channel: int, canbus: str = ''):
+        if channel not in self.cancoders:
+            self.cancoders[channel] = SimCANcoder(channel)
+        return self.cancoders[channel]
+
+    def createTalonFX(self, channel: int, canbus: str = ''):
+        if channel not in self.talonFXs:
+            self.talonFXs[channel] = SimTalonFX(channel, canbus)
+        return self.talonFXs[channel]
+
+    def createGyro(self, updateRate: int = None):
+        return self.gyro # Always up to date
+
+    def refreshSignals(self, signals: tuple):
+        pass # Simulated signals are always up to date
+
+    def signalCheck(self, signal):
+        return lambda: signal.ok
+
+    def sparkMaxCheck(self, motor):
+        return lambda: motor.connected
+
+    def gyroCheck(self, gyro):
+        return gyro.isConnected
+
+    def setConnected(self, kind: str, channel: int, connected: bool):
+        '''
+        Disconnects/reconnects a simulated device to test fault handling ('kind' is 'sparkMax', 'cancoder' or 'gyro')
+        '''
+        if kind == 'sparkMax':
+            self.sparkMaxes[channel].connected = connected
+        elif kind == 'cancoder':
+            self.cancoders[channel].setConnected(connected)
+        elif kind == 'gyro':
+            self.gyro.connected = connected
+        else:
+            errorMsg(f"Unknown simulated device kind '{kind}'", None)
+        debugMsg(f"Simulated {kind} {channel} {'connected' if connected else 'disconnected'}")
+
+    def getTimestamp(self):
+        return self.clock.time
+
+    def idleMode(self, brake: bool):
+        return self.IDLE_BRAKE if brake else self.IDLE_COAST
+
+    def controlType(self, name: str):
+        return name
+
+    def configureTalonFX(self, motor, config):
+        changed = [name for name in config.__slots__ if name != 'role' and motor.configuration.get(name) != getattr(config, name)]
+        if changed:
+            motor.configuration = {name: getattr(config, name) for name in config.__slots__}
+            motor.applies += 1
+        return changed
+
+    def setStatusFramePeriods(self, motor, periods: tuple):
+        motor.statusFramePeriods = tuple(periods)
+
+    def setSignalRates(self, device, rates: dict):
+        device.signalRates = dict(rates)
+
+    def velocityRequest(self, slot: int, enableFOC: bool):
+        return ('velocity', slot, enableFOC)
+
+    def followerRequest(self, masterChannel: int, opposeMasterDirection: bool):
+        return ('follower', masterChannel, opposeMasterDirection)
+
+    def step(self, dt: float):
+        '''
+        Advances the clock and every simulated device by 'dt' seconds
+        '''
+        self.clock.advance(dt)
+        timestamp = self.clock.time
+
+        # Step the modules and find the chassis rotation from the tangential part of each module velocity
+        angularMomentum = 0.0
+        for module in self.modules:
+            module.step(dt, timestamp)
+            vx, vy = module.getVelocity()
+            angularMomentum += module.location[0] * vy - module.location[1] * vx
+
+        self.gyro.angle += angularMomentum / self.radiusSquaredSum * dt
+
+        # Step every motor that is not part of a swerve module
+        for motor in self.sparkMaxes.values():
+            if id(motor) not in self.moduleMotors:
+                motor.step(dt)
+
+class SimRunner:
+    '''
+    # SimRunner
+    Steps a robot through its modes on the simulated clock, as fast as the code allows
+
+    Example:
+        backend.use(SimBackend())
+        runner = SimRunner(terrance())
+        runner.run('autonomous', 15.0)
+    '''
+    MODES = ('disabled', 'autonomous', 'teleop', 'test')
+
+    def __init__(self, robot, simBackend: SimBackend = None, period: float = None):
+        from hardware import backend
+        self.robot = robot
+        self.backend = simBackend or backend.get()
+        self.period = period or robot.getPeriod()
+        self.mode = None
+        self.ticks = 0
+
+        if not isinstance(self.backend, SimBackend):
+            errorMsg('SimRunner needs the simulated hardware backend (ROBOT_HARDWARE_BACKEND=sim)', None)
+
+        # Use the same fixed step for wpilib's own clock (slew rate limiters, timers, etc.) if it is available
+        try:
+            import wpilib.simulation
+            self.wpilibSim = wpilib.simulation
+            self.wpilibSim.pauseTiming()
+        except ImportError:
+            self.wpilibSim = None
+
+        self.robot.robotInit()
+
+        # The odometry notifier runs on real time, at any point of a step. Its updates are run here instead, between
+        # equal parts of every step, so a run gives the same result every time
+        drivetrain = getattr(self.robot, 'drivetrain', None)
+        self.odometrySteps = 1
+        if drivetrain is not None and drivetrain.odometryThread is not None:
+            drivetrain.odometryThread.stop()
+            self.odometrySteps = max(1, int(round(self.period / drivetrain.odometryThread.period)))
+
+        self.setMode('disabled')
+
+    def setMode(self, mode: str):
+        '''
+        Switches mode, calling the '...Exit()' method of the old mode and the '...Init()' method of the new one
+        '''
+        if mode not in self.MODES:
+            errorMsg(f"Unknown mode '{mode}'", None)
+        if mode == self.mode:
+            return
+
+        if self.mode is not None:
+            getattr(self.robot, self.mode + 'Exit')()
+
+        if self.wpilibSim is not None:
+            self.wpilibSim.DriverStationSim.setEnabled(mode != 'disabled')
+            self.wpilibSim.DriverStationSim.setAutonomous(mode == 'autonomous')
+            self.wpilibSim.DriverStationSim.setTest(mode == 'test')
+            self.wpilibSim.DriverStationSim.notifyNewData()
+
+        self.mode = mode
+        getattr(self.robot, mode + 'Init')()
+
+    def step(self):
+        '''
+        Runs one loop of the robot (mode periodic, then robot periodic) and advances the simulation by one period
+        '''
+        getattr(self.robot, self.mode + 'Periodic')()
+        self.robot.robotPeriodic()
+
+        # With the odometry thread, the step is split in the updates it would have made (see '__init__()')
+        drivetrain = getattr(self.robot, 'drivetrain', None)
+        odometryThread = drivetrain.odometryThread if drivetrain is not None else None
+        steps = self.odometrySteps if odometryThread is not None else 1
+        dt = self.period / steps
+        for _ in range(steps):
+            self.backend.step(dt)
+            if self.wpilibSim is not None:
+                self.wpilibSim.stepTimingAsync(dt) # Does not wait for notifiers (the TimedRobot loop is not running)
+            if odometryThread is not None:
+                odometryThread.run()
+        self.ticks += 1
+
+    def run(self, mode: str, seconds: float):
+        '''
+        Runs the robot in a mode for a number of simulated seconds
+        '''
+        self.setMode(mode)
+        for _ in range(int(round(seconds / self.period))):
+            self.step()
@@ -1,31 +1,130 @@
-import limelight, limelightresults
+# Reads Limelight results on a background thread so the robot loop never waits on the network or json parsing
+import threading
 
 from extras.debugmsgs import *
+from hardware import backend
+
+class VisionFrame:
+    '''
+    # VisionFrame
+    The fields of a Limelight result that the robot uses. Frames are never modified after they are published
+    '''
+    __slots__ = (
+        'sequence', # Increases by one for every published frame
+        'captureTimestamp', # Robot time (seconds) the image was captured at
+        'latency', # Capture + targeting latency (seconds)
+        'pipelineId',
+        'fiducialIds', # Tuple of the AprilTag ids in view
+        'robotPose' # (x, y, z, roll, pitch, yaw) in the blue alliance field frame (meters/degrees), None if no pose was found
+    )
+
+    def __init__(self, sequence: int, captureTimestamp: float, latency: float, pipelineId: int, fiducialIds: tuple, robotPose: tuple):
+        self.sequence = sequence
+        self.captureTimestamp = captureTimestamp
+        self.latency = latency
+        self.pipelineId = pipelineId
+        self.fiducialIds = fiducialIds
+        self.robotPose = robotPose
+
+def parseResults(results: dict, sequence: int, receiveTimestamp: float):
+    '''
+    Builds a 'VisionFrame' from the json results of a Limelight (returns None if there is nothing to publish)
+    '''
+    if not results:
+        return None
+    results = results.get('Results', results) # Some firmware versions nest everything under 'Results'
+
+    latency = (results.get('cl', 0.0) + results.get('tl', 0.0)) / 1000.0
+    fiducialIds = tuple(fiducial.get('fID') for fiducial in results.get('Fiducial', ()))
+
+    botpose = results.get('botpose_wpiblue')
+    robotPose = tuple(botpose[:6]) if results.get('v') and fiducialIds and botpose and len(botpose) >= 6 else None
+
+    return VisionFrame(sequence, receiveTimestamp - latency, latency, results.get('pID', 0), fiducialIds, robotPose)
 
 class LimelightCamera:
     '''
     # LimelightCamera
 
     Controlls a Limelight camera
+
+    Discovery and result parsing happen on a background thread. The newest frame is published to a single slot,
+    so 'getLatest()' never blocks. If no address is given, the first discovered Limelight is used
+
+    'client' replaces the camera with any object that has the 'get_latest_results()' method of 'limelight.Limelight'
+    (the 'FakeLimelight' of 'extras/visioncheck.py'), nothing is discovered then
     '''
-    def __init__(self, id: int):
-        # Search for limelights
-        discovered_limelights = limelight.discover_limelights()
-        debugMsg(f'Discovered Limelights: {discovered_limelights}')
-
-        if discovered_limelights: # 'limelight.discover_limelights()' probably returns "None" if no limelights are discovered
-            limelight_address = discovered_limelights[0] # Get the address of the first discovered limelight
-            self.limelight = limelight.Limelight(limelight_address) # Construct a new limelight object given the address
-
-            limelight.enable_websocket() # Enable websocket in a new thread for optmized performance
-            while True:
-                result = limelight.get_latest_results()
-
-                parsed_result = limelightresults.parse_results(result)
-                if parsed_result is not None:
-                    print(parsed_result.pipeline_id)
-                    print(parsed_result.parse_latency)
-
-                    # Accessing arrays
-                    for tag in parsed_result.fiducialResults:
-                        print(tag.robot_pose_target_space, tag.fiducial_id) 
\ No newline at end of file
+    def __init__(self, address: str = None, pollPeriod: float = 0.01, discoveryPeriod: float = 2.0, client=None):
+        self.address = address
+        self.pollPeriod = pollPeriod # Seconds between checks for a new result
+        self.discoveryPeriod = discoveryPeriod # Seconds between discovery attempts
+
+        self.limelight = client
+        self.frames = 0 # Number of frames published
+        self.errors = 0 # Number of failed reads
+
+        self._latest = None # Single slot: replaced (never modified) by the ingest thread
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='LimelightIngest', daemon=True)
+        self._thread.start()
+
+    def getLatest(self):
+        '''
+        Returns the newest 'VisionFrame' (or None if no frame has arrived yet)
+        '''
+        return self._latest
+
+    def stop(self):
+        '''
+        Stops the ingest thread
+        '''
+        self._stop.set()
+        self._thread.join(1.0)
+
+    def _connect(self):
+        import limelight
+
+        address = self.address
+        if not address:
+            # Search for limelights
+            discovered_limelights = limelight.discover_limelights()
+            debugMsg(f'Discovered Limelights: {discovered_limelights}')
+
+            if not discovered_limelights: # 'limelight.discover_limelights()' probably returns "None" if no limelights are discovered
+                return False
+            address = discovered_limelights[0] # Get the address of the first discovered limelight
+
+        self.limelight = limelight.Limelight(address) # Construct a new limelight object given the address
+        self.limelight.enable_websocket() # Results are pushed to us through a websocket
+        successMsg(f'Connected to Limelight at {address}')
+        return True
+
+    def _run(self):
+        while self.limelight is None and not self._stop.is_set():
+            try:
+                if self._connect():
+                    break
+            except Exception as e:
+                debugMsg(f'Could not connect to Limelight: {e}')
+            self._stop.wait(self.discoveryPeriod)
+
+        lastTimestamp = None
+        while not self._stop.wait(self.pollPeriod):
+            try:
+                results = self.limelight.get_latest_results()
+            except Exception:
+                self.errors += 1
+                continue
+
+            if not results:
+                continue
+            results = results.get('Results', results)
+
+            if results.get('ts') == lastTimestamp:
+                continue # Nothing new since the last check
+            lastTimestamp = results.get('ts')
+
+            frame = parseResults(results, self.frames + 1, backend.get().getTimestamp())
+            if frame is not None:
+                self.frames += 1
+                self._latest = frame
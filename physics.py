@@ -0,0 +1,18 @@
+# Steps the simulated hardware while running 'robotpy sim' with ROBOT_HARDWARE_BACKEND=sim
+# (for deterministic, faster than real time runs use 'hardware.simulation.SimRunner' instead)
+from hardware import backend
+from hardware.simulation import SimBackend
+
+class PhysicsEngine:
+    '''
+    # PhysicsEngine
+    Called by the robotpy simulator every time the simulation advances
+    '''
+    def __init__(self, physics_controller, robot):
+        self.physics_controller = physics_controller
+        self.robot = robot
+
+    def update_sim(self, now: float, tm_diff: float):
+        hardware = backend.get()
+        if isinstance(hardware, SimBackend):
+            hardware.step(tm_diff)
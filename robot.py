@@ -1,78 +1,229 @@
+from extras.startup import startup # Boot timing, started before anything else is imported
+startup.begin()
+
 from extras.debugmsgs import * # Formatted messages used for debugging
+from extras.profiler import profiler # Opt-in loop timing
+from extras.logger import logger, LEVELS # Log file written on a background thread
+from extras.telemetry import telemetry # Dashboard values over NetworkTables, sent once per tick
+from extras.worker import worker # Background jobs that do not have to finish within a tick
+from extras.allocations import AllocationWatch # Warns when memory is kept every tick
 
 from components.drivetrain import Drivetrain
 from components.controller import XboxController
+from components.scheduler import Scheduler, HIGH
+from hardware.vision import LimelightCamera
 
-from pathplannerlib.auto import NamedCommands
-from autonomous.autonomous import PPL
+import commands2
+from autonomous.autonomous import PPL, SDRbt
 
-from wpilib import TimedRobot
+from wpilib import TimedRobot, RobotBase
+from wpimath.geometry import Pose2d, Rotation2d
 
-# Load constants from the json file
-import json
-with open('constants.json') as jsonf:
-	constants = json.load(jsonf)
-	jsonf.close()
+from config import robotconfig
+from hardware import backend
+from hardware.health import health # Status of every device
+from hardware.canbus import busLoad # Expected CAN bus load of every device
+import atexit
 
 # Create the robot class (his name is terrance)
 class terrance(TimedRobot):
     def robotInit(self):
+        # Start logging first so every message from initialization ends up in the log file
+        with startup.stage('Logger'):
+            logging = robotconfig.get().logging
+            if logging.enabled:
+                logger.start(
+                    logging.directory or ('logs' if RobotBase.isSimulation() else '/home/lvuser/logs'),
+                    logging.bufferSize,
+                    logging.flushPeriod,
+                    logging.rateLimit,
+                    LEVELS[logging.level],
+                    logging.console,
+                    backend.get().getTimestamp, # Same clock as the sensor timestamps
+                    logging.maxFileSize,
+                    logging.minFreeSpace,
+                    logging.maxFiles
+                )
+                atexit.register(logger.stop) # Write what is left in the buffer when the robot code exits
+
+        # Components create their telemetry topics as they are constructed, publishers exist once this is started
+        with startup.stage('Telemetry'):
+            telemetryConfig = robotconfig.get().telemetry
+            if telemetryConfig.enabled:
+                telemetry.start(telemetryConfig.table, telemetryConfig.flushNetwork, self.getPeriod(), backend.get().getTimestamp)
+
+        # Slow work (file parsing, path generation, ...) is handed to the worker, 'robotPeriodic()' picks up the results
+        with startup.stage('Worker'):
+            workerConfig = robotconfig.get().worker
+            if workerConfig.enabled:
+                worker.start(workerConfig.threads, workerConfig.queueSize, workerConfig.latencyWindow)
+                atexit.register(worker.stop)
+
         # Robot initialization
-        self.drivetrain = Drivetrain()
+        healthConfig = robotconfig.get().health
+        health.configure(healthConfig.faultTimeout, healthConfig.recoveryReads)
+
+        with startup.stage('Drivetrain'):
+            self.drivetrain = Drivetrain()
         successMsg('Drivetrain initialized')
 
-        try:
-            self.controller = XboxController(self) # Link the xbox controller to the terrance class
-            successMsg('Xbox controller initialized')
-        except Exception as e:
-            errorMsg('Issue in initializing xbox controller:', e, __file__)
+        with startup.stage('Controllers'):
+            try:
+                self.controller = XboxController(self) # Link the xbox controller to the terrance class
+                self.auxController = XboxController(self, aux=True) # Second controller, only used for macros
+                successMsg('Xbox controllers initialized')
+            except Exception as e:
+                errorMsg('Issue in initializing xbox controller:', e, __file__)
+
+        # Commands (path following, etc.) run from the periodic methods within a time budget (see 'components/scheduler.py')
+        with startup.stage('Scheduler'):
+            scheduler = robotconfig.get().scheduler
+            self.scheduler = Scheduler(scheduler.budget, scheduler.maxDeferrals)
+            self.autonomousCommand = None
+
+            # Drive with the joystick whenever no other command needs the drivetrain (field relative in teleop only)
+            joystickCommand = commands2.RunCommand(lambda: self.driveWithJoystick(self.isTeleop()), self.drivetrain)
+            joystickCommand.setName('driveWithJoystick')
+            self.scheduler.setDefaultCommand(self.drivetrain, joystickCommand, HIGH)
 
-        self.PPL = PPL(self)
+        with startup.stage('Autonomous'):
+            self.PPL = PPL(self)
+            self.SDRbt = SDRbt(self) # Drives to field poses around obstacles
+
+        # Vision results are read on a background thread, 'robotPeriodic()' only picks up the newest frame
+        with startup.stage('Vision'):
+            vision = robotconfig.get().vision
+            self.camera = LimelightCamera(vision.address, vision.pollPeriod) if vision.enabled else None
+            self.visionFrame = None
+
+        # Record the inputs and motor references of every tick (replay them with 'python -m extras.replay <file>')
+        with startup.stage('Replay'):
+            replay = robotconfig.get().replay
+            self.recorder = None
+            if replay.record:
+                from extras.replay import ReplayRecorder # Only imported when recording, it is not needed to start otherwise
+                self.recorder = ReplayRecorder(
+                    self,
+                    replay.directory or ('replays' if RobotBase.isSimulation() else '/home/lvuser/replays'),
+                    replay.chunkTicks,
+                    replay.enabledOnly,
+                    replay.maxFileSize,
+                    replay.maxTotalSize,
+                    replay.maxFiles
+                )
+                atexit.register(self.recorder.stop)
 
         '''
         THIS IS TEMPORARY DONT HARASS ME ABOUT IT :3
 
+        from pathplannerlib.auto import NamedCommands
+
         try:
             # Register Named Commands
-            for command in constants["PATHPLANNER_CONSTANTS"]["AUTONOMOUS_COMMANDS"].keys():
+            for command in robotconfig.get().pathplanner.autonomousCommands.keys():
                 # Register's a command that runs an auton command based on the given string name of the function
                 NamedCommands.registerCommand(str(command), autonCommand(str(command)))
         except Exception as e:
             errorMsg('Could not register commands to PPL:',e,__file__)
         '''
 
+        # Expected CAN bus load of every device created above
+        canBus = robotconfig.get().canBus
+        busLoad.configure(canBus.bitrate)
+        busLoad.report(canBus.maxUtilization)
+
+        # Time the periodic loop if enabled in 'constants.json' (configured last so initialization is not counted as a loop)
+        diagnostics = robotconfig.get().diagnostics
+        profiler.configure(diagnostics.profilerEnabled, diagnostics.profilerWindow, diagnostics.overrunHistory, self.getPeriod())
+        self.allocationWatch = AllocationWatch(diagnostics.allocationRate) if diagnostics.allocationWatch else None
+
+        # Boot time (imports and each part of initialization), to catch slow new dependencies
+        startup.end()
+        if diagnostics.startupReport:
+            startup.report(diagnostics.startupImports)
+
+    @profiler.timed('robotPeriodic', endsLoop=True) # Last method called every loop
     def robotPeriodic(self):
         # TODO: Add proccesses that should always be running at all times here
-        pass
+        worker.poll() # Callbacks of the background jobs that finished since the last tick
+        self.controller.executeMacros()
+        self.auxController.executeMacros()
+
+        if self.camera is not None:
+            frame = self.camera.getLatest() # Newest frame, never waits on the camera
+
+            if frame is not None and frame is not self.visionFrame:
+                self.visionFrame = frame
+                if frame.robotPose is not None:
+                    # Fused at the time the image was captured, not the time it arrived
+                    self.drivetrain.addVisionMeasurement(
+                        Pose2d(frame.robotPose[0], frame.robotPose[1], Rotation2d.fromDegrees(frame.robotPose[5])),
+                        frame.captureTimestamp
+                    )
+
+        telemetry.flush() # Every value set during this tick, in one batch
+
+        if self.allocationWatch is not None:
+            self.allocationWatch.update(self.isEnabled())
+
+        if self.recorder is not None:
+            self.recorder.record() # Last, so the motor references of this tick are recorded
     
+    def disabledInit(self): # Called when the robot is disabled
+        self.scheduler.cancelAll(disabled=True) # Commands that should not run while disabled
+
+    @profiler.timed('disabledPeriodic')
     def disabledPeriodic(self):
         # TODO: Add functionality
-        pass
+        self.PPL.warmup() # Parse paths and generate trajectories while waiting for the match to start
 
     def autonomousInit(self): # Called at the begining of autonomous mode
         debugMsg('Entering autonomous mode') # Called only at the beginning of autonomous mode.
         self.controller.rumble(0.5) # Vibrate xbox controller to let driver know they are in auton mode
-        self.PPL.followPath('Example Path') # Run the autonomous command
+        self.autonomousCommand = self.PPL.followPath('Example Path')
+        self.scheduler.schedule(self.autonomousCommand, HIGH) # Run the autonomous command
 
+    @profiler.timed('autonomousPeriodic')
     def autonomousPeriodic(self): # Called every 20ms in autonomous mode.
-        self.driveWithJoystick(False) # Disable joystick controll in autonomous mode
+        self.drivetrain.refreshSensors() # Read every drivetrain sensor once for this tick
+        self.scheduler.run() # Follows the path (the joystick drives robot relative once it is done)
         self.drivetrain.updateOdometry()
 
     def autonomousExit(self): # Called when exiting autonomous mode
         debugMsg('Exiting autonomous mode')
+        profiler.report('Autonomous loop timing')
+        health.report()
+        telemetry.report()
+        self.scheduler.report()
+        worker.cancelAll(modeScoped=True) # Results of autonomous jobs are not wanted anymore
+        worker.report()
+        profiler.reset()
 
     def teleopInit(self): # Called only at the begining of teleop mode
         debugMsg('Entering tele-operated mode')
         self.controller.rumble(0.0) # Stop vibrating xbox controller to let driver know they are in teleop mode
+        if self.autonomousCommand is not None:
+            self.scheduler.cancel(self.autonomousCommand) # Give the drivetrain back to the joystick
 
+    @profiler.timed('teleopPeriodic')
     def teleopPeriodic(self): # Called every 20 milliseconds in teleop mode
-        self.driveWithJoystick(True) # Enable drive mode with joystick
+        self.drivetrain.refreshSensors() # Read every drivetrain sensor once for this tick
+        self.scheduler.run() # Drives with the joystick unless a command needs the drivetrain
+        self.drivetrain.updateOdometry()
 
     def teleopExit(self): # Called when exiting teleop mode
         debugMsg('Exiting tele-operated mode')
+        profiler.report('Teleop loop timing')
+        health.report()
+        telemetry.report()
+        self.scheduler.report()
+        worker.cancelAll(modeScoped=True)
+        worker.report()
+        profiler.reset()
 
+    @profiler.timed('driveWithJoystick')
     def driveWithJoystick(self, state: bool):  # Custom method to drive with joystick
-        self.controller.getSwerveValues()
+        self.controller.getSwerveValues(self.getPeriod())
         self.drivetrain.drive(self.controller.xSpeed, 
                               self.controller.ySpeed, 
                               self.controller.rot, 
@@ -89,8 +240,20 @@ class terrance(TimedRobot):
     def zeroGyro(self):
         self.drivetrain.zeroGyro()
 
-    def slowDownSwerve(self):
-        pass
+    def reloadConfig(self): # Re-reads 'constants.json' (useful for tuning in simulation)
+        # Parsed on the worker, applied on the robot loop by '_applyConfig()'
+        job = worker.submit(robotconfig.load, robotconfig.get().path, name='reloadConfig', onDone=self._applyConfig, modeScoped=False)
+        if job is None: # Worker not running (or busy)
+            robotconfig.reload()
+
+    def _applyConfig(self, job):
+        if job.error is not None:
+            debugMsg(f'Config reload failed, keeping current values: {job.error}')
+        else:
+            robotconfig.apply(job.result())
+
+    def slowDownSwerve(self): # Held on the left bumper for precise driving
+        self.controller.setSlowMode(True)
 
     def resetSwerveSpeed(self):
-        pass
\ No newline at end of file
+        self.controller.setSlowMode(False)
\ No newline at end of file